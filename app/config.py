@@ -12,3 +12,126 @@ INDEX_DIR = DATA_DIR / "index"
 
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+# ==== Embedding model ====
+EMBED_MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "paraphrase-multilingual-MiniLM-L12-v2")
+
+# ==== Models (loaded lazily on first use, see app/utils/model_provider.py) ====
+# Every *_NAME may be a Hub id or a local directory; with MODELS_OFFLINE the service
+# starts and loads without network access, from local paths or MODEL_CACHE_DIR only.
+RERANK_MODEL_NAME = os.environ.get("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Also used at ingestion, to store each chunk's prompt token count (with this name: counts
+# stored under another tokenizer are recomputed at query time)
+LLM_TOKENIZER_NAME = os.environ.get("LLM_TOKENIZER_NAME", "hf-internal-testing/llama-tokenizer")
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR") or None  # default: the Hugging Face cache
+MODELS_OFFLINE = os.environ.get("MODELS_OFFLINE", "false").lower() in ("1", "true", "yes")
+MODELS_PRELOAD = os.environ.get("MODELS_PRELOAD", "false").lower() in ("1", "true", "yes")  # warm up at startup
+
+# ==== Retriever cache (loaded FAISS indexes kept in memory, LRU) ====
+RETRIEVER_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVER_CACHE_MAX_ENTRIES", "32"))
+RETRIEVER_CACHE_MAX_BYTES = int(os.environ.get("RETRIEVER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# ==== LLM engine ====
+LLM_MODEL_PATH = os.environ.get("LLM_MODEL_PATH", "models/llama-2-7b-chat.ggmlv3.q4_1.bin")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "1"))  # the model is not re-entrant
+LLM_ACQUIRE_TIMEOUT = float(os.environ.get("LLM_ACQUIRE_TIMEOUT", "300"))  # seconds waiting for a free slot
+LLM_PRELOAD = os.environ.get("LLM_PRELOAD", "false").lower() in ("1", "true", "yes")
+LLM_PROMPT_MAX_TOKENS = int(os.environ.get("LLM_PROMPT_MAX_TOKENS", "512"))  # whole prompt: template + context + question
+
+# ==== Async query stages (one bounded thread pool per stage; full queues answer 429) ====
+# Embedding and reranking threads mostly wait on their micro-batchers, so they can outnumber the cores
+QUERY_EMBED_WORKERS = int(os.environ.get("QUERY_EMBED_WORKERS", "8"))
+QUERY_SEARCH_WORKERS = int(os.environ.get("QUERY_SEARCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+QUERY_RERANK_WORKERS = int(os.environ.get("QUERY_RERANK_WORKERS", "8"))
+QUERY_LLM_WORKERS = int(os.environ.get("QUERY_LLM_WORKERS", str(LLM_MAX_CONCURRENCY)))
+QUERY_STAGE_QUEUE_SIZE = int(os.environ.get("QUERY_STAGE_QUEUE_SIZE", "32"))  # waiting calls per stage before 429
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "120"))  # seconds per /query request (504 after), 0 = none
+QUERY_DISCONNECT_POLL = float(os.environ.get("QUERY_DISCONNECT_POLL", "0.5"))  # seconds between client checks
+
+# ==== Latency instrumentation (stage histograms on /metrics) ====
+METRICS_BUCKETS = [float(b) for b in os.environ.get(
+    "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120").split(",")]  # seconds
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# ==== Multi-index search ====
+SEARCH_MAX_WORKERS = int(os.environ.get("SEARCH_MAX_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# ==== Hybrid retrieval (BM25 inverted index + vectors, fused with reciprocal rank fusion) ====
+HYBRID_SEARCH_ENABLED = os.environ.get("HYBRID_SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+BM25_CACHE_MAX_ENTRIES = int(os.environ.get("BM25_CACHE_MAX_ENTRIES", "64"))  # open per-document indexes
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+# ==== Reranking (cross-encoder over the retrieved candidates) ====
+RERANK_MAX_CANDIDATES = int(os.environ.get("RERANK_MAX_CANDIDATES", "20"))  # nearest candidates scored, 0 = all
+RERANK_MAX_DISTANCE_RATIO = float(os.environ.get("RERANK_MAX_DISTANCE_RATIO", "0"))  # drop distance > ratio * best, 0 = off
+RERANK_EARLY_EXIT_GAP = float(os.environ.get("RERANK_EARLY_EXIT_GAP", "0"))  # skip when top_n lead by this distance, 0 = off
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "256"))  # tokens per (query, chunk) pair
+RERANK_CACHE_MAX_ENTRIES = int(os.environ.get("RERANK_CACHE_MAX_ENTRIES", "10000"))  # (query, chunk) scores
+
+# ==== Micro-batching (concurrent queries share one embedding / rerank forward pass) ====
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "5"))  # 0 = off
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", "64"))  # items (queries or pairs) per batch
+
+# ==== Vector index type ====
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "auto")  # auto | flat | hnsw | ivf_flat | ivf_pq
+INDEX_IVF_MIN_VECTORS = int(os.environ.get("INDEX_IVF_MIN_VECTORS", "50000"))  # auto: flat below this
+INDEX_PQ_MIN_VECTORS = int(os.environ.get("INDEX_PQ_MIN_VECTORS", "1000000"))  # auto: ivf_pq from this
+INDEX_TRAIN_SAMPLE = int(os.environ.get("INDEX_TRAIN_SAMPLE", "100000"))
+# The FAISS index file is rewritten once the vectors added/removed since the last write reach this share of it
+INDEX_CHECKPOINT_RATIO = float(os.environ.get("INDEX_CHECKPOINT_RATIO", "0.1"))
+# IVF indexes are re-trained (on a sample of the whole corpus) once it has grown this many times
+# over the vectors they were last trained with, 0 = never
+INDEX_RETRAIN_GROWTH = float(os.environ.get("INDEX_RETRAIN_GROWTH", "2"))
+# HNSW cannot delete: removed vectors stay as tombstones until they reach this share of the index
+INDEX_TOMBSTONE_RATIO = float(os.environ.get("INDEX_TOMBSTONE_RATIO", "0.2"))
+INDEX_NPROBE = int(os.environ.get("INDEX_NPROBE", "16"))
+INDEX_HNSW_M = int(os.environ.get("INDEX_HNSW_M", "32"))
+INDEX_EF_SEARCH = int(os.environ.get("INDEX_EF_SEARCH", "64"))
+INDEX_PQ_M = int(os.environ.get("INDEX_PQ_M", "48"))  # 8 dims per sub-quantizer for 384-d embeddings
+
+# ==== Ingestion embedding ====
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+EMBED_SORT_WINDOW = int(os.environ.get("EMBED_SORT_WINDOW", "1024"))  # texts sorted by length per window
+EMBED_PROCESSES = int(os.environ.get("EMBED_PROCESSES", "0"))  # >1: multi-process encode pool (CPU hosts)
+
+# ==== Background ingestion ====
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))  # documents indexed concurrently
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "16"))  # waiting uploads before 429
+INGEST_JOB_HISTORY = int(os.environ.get("INGEST_JOB_HISTORY", "1000"))  # finished jobs kept for status
+# Documents embedded at the same time share encode calls: wait this long to gather them (0 = off)
+INGEST_EMBED_BATCH_WAIT_MS = float(os.environ.get("INGEST_EMBED_BATCH_WAIT_MS", "20" if INGEST_WORKERS > 1 else "0"))
+
+# ==== Uploads ====
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))  # 0 = unlimited
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_BATCH_MAX_FILES = int(os.environ.get("UPLOAD_BATCH_MAX_FILES", "32"))  # files per /upload/batch request
+
+# ==== Document catalog (SQLite: file_id -> filename, content hash, index info) ====
+CATALOG_PATH = DATA_DIR / "catalog.sqlite3"
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", "4096"))  # rows cached in-process
+
+# ==== Persistent embedding cache (chunk text hash -> vector) ====
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_DIR = INDEX_DIR / "embedding_cache"
+EMBED_CACHE_DTYPE = os.environ.get("EMBED_CACHE_DTYPE", "float16")  # float16 | float32
+
+# ==== Chunking (single pass over the PDF pages) ====
+CHUNK_UNIT = os.environ.get("CHUNK_UNIT", "tokens")  # tokens (embedding model tokenizer) | chars
+# Keep CHUNK_SIZE below the embedding model's max_seq_length (128 for the default model)
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "120"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "15"))
+
+# ==== PDF text extraction ====
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))  # <= 1: serial
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))  # page range handed to one worker
+PDF_PAGE_TIMEOUT = float(os.environ.get("PDF_PAGE_TIMEOUT", "30"))  # seconds per page
+
+# ==== Answer cache (repeated questions on the same documents) ====
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))  # seconds
+# Near-duplicate questions: cosine similarity of query embeddings, 0 = exact (normalized) matches only
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
@@ -1,16 +1,45 @@
 # app/main.py
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routes import upload, query
+from app.config import LLM_PRELOAD, MODELS_PRELOAD
+from app.utils.llm_client import llm_engine
+from app.rag.global_index import global_index
+from app.rag.retriever import stop_embed_pool
+from app.services.ingestion_service import job_manager
+from app.utils.pdf_parser import stop_extract_pool
+from app.utils.model_provider import model_provider
+from app.utils.executors import query_executors
+from app.utils.timing import render_metrics
 from dotenv import load_dotenv
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The corpus-wide vector index is loaded once and shared by all requests
+    global_index.load()
+    # Load + warm up the LLM in the background so the server can report readiness meanwhile
+    if LLM_PRELOAD:
+        threading.Thread(target=llm_engine.warmup, name="llm-warmup", daemon=True).start()
+    # Embedder, reranker and tokenizer otherwise load on the first request that needs them
+    if MODELS_PRELOAD:
+        threading.Thread(target=model_provider.warmup, name="models-warmup", daemon=True).start()
+    yield
+    job_manager.shutdown()
+    stop_embed_pool()
+    stop_extract_pool()
+    query_executors.shutdown()
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title="Ask My Document",
         description="Upload documents and ask questions using RAG pipeline.",
         version="0.1.0",
+        lifespan=lifespan,
     )
 
     # CORS middleware for Swagger UI
@@ -25,6 +54,25 @@ def create_app() -> FastAPI:
     app.include_router(upload.router, prefix="/documents", tags=["Upload"])
     app.include_router(query.router, prefix="/documents", tags=["Query"])
 
+    @app.get("/ready", tags=["Health"])
+    def ready():
+        """
+        Readiness probe: 200 once the LLM engine and models are loaded (or lazy loading is used), 503 otherwise.
+        """
+        body = {"llm": llm_engine.state, "error": llm_engine.error, "models": model_provider.stats()}
+        if (LLM_PRELOAD and not llm_engine.is_ready()) or (MODELS_PRELOAD and not model_provider.is_ready()):
+            return JSONResponse(content=body, status_code=503)
+        return body
+
+    @app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+    def metrics():
+        """
+        Prometheus metrics: rag_stage_duration_seconds{pipeline, stage} histograms of
+        query (encode, search, bm25, rerank, context_pack, llm, total) and ingestion
+        (save, parse, chunk, embed, write, total) stages.
+        """
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
     return app
 
 app = create_app()
@@ -0,0 +1,258 @@
+# app/rag/bm25.py
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable
+import numpy as np
+
+from app.config import INDEX_DIR, BM25_K1, BM25_B, BM25_CACHE_MAX_ENTRIES
+
+# Words, plus identifiers kept whole across inner separators: "ERR-1042", "3.2.1", "a/b"
+_TOKEN_RE = re.compile(r"\w+(?:[-./:_]\w+)*")
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercased terms of text. An identifier such as "ABC-12.3" yields itself and
+    its parts ("abc-12.3", "abc", "12", "3"), so exact and partial mentions both match.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text).casefold()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(re.findall(r"\w+", token))
+    return terms
+
+# ==== Varint postings ====
+def encode_varints(values: Iterable[int]) -> bytes:
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+def decode_varints(buf: np.ndarray) -> np.ndarray:
+    """
+    Decode a uint8 array of LEB128 varints (vectorized). Returns int64 values.
+    """
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = (np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)) * 7
+    parts = (buf & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+# File layout (little-endian):
+#   MAGIC | uint64 header length | JSON header | columns (offsets relative to the 8-byte aligned end of the header)
+# Header: count (chunks), total_length (terms), terms {term: [postings offset, nbytes, df]}, columns
+# Columns:
+#   chunk_ids  int64 [count]   global index id of each row
+#   lengths    int32 [count]   terms per row
+#   postings   uint8 [...]     per term: varints (row gap, term frequency) for every row containing it
+MAGIC = b"BM25IX01"
+
+class Bm25Index:
+    """
+    Read-only, memory-mapped inverted index of one document's chunks.
+    Only the postings of the query terms are decoded.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a BM25 index: {self.path}")
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start + header_len].decode("utf-8"))
+        base = (start + header_len + 7) & ~7
+
+        self.count = header["count"]
+        self.total_length = header["total_length"]
+        self.terms: dict[str, list[int]] = header["terms"]
+        columns = {
+            name: np.frombuffer(self._mmap, dtype=spec["dtype"], count=spec["length"], offset=base + spec["offset"])
+            for name, spec in header["columns"].items()
+        }
+        self.chunk_ids = columns["chunk_ids"]
+        self.lengths = columns["lengths"]
+        self._postings = columns["postings"]
+
+    def df(self, term: str) -> int:
+        entry = self.terms.get(term)
+        return entry[2] if entry else 0
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (rows, term frequencies) of the chunks containing term.
+        """
+        entry = self.terms.get(term)
+        if not entry:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+        offset, nbytes, _ = entry
+        pairs = decode_varints(self._postings[offset:offset + nbytes]).reshape(-1, 2)
+        return np.cumsum(pairs[:, 0]), pairs[:, 1]
+
+    @staticmethod
+    def write(path: Path, chunk_ids: Iterable[int], texts: Iterable[str]):
+        """
+        Build the index of (chunk id, text) pairs and write it to path (atomically, via a temp file).
+        """
+        ids, lengths = [], []
+        postings: dict[str, list[int]] = {}  # term -> flat [row gap, tf, ...]
+        last_row: dict[str, int] = {}
+        for row, (chunk_id, text) in enumerate(zip(chunk_ids, texts)):
+            counts = Counter(tokenize(text))
+            ids.append(int(chunk_id))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).extend((row - last_row.get(term, 0), tf))
+                last_row[term] = row
+
+        blobs, terms, offset = [], {}, 0
+        for term in sorted(postings):
+            blob = encode_varints(postings[term])
+            terms[term] = [offset, len(blob), len(postings[term]) // 2]
+            blobs.append(blob)
+            offset += len(blob)
+
+        columns = {
+            "chunk_ids": np.asarray(ids, dtype="int64"),
+            "lengths": np.asarray(lengths, dtype="int32"),
+            "postings": np.frombuffer(b"".join(blobs), dtype="uint8"),
+        }
+        specs, offset = {}, 0
+        for name, array in columns.items():
+            specs[name] = {"offset": offset, "dtype": array.dtype.str, "length": len(array)}
+            offset = (offset + array.nbytes + 7) & ~7
+        header = json.dumps({
+            "count": len(ids), "total_length": int(sum(lengths)), "terms": terms, "columns": specs,
+        }, ensure_ascii=False).encode("utf-8")
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            base = (f.tell() + 7) & ~7
+            for name, array in columns.items():
+                f.seek(base + specs[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate((f.tell() + 7) & ~7)
+        os.replace(tmp_path, path)
+
+class Bm25Store:
+    """
+    The per-document BM25 indexes ({index_dir}/{file_id}.bm25), with an LRU of open ones.
+    search() scores the chunks of several documents together, with corpus
+    statistics (chunk count, average length, document frequencies) summed over
+    exactly those documents.
+    """
+    def __init__(self, index_dir: Path = INDEX_DIR / "bm25", max_entries: int = BM25_CACHE_MAX_ENTRIES,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.index_dir = Path(index_dir)
+        self.max_entries = max_entries
+        self.k1 = k1
+        self.b = b
+        self._entries: "OrderedDict[str, Bm25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, file_id: str) -> Path:
+        return self.index_dir / f"{file_id}.bm25"
+
+    def write(self, file_id: str, chunk_ids: Iterable[int], texts: Iterable[str]):
+        Bm25Index.write(self.path(file_id), chunk_ids, texts)
+        self.invalidate(file_id)  # open readers keep the old file until they are done
+
+    def remove(self, file_id: str) -> bool:
+        self.invalidate(file_id)
+        path = self.path(file_id)
+        if path.exists():
+            path.unlink()
+            return True
+        return False
+
+    def invalidate(self, file_id: str):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def get(self, file_id: str) -> Bm25Index:
+        """
+        The open index of file_id, or None if it has none (e.g. indexed before BM25 existed).
+        """
+        with self._lock:
+            index = self._entries.get(file_id)
+            if index is not None:
+                self._entries.move_to_end(file_id)
+                return index
+        path = self.path(file_id)
+        if not path.exists():
+            return None
+        index = Bm25Index(path)
+        with self._lock:
+            self._entries[file_id] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def search(self, query: str, file_ids: list[str], top_k: int) -> list[tuple[int, float]]:
+        """
+        The top_k (chunk id, BM25 score) pairs for query over the chunks of file_ids, best first.
+        """
+        indexes = [index for index in map(self.get, dict.fromkeys(file_ids)) if index is not None]
+        terms = list(dict.fromkeys(tokenize(query)))
+        n = sum(index.count for index in indexes)
+        if not terms or not n:
+            return []
+        avgdl = sum(index.total_length for index in indexes) / n
+        idf = {}
+        for term in terms:
+            df = sum(index.df(term) for index in indexes)
+            if df:
+                idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+        ids, scores = [], []
+        for index in indexes:
+            doc_scores = None
+            for term, weight in idf.items():
+                rows, tf = index.postings(term)
+                if not len(rows):
+                    continue
+                if doc_scores is None:
+                    doc_scores = np.zeros(index.count, dtype="float64")
+                norm = self.k1 * (1 - self.b + self.b * index.lengths[rows] / avgdl)
+                doc_scores[rows] += weight * tf * (self.k1 + 1) / (tf + norm)
+            if doc_scores is not None:
+                rows = np.flatnonzero(doc_scores)
+                ids.append(index.chunk_ids[rows])
+                scores.append(doc_scores[rows])
+        if not ids:
+            return []
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return [(int(ids[i]), float(scores[i])) for i in best]
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], key: Callable[[dict], object], k: int = 60) -> list[dict]:
+    """
+    Merge ranked hit lists: each hit scores sum(1 / (k + rank)) over the lists
+    it appears in (rank from 1), and hits found by several lists are merged into
+    one dict. Returns hits sorted by that score, stored as "rrf_score".
+    """
+    merged: dict[object, dict] = {}
+    scores: dict[object, float] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            hit_key = key(hit)
+            merged.setdefault(hit_key, {}).update(hit)
+            scores[hit_key] = scores.get(hit_key, 0.0) + 1.0 / (k + rank)
+    # Stable sort: ties keep the order of the first ranking
+    return [{**merged[h], "rrf_score": scores[h]} for h in sorted(scores, key=scores.get, reverse=True)]
+
+bm25_store = Bm25Store()
@@ -0,0 +1,156 @@
+# app/rag/chunk_store.py
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator
+import numpy as np
+
+# File layout (little-endian, every column 8-byte aligned):
+#   MAGIC | uint64 header length | JSON header | columns
+# Columns:
+#   rows         int32 [id_span]  FAISS id - id_base -> row, -1 if absent
+#   chunk_ids    int64 [n]        FAISS id of each row
+#   <str field>  int32 [n]        index into header "strings" (interned), -1 for None
+#   <int field>  int32 [n]        value, INT_NULL for None
+#   text_offsets int64 [n + 1]    byte offsets into text
+#   text         uint8 [...]      UTF-8 contents, concatenated
+MAGIC = b"CHUNKS01"
+STR_FIELDS = ("file_id", "file_name", "tokenizer")  # tokenizer: the one n_tokens was counted with
+INT_FIELDS = ("page_number", "page_end", "n_tokens")
+INT_NULL = np.iinfo(np.int32).min
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped store of chunk metadata addressed by FAISS id.
+    Opening only parses the small JSON header; get() is O(1) and decodes just
+    the requested row, so resident memory follows the chunks actually read.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a chunk store: {self.path}")
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start + header_len].decode("utf-8"))
+
+        self.count = header["count"]
+        self.id_base = header["id_base"]
+        self.strings = header["strings"]
+        self.columns = {
+            name: np.frombuffer(self._mmap, dtype=spec["dtype"], count=spec["length"], offset=spec["offset"])
+            for name, spec in header["columns"].items()
+        }
+        self.nbytes = len(self._mmap)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _row(self, chunk_id: int) -> int:
+        rel = chunk_id - self.id_base
+        rows = self.columns["rows"]
+        return int(rows[rel]) if 0 <= rel < len(rows) else -1
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return self._row(int(chunk_id)) >= 0
+
+    def get(self, chunk_id: int) -> dict:
+        """
+        Chunk dict for a FAISS id, or None. Fields stored as None are omitted.
+        """
+        row = self._row(int(chunk_id))
+        return None if row < 0 else self._read(row)
+
+    def ids(self) -> np.ndarray:
+        return self.columns["chunk_ids"]
+
+    def items(self) -> Iterator[tuple[int, dict]]:
+        for row, chunk_id in enumerate(self.columns["chunk_ids"].tolist()):
+            yield chunk_id, self._read(row)
+
+    def _read(self, row: int) -> dict:
+        chunk = {}
+        # Fields added after a store was written are simply absent from it
+        for field in STR_FIELDS:
+            value = int(self.columns[field][row]) if field in self.columns else -1
+            if value >= 0:
+                chunk[field] = self.strings[value]
+        for field in INT_FIELDS:
+            value = int(self.columns[field][row]) if field in self.columns else INT_NULL
+            if value != INT_NULL:
+                chunk[field] = value
+        offsets = self.columns["text_offsets"]
+        chunk["content"] = self.columns["text"][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+        return chunk
+
+    @staticmethod
+    def write(path: Path, chunks: Iterable[tuple[int, dict]]):
+        """
+        Write (chunk_id, chunk dict) pairs to path (atomically, via a temp file).
+        Chunks are plain dicts with "content" and any of STR_FIELDS / INT_FIELDS;
+        a bare string is stored as {"content": string}.
+        """
+        chunk_ids, texts = [], []
+        strs = {field: [] for field in STR_FIELDS}
+        ints = {field: [] for field in INT_FIELDS}
+        interned: dict[str, int] = {}
+        for chunk_id, chunk in chunks:
+            if not isinstance(chunk, dict):
+                chunk = {"content": chunk}
+            unknown = set(chunk) - set(STR_FIELDS) - set(INT_FIELDS) - {"content", "chunk_id"}
+            if unknown:
+                raise ValueError(f"Unsupported chunk fields: {', '.join(sorted(unknown))}")
+            chunk_ids.append(int(chunk_id))
+            texts.append(chunk.get("content", "").encode("utf-8"))
+            for field in STR_FIELDS:
+                value = chunk.get(field)
+                strs[field].append(-1 if value is None else interned.setdefault(value, len(interned)))
+            for field in INT_FIELDS:
+                value = chunk.get(field)
+                ints[field].append(INT_NULL if value is None else int(value))
+
+        ids = np.asarray(chunk_ids, dtype="int64")
+        id_base = int(ids.min()) if len(ids) else 0
+        rows = np.full(int(ids.max()) - id_base + 1 if len(ids) else 0, -1, dtype="int32")
+        rows[ids - id_base] = np.arange(len(ids), dtype="int32")
+        lengths = np.fromiter((len(t) for t in texts), dtype="int64", count=len(texts))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype("int64")
+
+        columns = {"rows": rows, "chunk_ids": ids}
+        columns.update({field: np.asarray(v, dtype="int32") for field, v in strs.items()})
+        columns.update({field: np.asarray(v, dtype="int32") for field, v in ints.items()})
+        columns["text_offsets"] = offsets
+        columns["text"] = np.frombuffer(b"".join(texts), dtype="uint8")
+
+        # Column offsets depend on the header size, which depends on the offsets: iterate to a fixed point
+        header_len = 0
+        while True:
+            offset = _align(len(MAGIC) + 8 + header_len)
+            specs = {}
+            for name, array in columns.items():
+                specs[name] = {"offset": offset, "dtype": array.dtype.str, "length": len(array)}
+                offset = _align(offset + array.nbytes)
+            header = json.dumps({
+                "count": len(ids), "id_base": id_base,
+                "strings": list(interned), "columns": specs,
+            }).encode("utf-8")
+            if len(header) == header_len:
+                break
+            header_len = len(header)
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", header_len) + header)
+            for name, array in columns.items():
+                f.seek(specs[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(_align(f.tell()))
+        os.replace(tmp_path, path)
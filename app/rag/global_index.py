@@ -0,0 +1,543 @@
+# app/rag/global_index.py
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import faiss
+import numpy as np
+
+from app.config import (
+    INDEX_DIR, INDEX_TYPE, INDEX_CHECKPOINT_RATIO, INDEX_RETRAIN_GROWTH, INDEX_TOMBSTONE_RATIO,
+)
+from app.rag.chunk_store import ChunkStore
+from app.utils.timing import span
+from app.rag.index_factory import (
+    INDEX_TYPES, buildable_index_type, choose_index_type, index_type_of, make_index, reconstruct_all,
+    search_params,
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT = 2  # 1: a single {name}.chunks store rewritten on every change; 2: per-document segments
+
+def _to_runs(ids: np.ndarray) -> list[list[int]]:
+    ids = np.sort(ids)
+    breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+    return [[int(run[0]), len(run)] for run in np.split(ids, breaks)]
+
+def _from_runs(runs: list[list[int]]) -> np.ndarray:
+    if runs and isinstance(runs[0], int):
+        runs = [runs]  # written before ids were assigned per batch: a single [first id, count]
+    return np.concatenate([np.arange(start, start + count, dtype="int64") for start, count in runs])
+
+def _replace_file(path: Path, write):
+    # Write to a temp file then rename, so readers never see a half-written file
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+class _ReadWriteLock:
+    """
+    Any number of readers (searches) or a single writer (index mutations).
+    Waiting writers go first, so a steady stream of searches cannot starve them.
+    Not reentrant.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class GlobalIndex:
+    """
+    One corpus-wide FAISS index shared by all uploaded documents.
+    Vectors live under stable int64 ids (IndexIDMap2), so a document can be
+    added or removed incrementally and queries can be restricted to a set of
+    file_ids with an ID selector: one search per query, however many files.
+    The underlying index type (flat/HNSW/IVF/IVF-PQ) follows INDEX_TYPE; with
+    "auto" it is upgraded (re-trained and rebuilt) as the corpus grows. IVF indexes
+    are also re-trained on the whole corpus every time it grows INDEX_RETRAIN_GROWTH
+    times, so their lists are not fitted to the first document(s) only.
+
+    Persistence is incremental: every document version is written once, as its
+    own segment in {name}.segments/ (chunk store + vectors), and the state file
+    ({name}.json: ids and versions per document) is updated. The FAISS index file
+    is only rewritten (checkpointed) once the vectors changed since the last
+    checkpoint reach checkpoint_ratio of the index; loading replays newer
+    segments and removals on top of it.
+    Searches share a read lock on the FAISS index; only in-memory mutations take
+    it exclusively, and no lock searches need is held while writing to disk.
+    """
+    def __init__(self, index_dir: Path = INDEX_DIR, name: str = "global", index_type: str = INDEX_TYPE,
+                 checkpoint_ratio: float = INDEX_CHECKPOINT_RATIO):
+        self.index_path = index_dir / f"{name}.faiss"
+        self.metadata_path = index_dir / f"{name}.chunks"  # format 1 chunk store, migrated on load
+        self.state_path = index_dir / f"{name}.json"
+        self.segments_dir = index_dir / f"{name}.segments"
+        self.index_type = index_type
+        self.checkpoint_ratio = checkpoint_ratio
+        self.index = None  # created on first add, once the embedding dim is known
+        self.doc_ids: dict[str, np.ndarray] = {}  # file_id -> int64 ids of its chunks
+        self.versions: dict[str, int] = {}  # file_id -> bumped on every (re)index/removal
+        self.next_id = 0
+        self.trained_on = 0  # vectors the index was created / last re-trained with
+        self._tombstones = np.empty(0, dtype="int64")  # HNSW: removed ids still in the graph
+        # Chunk metadata, per document. Replaced (never mutated) on change, so readers can snapshot them
+        self._segments: dict[str, str] = {}  # file_id -> segment name of its current version
+        self._stores: dict[str, ChunkStore] = {}  # file_id -> open chunk store of that segment
+        self._runs: dict[str, list[list[int]]] = {}  # file_id -> its ids as runs
+        self._owners = (np.empty(0, dtype="int64"), np.empty(0, dtype="int64"), [])  # run starts, ends, file_ids
+        self._unsaved: set[str] = set()  # documents whose vectors are not in the index file yet
+        self._changes = 0  # vectors added / removed since the last checkpoint
+        self._loaded = False
+        self._lock = threading.RLock()  # metadata above
+        self._index_lock = _ReadWriteLock()  # the FAISS index
+        self._persist_lock = threading.Lock()  # orders registrations with their state file / checkpoint writes
+
+    # ==== Persistence ====
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            if self.state_path.exists():
+                with span("index_load", pipeline="startup"):
+                    self._load()
+            self._loaded = True
+
+    def _load(self):
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        # A document's ids are stored as runs of consecutive ids: [[first id, count], ...]
+        self.doc_ids = {k: _from_runs(runs) for k, runs in state["doc_ids"].items()}
+        self._runs = {k: _to_runs(ids) for k, ids in self.doc_ids.items()}
+        self.versions = state["versions"]
+        self.next_id = state["next_id"]
+        if self.index_path.exists():
+            self.index = faiss.read_index(str(self.index_path))
+        self.trained_on = state.get("trained_on", self.index.ntotal if self.index is not None else 0)
+        if state.get("format", 1) < STATE_FORMAT:
+            self._segments = self._migrate_chunk_store()
+        else:
+            self._segments = state["segments"]
+        self._stores = {f: ChunkStore(self._segment_path(name, ".chunks")) for f, name in self._segments.items()}
+        self._index_owners()
+        self._replay()
+        if state.get("format", 1) < STATE_FORMAT:
+            self._write_state(self._state())
+            self.metadata_path.unlink(missing_ok=True)
+        self._remove_orphan_segments()
+
+    def _migrate_chunk_store(self) -> dict[str, str]:
+        """
+        Split the single chunk store of format 1 into one segment per document.
+        Its index file holds every vector, so the segments need no vectors.
+        """
+        store = ChunkStore(self.metadata_path) if self.metadata_path.exists() else None
+        segments = {}
+        for file_id, ids in self.doc_ids.items():
+            name = self._segment_name(file_id, ids)
+            chunks = [(i, store.get(i)) for i in ids.tolist()] if store is not None else []
+            self._write_chunks(name, [(i, chunk) for i, chunk in chunks if chunk is not None])
+            segments[file_id] = name
+        logger.info("Migrated %d documents to per-document chunk segments", len(segments))
+        return segments
+
+    def _replay(self):
+        """
+        Bring the index read from disk up to date with the state: drop the vectors of
+        removed / replaced documents and add those of documents newer than the checkpoint.
+        """
+        live = np.concatenate(list(self.doc_ids.values())) if self.doc_ids else np.empty(0, dtype="int64")
+        stored = (faiss.vector_to_array(self.index.id_map).astype("int64") if self.index is not None
+                  else np.empty(0, dtype="int64"))
+        stale = np.setdiff1d(stored, live)
+        if len(stale):
+            self._drop_vectors(stale)
+            self._changes += len(stale)
+        for file_id, ids in self.doc_ids.items():
+            if np.isin(ids, stored).all():
+                continue
+            path = self._segment_path(self._segments[file_id], ".npz")
+            if not path.exists():
+                logger.error("Vectors of %s are missing (%s): it cannot be searched until re-uploaded", file_id, path)
+                continue
+            with np.load(path) as data:
+                seg_ids, vectors = data["ids"], data["vectors"]
+            missing = ~np.isin(seg_ids, stored)
+            if self.index is None:
+                kind = choose_index_type(len(live), self.index_type)
+                self.index = faiss.IndexIDMap2(make_index(vectors.shape[1], kind, vectors))
+                self.trained_on = len(vectors)
+            self.index.add_with_ids(vectors[missing], seg_ids[missing])
+            self._unsaved.add(file_id)
+            self._changes += int(missing.sum())
+        top = max([int(stored.max()) if len(stored) else -1, int(live.max()) if len(live) else -1])
+        self.next_id = max(self.next_id, top + 1)
+
+    def _remove_orphan_segments(self):
+        if not self.segments_dir.exists():
+            return
+        keep = {f"{name}.chunks" for name in self._segments.values()}
+        keep |= {f"{self._segments[f]}.npz" for f in self._unsaved}
+        for path in self.segments_dir.iterdir():
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+
+    def _state(self) -> dict:
+        return {
+            "format": STATE_FORMAT,
+            "doc_ids": {k: runs for k, runs in self._runs.items()},
+            "versions": dict(self.versions),
+            "next_id": self.next_id,
+            "trained_on": self.trained_on,
+            "segments": dict(self._segments),
+        }
+
+    def _write_state(self, state: dict):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        _replace_file(self.state_path, lambda f: f.write(json.dumps(state).encode("utf-8")))
+
+    @staticmethod
+    def _segment_name(file_id: str, ids: np.ndarray) -> str:
+        # Ids are never reused, so the first one makes the name unique per document version
+        safe_id = re.sub(r"[^\w.-]", "_", file_id)
+        return f"{safe_id}-{int(ids.min())}"
+
+    def _segment_path(self, name: str, suffix: str) -> Path:
+        return self.segments_dir / f"{name}{suffix}"
+
+    def _write_chunks(self, name: str, chunks):
+        ChunkStore.write(self._segment_path(name, ".chunks"), chunks)
+
+    def _write_segment(self, name: str, ids: np.ndarray, docs: list[dict], vectors: np.ndarray):
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self._write_chunks(name, zip(ids.tolist(), docs))
+        _replace_file(self._segment_path(name, ".npz"), lambda f: np.savez(f, ids=ids, vectors=vectors))
+
+    def _delete_segment(self, name: str):
+        for suffix in (".chunks", ".npz"):
+            try:
+                self._segment_path(name, suffix).unlink(missing_ok=True)
+            except OSError:  # still mapped (Windows): removed as an orphan on the next load
+                pass
+
+    def checkpoint(self, force: bool = True):
+        """
+        Write the FAISS index file (and drop the segment vectors it now covers).
+        Without force, only once the changes since the last checkpoint reach
+        checkpoint_ratio of the index (or there is no index file yet).
+        """
+        with self._persist_lock:
+            self._checkpoint(force)
+
+    def _checkpoint(self, force: bool = False):
+        # Caller holds _persist_lock, so no document is registered or removed meanwhile
+        if self.index is None:
+            return
+        if not force and self.index_path.exists() and self._changes < self.checkpoint_ratio * self.index.ntotal:
+            return
+        with self._lock:
+            covered = {f: self._segments[f] for f in self._unsaved if f in self._segments}
+            state = self._state()
+        # Serializing only reads the index: searches go on meanwhile
+        with self._index_lock.read():
+            data = faiss.serialize_index(self.index)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        _replace_file(self.index_path, lambda f: f.write(data.tobytes()))
+        self._write_state(state)
+        with self._lock:
+            self._unsaved -= covered.keys()
+        self._changes = 0
+        for name in covered.values():
+            self._segment_path(name, ".npz").unlink(missing_ok=True)
+
+    # ==== Chunk metadata ====
+    def _index_owners(self):
+        runs = [(start, start + count, file_id) for file_id, doc_runs in self._runs.items()
+                for start, count in doc_runs]
+        runs.sort()
+        self._owners = (
+            np.asarray([r[0] for r in runs], dtype="int64"),
+            np.asarray([r[1] for r in runs], dtype="int64"),
+            [r[2] for r in runs],
+        )
+
+    def _snapshot(self):
+        with self._lock:
+            return self._owners, self._stores
+
+    @staticmethod
+    def _lookup(chunk_id: int, owners, stores: dict) -> dict:
+        starts, ends, file_ids = owners
+        run = int(np.searchsorted(starts, chunk_id, side="right")) - 1
+        if run < 0 or chunk_id >= ends[run]:
+            return None
+        store = stores.get(file_ids[run])
+        chunk = store.get(chunk_id) if store is not None else None
+        return None if chunk is None else {**chunk, "chunk_id": chunk_id}
+
+    # ==== Mutations ====
+    def add_document(self, file_id: str, docs: list[dict], embeddings) -> np.ndarray:
+        """
+        Add (or replace) all chunks of one document. Returns the assigned ids.
+        embeddings is either an array aligned with docs, or an iterable of
+        (positions, vectors) batches (see retriever.iter_embeddings) that are
+        streamed into the index as they arrive. When streaming, docs may still be
+        growing while the batches are produced (pipelined ingestion): each position
+        only has to be present in docs once its batch arrives. The new version only
+        becomes visible to searches once every chunk has been added.
+        """
+        if isinstance(embeddings, (np.ndarray, list)):
+            embeddings = [(np.arange(len(docs)), embeddings)]
+
+        self.load()
+        # Ids are assigned per batch, so documents ingested concurrently may interleave
+        batches: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []  # (positions, ids, vectors)
+        added = 0
+        try:
+            for positions, vectors in embeddings:
+                positions = np.asarray(positions, dtype="int64")
+                vectors = np.asarray(vectors, dtype="float32")
+                with self._lock:
+                    ids = np.arange(self.next_id, self.next_id + len(vectors), dtype="int64")
+                    self.next_id += len(vectors)
+                with self._index_lock.write():
+                    if self.index is None:
+                        # Trained on this first batch only: re-trained once the corpus has grown
+                        kind = choose_index_type(len(docs), self.index_type)
+                        self.index = faiss.IndexIDMap2(make_index(vectors.shape[1], kind, vectors))
+                        self.trained_on = len(vectors)
+                    batches.append((positions, ids, vectors))
+                    self.index.add_with_ids(vectors, ids)
+                added += len(vectors)
+            if added != len(docs):
+                raise ValueError("docs and embeddings must have the same length.")
+            if not docs:
+                raise ValueError(f"No chunks to index for {file_id}.")
+        except Exception:
+            if batches:
+                with self._index_lock.write():
+                    self._drop_vectors(np.concatenate([ids for _, ids, _ in batches]))
+            raise
+
+        ids = np.empty(len(docs), dtype="int64")
+        vectors = np.empty((len(docs), batches[0][2].shape[1]), dtype="float32")
+        for positions, batch_ids, batch_vectors in batches:
+            ids[positions] = batch_ids
+            vectors[positions] = batch_vectors
+
+        # The new version's segment is written before it is registered, without any lock
+        name = self._segment_name(file_id, ids)
+        self._write_segment(name, ids, docs, vectors)
+        store = ChunkStore(self._segment_path(name, ".chunks"))
+
+        with self._persist_lock:
+            with self._lock:
+                previous = self._detach(file_id)
+                self.doc_ids[file_id] = ids
+                self._runs[file_id] = _to_runs(ids)
+                self._segments = {**self._segments, file_id: name}
+                self._stores = {**self._stores, file_id: store}
+                self._index_owners()
+                self._unsaved.add(file_id)
+                self.versions[file_id] = self.versions.get(file_id, 0) + 1
+                state = self._state()
+            self._changes += len(ids)
+            if previous is not None:
+                with self._index_lock.write():
+                    self._changes += self._drop_vectors(previous[0])
+            self._write_state(state)
+
+            with self._index_lock.read():
+                target = self._rebuild_target()
+            if target is not None:
+                self.rebuild(target)
+            self._checkpoint(force=target is not None)
+        if previous is not None:
+            self._delete_segment(previous[1])
+        return ids
+
+    def remove_document(self, file_id: str) -> int:
+        """
+        Remove all chunks of one document. Returns number of vectors removed.
+        """
+        self.load()
+        with self._persist_lock:
+            with self._lock:
+                previous = self._detach(file_id)
+                if previous is None:
+                    return 0
+                self.versions[file_id] = self.versions.get(file_id, 0) + 1
+                state = self._state()
+            with self._index_lock.write():
+                removed = self._drop_vectors(previous[0])
+            self._changes += removed
+            self._write_state(state)
+            self._checkpoint()
+        self._delete_segment(previous[1])
+        return removed
+
+    def _detach(self, file_id: str):
+        """
+        Unregister the current version of file_id (caller holds _lock). Its vectors are
+        no longer selected by searches and are dropped by the caller; returns (ids, segment name).
+        """
+        if file_id not in self.doc_ids:
+            return None
+        ids = self.doc_ids.pop(file_id)
+        self._runs.pop(file_id, None)
+        segments, stores = dict(self._segments), dict(self._stores)
+        name = segments.pop(file_id)
+        stores.pop(file_id, None)
+        self._segments, self._stores = segments, stores
+        self._unsaved.discard(file_id)
+        self._index_owners()
+        return ids, name
+
+    def _rebuild_target(self) -> str:
+        """
+        The type to rebuild the index as after it grew, or None to keep it (caller holds
+        the index lock): an upgrade, or the same IVF type re-trained on the grown corpus.
+        """
+        n = self.index.ntotal - len(self._tombstones)
+        current = index_type_of(self.index)
+        # Compare with what a rebuild can train now (an explicit ivf_pq stays ivf_flat until
+        # there is enough data), or every add would rebuild into the same type
+        target = buildable_index_type(choose_index_type(n, self.index_type), n)
+        if INDEX_TYPES.index(target) > INDEX_TYPES.index(current):
+            return target
+        retrain = INDEX_RETRAIN_GROWTH > 0 and n >= INDEX_RETRAIN_GROWTH * self.trained_on
+        if current in ("ivf_flat", "ivf_pq") and retrain:
+            return current
+        return None
+
+    def _drop_vectors(self, ids: np.ndarray) -> int:
+        # Caller holds the index write lock
+        if index_type_of(self.index) == "hnsw":
+            # HNSW graphs do not support deletion: removed ids stay in the graph as tombstones
+            # (searches only select live ids) until they are worth a rebuild without them
+            self._tombstones = np.union1d(self._tombstones, ids)
+            if len(self._tombstones) >= INDEX_TOMBSTONE_RATIO * self.index.ntotal:
+                self._rebuild("hnsw")
+            return len(ids)
+        return self.index.remove_ids(faiss.IDSelectorBatch(ids))
+
+    def rebuild(self, index_type: str = None, exclude: np.ndarray = None):
+        """
+        Re-create the index as index_type (re-training on the stored vectors),
+        dropping tombstones and the ids in exclude. Persisted by the next checkpoint().
+        """
+        with self._index_lock.write():
+            self._rebuild(index_type, exclude)
+
+    def _rebuild(self, index_type: str = None, exclude: np.ndarray = None):
+        ids, vectors = reconstruct_all(self.index)
+        exclude = self._tombstones if exclude is None else np.union1d(self._tombstones, exclude)
+        if len(exclude):
+            keep = ~np.isin(ids, exclude)
+            ids, vectors = ids[keep], vectors[keep]
+        kind = index_type or choose_index_type(len(ids), self.index_type)
+        index = faiss.IndexIDMap2(make_index(self.index.d, kind, vectors))
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        self.index = index
+        self.trained_on = len(ids)
+        self._tombstones = np.empty(0, dtype="int64")
+
+    # ==== Queries ====
+    # has_document / version read plain dict entries, which are replaced atomically: no lock needed
+    def has_document(self, file_id: str) -> bool:
+        if not self._loaded:
+            self.load()
+        return file_id in self.doc_ids
+
+    def version(self, file_id: str) -> int:
+        if not self._loaded:
+            self.load()
+        return self.versions.get(file_id, 0)
+
+    def get_chunks(self, chunk_ids) -> list[dict]:
+        """
+        Chunk dicts (with "chunk_id") of ids, None for ids no longer in the index.
+        """
+        self.load()
+        owners, stores = self._snapshot()
+        return [self._lookup(int(chunk_id), owners, stores) for chunk_id in chunk_ids]
+
+    def search(self, query_vectors: np.ndarray, file_ids: list[str], top_k: int = 2,
+               threshold: float = None, nprobe: int = None, ef_search: int = None) -> list[list[dict]]:
+        """
+        Search only the chunks of file_ids. query_vectors: float32 array (n, d).
+        nprobe (IVF) and ef_search (HNSW) override the index defaults for this call.
+        Returns one list of hits per query, sorted by distance; each hit is a copy
+        of the chunk metadata plus a "distance" key.
+        """
+        query_vectors = np.asarray(query_vectors, dtype="float32")
+        if query_vectors.ndim == 1:
+            query_vectors = query_vectors.reshape(1, -1)
+        self.load()
+        with self._lock:
+            wanted = [self.doc_ids[f] for f in dict.fromkeys(file_ids) if f in self.doc_ids]
+            owners, stores = self._owners, self._stores
+        if not wanted:
+            return [[] for _ in range(len(query_vectors))]
+        wanted_count = sum(len(ids) for ids in wanted)
+
+        with self._index_lock.read():
+            if self.index is None:
+                return [[] for _ in range(len(query_vectors))]
+            selector = None
+            # Skip the filter only when the request covers every vector (incl. in-flight uploads
+            # and HNSW tombstones)
+            if wanted_count < self.index.ntotal:
+                selector = faiss.IDSelectorBatch(np.concatenate(wanted))
+            params = search_params(self.index, selector, nprobe=nprobe, ef_search=ef_search)
+            distances, indices = self.index.search(query_vectors, top_k, params=params)
+
+        results = []
+        for row_dist, row_idx in zip(distances, indices):
+            hits = []
+            for dist, idx in zip(row_dist, row_idx):
+                if idx != -1 and (threshold is None or dist < threshold):
+                    # None if the document was removed / replaced since the search
+                    chunk = self._lookup(int(idx), owners, stores)
+                    if chunk is not None:
+                        hits.append({**chunk, "distance": float(dist)})
+            results.append(hits)
+        return results
+
+
+global_index = GlobalIndex()
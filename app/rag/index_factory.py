@@ -0,0 +1,142 @@
+# app/rag/index_factory.py
+import logging
+import math
+import faiss
+import numpy as np
+
+from app.config import (
+    INDEX_TYPE, INDEX_IVF_MIN_VECTORS, INDEX_PQ_MIN_VECTORS, INDEX_TRAIN_SAMPLE,
+    INDEX_NPROBE, INDEX_HNSW_M, INDEX_EF_SEARCH, INDEX_PQ_M,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ordered from exact/small to approximate/large; "auto" only ever moves right as the corpus grows
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+def choose_index_type(n_vectors: int, index_type: str = INDEX_TYPE) -> str:
+    """
+    Resolve "auto" to a concrete index type for a corpus of n_vectors chunks.
+    """
+    if index_type != "auto":
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}. Allowed: auto, {', '.join(INDEX_TYPES)}")
+        return index_type
+    if n_vectors < INDEX_IVF_MIN_VECTORS:
+        return "flat"
+    if n_vectors < INDEX_PQ_MIN_VECTORS:
+        return "ivf_flat"
+    return "ivf_pq"
+
+def index_type_of(index: faiss.Index) -> str:
+    """
+    Concrete type of an index (unwrapping IndexIDMap2).
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = index.index
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def _nlist(n_train: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid (FAISS recommendation)
+    return max(1, min(int(4 * math.sqrt(n_train)), n_train // 39))
+
+def _pq_m(dim: int) -> int:
+    # Number of PQ sub-quantizers must divide the dimension
+    m = min(INDEX_PQ_M, dim)
+    while dim % m:
+        m -= 1
+    return m
+
+def buildable_index_type(index_type: str, n_train: int) -> str:
+    """
+    The type make_index actually builds for index_type with n_train training vectors:
+    trainable types fall back to a simpler type when there is too little training data.
+    """
+    if index_type == "ivf_pq" and n_train < 39 * 256:
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and n_train < 39:
+        index_type = "flat"
+    return index_type
+
+def make_index(dim: int, index_type: str, train_vectors: np.ndarray = None) -> faiss.Index:
+    """
+    Create an empty FAISS index of index_type, trained on train_vectors when the type needs it.
+    Trainable types fall back to a simpler type when there is too little training data
+    (see buildable_index_type).
+    """
+    n_train = 0 if train_vectors is None else len(train_vectors)
+    index_type = buildable_index_type(index_type, n_train)
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, INDEX_HNSW_M)
+        index.hnsw.efSearch = INDEX_EF_SEARCH
+        return index
+
+    nlist = _nlist(n_train)
+    if index_type == "ivf_flat":
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+    elif index_type == "ivf_pq":
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{_pq_m(dim)}x8")
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    train_vectors = sample_vectors(train_vectors, INDEX_TRAIN_SAMPLE)
+    logger.info("Training %s index (nlist=%d) on %d vectors", index_type, nlist, len(train_vectors))
+    index.train(train_vectors)
+    index.nprobe = min(INDEX_NPROBE, nlist)
+    return index
+
+def build_index(embeddings: np.ndarray, index_type: str = INDEX_TYPE) -> faiss.Index:
+    """
+    Choose, train and fill an index for a full set of embeddings (ids 0..n-1).
+    """
+    embeddings = np.asarray(embeddings, dtype="float32")
+    index = make_index(embeddings.shape[1], choose_index_type(len(embeddings), index_type), embeddings)
+    index.add(embeddings)
+    return index
+
+def sample_vectors(vectors: np.ndarray, max_samples: int, seed: int = 0) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype="float32")
+    if len(vectors) <= max_samples:
+        return vectors
+    rows = np.random.default_rng(seed).choice(len(vectors), size=max_samples, replace=False)
+    return vectors[np.sort(rows)]
+
+def reconstruct_all(index: faiss.IndexIDMap2) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return (ids, vectors) currently stored in an IndexIDMap2.
+    Exact for flat/HNSW/IVF-flat, approximate for IVF-PQ.
+    """
+    sub = faiss.downcast_index(index.index)
+    if isinstance(sub, faiss.IndexIVF):
+        sub.make_direct_map()
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+    vectors = sub.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+    if isinstance(sub, faiss.IndexIVF):
+        sub.set_direct_map_type(faiss.DirectMap.NoMap)
+    return ids, vectors
+
+def search_params(index: faiss.Index, selector: faiss.IDSelector = None,
+                  nprobe: int = None, ef_search: int = None):
+    """
+    Build FAISS search parameters matching the index type, or None if nothing is set.
+    Unset knobs keep the index defaults (IVF rejects untyped parameters, so they are always typed).
+    """
+    if selector is None and nprobe is None and ef_search is None:
+        return None
+    sub = index.index if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    sub = faiss.downcast_index(sub)
+    if isinstance(sub, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or sub.nprobe)
+    if isinstance(sub, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or sub.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
@@ -26,8 +26,8 @@ class RAGPipeline:
 
     def run(self, query: str, top_k: int = 5) -> str:
         # Get context from FAISS
-        context_chunks: List[str] = self.retriever.retrieve(query, top_k=top_k)
-        
+        context_chunks: List[str] = [c["content"] for c in self.retriever.retrieve(query, top_k=top_k)]
+
         # Build prompt
         prompt = build_prompt(query, context_chunks)
         
@@ -39,10 +39,25 @@ def generate_answer(query: str, context_docs: list[dict], llm_client=None) -> st
     """
     Generate answer from query and context using LLM.
     """
+    from app.utils.llm_client import get_default_llm, stored_token_counts
     if llm_client is None:
-        from app.utils.llm_client import get_default_llm
         llm_client = get_default_llm()
 
-    # Only get the content of the context
+    # Only get the content of the context (and prompt token counts stored at ingestion, if still valid)
     context_texts = [c["content"] for c in context_docs]
+    token_counts = stored_token_counts(context_docs)
+    if any(n is not None for n in token_counts):
+        return llm_client.generate(query, context_texts, token_counts=token_counts)
     return llm_client.generate(query, context_texts)
+
+def stream_answer(query: str, context_docs: list[dict], llm_client=None):
+    """
+    Stream the raw answer text as the LLM produces it.
+    """
+    from app.utils.llm_client import get_default_llm, stored_token_counts
+    if llm_client is None:
+        llm_client = get_default_llm()
+
+    context_texts = [c["content"] for c in context_docs]
+    token_counts = stored_token_counts(context_docs)
+    return llm_client.stream(query, context_texts, token_counts=token_counts)
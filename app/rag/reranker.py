@@ -0,0 +1,137 @@
+# app/rag/reranker.py
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from app.config import (
+    RERANK_MAX_CANDIDATES, RERANK_MAX_DISTANCE_RATIO, RERANK_EARLY_EXIT_GAP, RERANK_BATCH_SIZE,
+    RERANK_CACHE_MAX_ENTRIES,
+)
+from app.utils.batching import MicroBatcher
+from app.utils.model_provider import get_cross_encoder
+
+def chunk_key(chunk: dict):
+    """
+    Identity of a chunk for the score cache: its global index id (never reused,
+    re-indexing assigns new ids), or a hash of its content for legacy per-file hits.
+    """
+    if chunk.get("chunk_id") is not None:
+        return int(chunk["chunk_id"])
+    return hashlib.blake2b(chunk["content"].encode("utf-8"), digest_size=16).hexdigest()
+
+class Reranker:
+    """
+    Cross-encoder reranking of retrieved chunks (in retrieval order), bounded per query:
+    - Only the first max_candidates chunks are scored, and with max_distance_ratio
+      chunks further than ratio * the best distance are dropped first (not when the
+      best distance is 0, an exact match, which no ratio can scale)
+    - With early_exit_gap, reranking is skipped when the top_n nearest chunks lead
+      the next one by at least that distance (whatever order they arrive in, e.g.
+      fused): vector search already separated them
+    - Pairs are scored in batches of batch_size (sequence length is capped by the
+      model, see RERANK_MAX_LENGTH); scores of (query, chunk) pairs are kept in
+      an LRU cache, so repeated queries only score chunks not seen before
+    - With a batcher, the pairs of concurrent queries are scored in one forward pass
+    """
+    def __init__(self, model_fn: Callable = get_cross_encoder, max_candidates: int = RERANK_MAX_CANDIDATES,
+                 max_distance_ratio: float = RERANK_MAX_DISTANCE_RATIO, early_exit_gap: float = RERANK_EARLY_EXIT_GAP,
+                 batch_size: int = RERANK_BATCH_SIZE, cache_size: int = RERANK_CACHE_MAX_ENTRIES,
+                 batcher: MicroBatcher = None):
+        self.model_fn = model_fn
+        self.batcher = batcher
+        self.max_candidates = max_candidates
+        self.max_distance_ratio = max_distance_ratio
+        self.early_exit_gap = early_exit_gap
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._scores: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.early_exits = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+
+    def candidates(self, chunks: list[dict]) -> list[dict]:
+        """
+        Candidates to score, in retrieval order (by distance, or fused rank for hybrid
+        search). Chunks found only by keyword search have no distance and are kept.
+        """
+        distances = [c["distance"] for c in chunks if "distance" in c]
+        best = min(distances) if distances else 0.0
+        if self.max_distance_ratio > 0 and best > 0:
+            limit = best * self.max_distance_ratio
+            chunks = [c for c in chunks if c.get("distance", 0.0) <= limit]
+        if self.max_candidates > 0:
+            chunks = chunks[:self.max_candidates]
+        return chunks
+
+    def separated(self, chunks: list[dict], top_n: int) -> bool:
+        # Without a chunk past the top_n there is no gap to test: the cross-encoder still orders them
+        if self.early_exit_gap <= 0 or len(chunks) <= top_n:
+            return False
+        # Chunks found only by keyword search have no distance to compare
+        if any("distance" not in c for c in chunks):
+            return False
+        # Hybrid results arrive in fused (RRF) order, not by distance
+        distances = sorted(c["distance"] for c in chunks)
+        return distances[top_n] - distances[top_n - 1] >= self.early_exit_gap
+
+    def scores(self, query: str, chunks: list[dict]) -> list[float]:
+        keys = [(query, chunk_key(c)) for c in chunks]
+        scores = [None] * len(chunks)
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            pairs = [(query, chunks[i]["content"]) for i in missing]
+            predicted = self.batcher.submit(pairs) if self.batcher is not None else self.predict(pairs)
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = scores[i]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        with self._lock:
+            self.pairs_scored += len(missing)
+            self.cache_hits += len(chunks) - len(missing)
+        return scores
+
+    def predict(self, pairs: list[tuple[str, str]]) -> list[float]:
+        return self.model_fn().predict(pairs, batch_size=self.batch_size)
+
+    def rerank(self, query: str, chunks: list[dict], top_n: int = 2) -> list[dict]:
+        if not chunks:
+            return []
+        candidates = self.candidates(chunks)
+        with self._lock:
+            self.queries += 1
+        if self.separated(candidates, top_n):
+            with self._lock:
+                self.early_exits += 1
+            return sorted(candidates, key=lambda c: c["distance"])[:top_n]
+        scores = self.scores(query, candidates)
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+        return [candidates[i] for i in order[:top_n]]
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "early_exits": self.early_exits,
+                "pairs_scored": self.pairs_scored,
+                "cache_hits": self.cache_hits,
+                "cached_scores": len(self._scores),
+                "max_candidates": self.max_candidates,
+            }
+
+reranker = Reranker()
+reranker.batcher = MicroBatcher(reranker.predict, name="rerank-batcher")
@@ -1,10 +1,37 @@
 # app/rag/retriever.py
+import hashlib
+import json
 import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
 import faiss
-import pickle
-from typing import List
-from sentence_transformers import SentenceTransformer, CrossEncoder
+import numpy as np
+from typing import Callable, Iterable, Iterator, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within the process
+    fcntl = None
+
+from app.rag.chunk_store import ChunkStore
+from app.rag.global_index import global_index
+from app.rag.index_factory import build_index, search_params
+from app.rag.bm25 import bm25_store, reciprocal_rank_fusion
+from app.rag.reranker import reranker, chunk_key
+from app.utils.batching import MicroBatcher
+from app.utils.model_provider import get_embed_model
+from app.utils.timing import span
+from app.config import (
+    EMBED_MODEL_NAME, RETRIEVER_CACHE_MAX_ENTRIES, RETRIEVER_CACHE_MAX_BYTES, SEARCH_MAX_WORKERS,
+    EMBED_BATCH_SIZE, EMBED_SORT_WINDOW, EMBED_PROCESSES, INGEST_EMBED_BATCH_WAIT_MS,
+    EMBED_CACHE_ENABLED, EMBED_CACHE_DIR, EMBED_CACHE_DTYPE, HYBRID_SEARCH_ENABLED, RRF_K,
+)
 
 # ==== Config: dynamic data folder based on APP_ENV ====
 APP_ENV = os.getenv("APP_ENV", "dev")  # default dev
@@ -12,16 +39,18 @@ DATA_DIR = Path(f"data_{APP_ENV}") if APP_ENV != "dev" else Path("data")
 INDEX_DIR = DATA_DIR / "index"
 
 class FaissRetriever:
-    def __init__(self, index_path: Path, metadata_path: Path):
+    def __init__(self, index_path: Path, metadata_path: Path, embed_model=None):
         if not index_path.exists() or not metadata_path.exists():
             raise FileNotFoundError(f"FAISS index or metadata not found: {index_path}, {metadata_path}")
 
         self.index = faiss.read_index(str(index_path))
+        # Memory-mapped: only the chunks that are actually returned get decoded
+        self.metadata = ChunkStore(metadata_path)
 
-        with open(metadata_path, "rb") as f:
-            self.metadata = pickle.load(f)
+        self.embed_model = embed_model if embed_model is not None else get_embed_model()
 
-        self.embed_model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
+        # Rough memory footprint, used by RetrieverRegistry for its byte budget
+        self.nbytes = self.index.ntotal * self.index.d * 4 + self.metadata.nbytes
 
     def retrieve(self, query: str, top_k: int = 5) -> List[dict]:
         query_emb = self.embed_model.encode([query])
@@ -30,54 +59,508 @@ class FaissRetriever:
         results = []
         for idx in indices[0]:
             if idx != -1:
-                results.append(self.metadata[idx])
+                results.append(self.metadata.get(idx))
         return results
 
 
+class RetrieverRegistry:
+    """
+    Process-wide LRU cache of loaded FaissRetriever objects, keyed by file_id.
+    Bounded both by number of entries and by estimated memory (bytes).
+    """
+    def __init__(self, index_dir: Path = INDEX_DIR,
+                 max_entries: int = RETRIEVER_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RETRIEVER_CACHE_MAX_BYTES):
+        self.index_dir = index_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, FaissRetriever]" = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, file_id: str) -> FaissRetriever:
+        with self._lock:
+            retriever = self._entries.get(file_id)
+            if retriever is not None:
+                self._entries.move_to_end(file_id)
+                self.hits += 1
+                return retriever
+            self.misses += 1
+            generation = self._generations.get(file_id, 0)
+
+        # Load outside the lock so a slow disk read does not block other files
+        with span("index_load"):
+            retriever = FaissRetriever(self.index_dir / f"{file_id}.faiss", self.index_dir / f"{file_id}.chunks")
+
+        with self._lock:
+            # Index was rewritten while we were loading: serve it, but don't cache it
+            if self._generations.get(file_id, 0) != generation:
+                return retriever
+            existing = self._entries.get(file_id)
+            if existing is not None:
+                return existing
+            self._entries[file_id] = retriever
+            self._bytes += retriever.nbytes
+            self._evict()
+        return retriever
+
+    def invalidate(self, file_id: str):
+        """
+        Drop the cached retriever for file_id (call after its index is rewritten).
+        """
+        with self._lock:
+            self._generations[file_id] = self._generations.get(file_id, 0) + 1
+            retriever = self._entries.pop(file_id, None)
+            if retriever is not None:
+                self._bytes -= retriever.nbytes
+
+    def clear(self):
+        with self._lock:
+            for file_id in self._entries:
+                self._generations[file_id] = self._generations.get(file_id, 0) + 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the byte budget
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, retriever = self._entries.popitem(last=False)
+            self._bytes -= retriever.nbytes
+            self.evictions += 1
+
+
+retriever_registry = RetrieverRegistry()
+
+
 def build_faiss_index(docs: list[dict], index_path: Path, metadata_path: Path):
     # docs: list of dict: {"content": ..., "file_id": ..., "file_name": ..., "page_number": ...}
     index_path.parent.mkdir(parents=True, exist_ok=True)
     metadata_path.parent.mkdir(parents=True, exist_ok=True)
 
-    model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-    embeddings = model.encode([doc["content"] for doc in docs])
+    embeddings = embed_texts([doc["content"] for doc in docs])
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    index = build_index(embeddings)
 
     faiss.write_index(index, str(index_path))
-    with open(metadata_path, "wb") as f:
-        pickle.dump(docs, f)
+    ChunkStore.write(metadata_path, enumerate(docs))
 
 
 # ==== Default mock paths for quick retrieval ====
 INDEX_PATH = INDEX_DIR / "mock_index.faiss"
-META_PATH = INDEX_DIR / "mock_index.pkl"
+META_PATH = INDEX_DIR / "mock_index.chunks"
 
 def get_relevant_context(query: str, top_k: int = 2):
     retriever = FaissRetriever(INDEX_PATH, META_PATH)
     return retriever.retrieve(query, top_k)
 
 def get_relevant_context_for_file(query: str, file_id: str, top_k: int = 2, threshold: float = None):
-    index_path = INDEX_DIR / f"{file_id}.faiss"
-    meta_path = INDEX_DIR / f"{file_id}.pkl"
-    retriever = FaissRetriever(index_path, meta_path)
-    query_emb = retriever.embed_model.encode([query])
-    distances, indices = retriever.index.search(query_emb, top_k)
-    results = []
-    for dist, idx in zip(distances[0], indices[0]):
-        if idx != -1 and (threshold is None or dist < threshold):
-            results.append(retriever.metadata[idx])
-    return results
-
-# Add cross-encoder model for reranking
-cross_encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+    query_emb = encode_queries([query])[0]
+    return search_indexes(query_emb, [file_id], top_k=top_k, threshold=threshold, max_workers=1)
+
+# ==== Multi-index search: encode once, search many ====
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+def _get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    if _search_pool is None:
+        with _search_pool_lock:
+            if _search_pool is None:
+                _search_pool = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS, thread_name_prefix="faiss-search")
+    return _search_pool
+
+# ==== Ingestion embedding: batched, length-sorted, streamed ====
+_embed_pool = None
+_embed_pool_lock = threading.Lock()
+
+def _get_embed_pool():
+    """
+    Multi-process encode pool (CPU-only hosts), started on first use when EMBED_PROCESSES > 1.
+    """
+    global _embed_pool
+    if EMBED_PROCESSES <= 1:
+        return None
+    if _embed_pool is None:
+        with _embed_pool_lock:
+            if _embed_pool is None:
+                _embed_pool = get_embed_model().start_multi_process_pool(["cpu"] * EMBED_PROCESSES)
+    return _embed_pool
+
+def stop_embed_pool():
+    global _embed_pool
+    with _embed_pool_lock:
+        if _embed_pool is not None:
+            get_embed_model().stop_multi_process_pool(_embed_pool)
+            _embed_pool = None
+
+# ==== Persistent embedding cache ====
+class EmbeddingCache:
+    """
+    Disk-backed cache of chunk embeddings keyed by (model name, normalized-text hash).
+    - vectors.bin: raw float16/float32 rows, appended, read through np.memmap
+    - keys.bin: one 16-byte digest per row (same order); loaded into a dict on open
+    - meta.json: dim and dtype
+    Rows are only ever appended; a torn tail after a crash is truncated on open.
+    Appends hold an exclusive flock on .lock (where fcntl exists), so several
+    processes (e.g. uvicorn workers) can share one cache: each picks up the rows
+    the others appended before adding its own.
+    """
+    KEY_BYTES = 16
+
+    def __init__(self, cache_dir: Path, model_name: str, dtype: str = EMBED_CACHE_DTYPE):
+        self.dir = cache_dir / re.sub(r"[^\w.-]", "_", model_name)
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self._rows: dict[bytes, int] = {}
+        self._count = 0  # rows on disk (a key appended by two processes takes two rows)
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._open()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def key(self, text: str) -> bytes:
+        payload = f"{self.model_name}\0{self.normalize(text)}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=self.KEY_BYTES).digest()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @contextmanager
+    def _locked(self):
+        # Thread lock for this instance, then the file lock shared with other processes
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)  # also if the cache was deleted meanwhile
+            with open(self.dir / ".lock", "a+b") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _open(self):
+        with self._locked():
+            self._refresh()
+
+    def _refresh(self):
+        """
+        Read the rows appended since the last refresh (by any process). Caller holds _locked(),
+        so no append is in progress: a partially written tail is from a crash and is dropped.
+        """
+        meta_path = self.dir / "meta.json"
+        if not meta_path.exists():
+            self._reset()  # nothing stored yet, or the cache was deleted: start over
+            self.dim = None
+            return
+        if self.dim is None:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+
+        keys_path, vectors_path = self.dir / "keys.bin", self.dir / "vectors.bin"
+        row_bytes = self.dim * self.dtype.itemsize
+        n_keys = keys_path.stat().st_size // self.KEY_BYTES if keys_path.exists() else 0
+        n_vectors = vectors_path.stat().st_size // row_bytes if vectors_path.exists() else 0
+        n = min(n_keys, n_vectors)
+
+        # Drop a partially written tail (crash between the two appends)
+        for path, size in ((keys_path, n * self.KEY_BYTES), (vectors_path, n * row_bytes)):
+            if path.exists() and path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        if n < self._count:
+            self._reset()  # replaced by a shorter cache: read it from the start
+        if n == self._count:
+            return
+        with open(keys_path, "rb") as f:
+            f.seek(self._count * self.KEY_BYTES)
+            raw_keys = f.read((n - self._count) * self.KEY_BYTES)
+        for i in range(n - self._count):
+            self._rows.setdefault(raw_keys[i * self.KEY_BYTES:(i + 1) * self.KEY_BYTES], self._count + i)
+        self._count = n
+        self._remap()
+
+    def _reset(self):
+        self._rows = {}
+        self._count = 0
+        self._vectors = None
+
+    def _remap(self):
+        n = self._count
+        self._vectors = (
+            np.memmap(self.dir / "vectors.bin", dtype=self.dtype, mode="r", shape=(n, self.dim)) if n else None
+        )
+
+    def lookup(self, texts: list[str]) -> tuple[list[int], np.ndarray]:
+        """
+        Returns (positions of texts found in the cache, their float32 embeddings).
+        """
+        keys = [self.key(t) for t in texts]
+        with self._lock:
+            rows = [self._rows.get(k) for k in keys]
+            vectors = self._vectors
+        hit_positions = [i for i, row in enumerate(rows) if row is not None]
+        if not hit_positions:
+            return [], np.zeros((0, self.dim or 0), dtype="float32")
+        return hit_positions, np.asarray(vectors[[rows[i] for i in hit_positions]], dtype="float32")
+
+    def add(self, texts: list[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors)
+        with self._locked():
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                _replace_json(self.dir / "meta.json",
+                              {"model": self.model_name, "dim": self.dim, "dtype": self.dtype.name})
+
+            new_keys, new_rows = {}, []
+            for text, vector in zip(texts, vectors):
+                k = self.key(text)
+                if k not in self._rows and k not in new_keys:
+                    new_keys[k] = len(new_rows)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+
+            # Vectors first, then keys: a key never points past the end of vectors.bin
+            with open(self.dir / "vectors.bin", "ab") as f:
+                f.write(np.asarray(new_rows, dtype=self.dtype).tobytes())
+            with open(self.dir / "keys.bin", "ab") as f:
+                f.write(b"".join(new_keys))
+            for k, i in new_keys.items():
+                self._rows[k] = self._count + i
+            self._count += len(new_rows)
+            self._remap()
+
+def _replace_json(path: Path, data: dict):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(EMBED_CACHE_DIR, EMBED_MODEL_NAME)
+    return _embedding_cache
+
+def _encode_documents(texts: list[str]) -> np.ndarray:
+    return np.asarray(get_embed_model().encode(texts, batch_size=EMBED_BATCH_SIZE), dtype="float32")
+
+# Chunks of documents ingested concurrently are encoded together (helps most with many small PDFs);
+# a merged batch is re-sorted by length, as each document's window is only sorted on its own
+ingest_batcher = MicroBatcher(_encode_documents, max_wait=INGEST_EMBED_BATCH_WAIT_MS / 1000,
+                              max_batch=EMBED_SORT_WINDOW, name="ingest-embed-batcher", sort_key=len)
+
+def iter_embeddings(texts: Iterable[str], batch_size: int = EMBED_BATCH_SIZE,
+                    window: int = EMBED_SORT_WINDOW,
+                    progress: Callable[[int], None] = None,
+                    cache: EmbeddingCache | bool = True, stats: dict = None,
+                    use_batcher: bool = False) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream embeddings of texts with the shared model, without building the full matrix.
+    - Texts are consumed `window` at a time and sorted by length inside each window,
+      so every batch holds similar-length texts and wastes little padding
+    - Texts found in the embedding cache are not re-encoded; new embeddings are added to it
+      (cache=True uses the shared cache when EMBED_CACHE_ENABLED, False disables it)
+    - Yields (positions, embeddings) per window: positions index into the input order
+    - progress(n_done) is called after each window; stats gets cache_hits / cache_misses
+    - With use_batcher, windows of concurrent calls share encode calls (ingest_batcher,
+      when INGEST_EMBED_BATCH_WAIT_MS > 0; it encodes with EMBED_BATCH_SIZE)
+    """
+    if cache is True:
+        cache = get_embedding_cache() if EMBED_CACHE_ENABLED else None
+    elif cache is False:
+        cache = None
+    if stats is not None:
+        stats.setdefault("cache_hits", 0)
+        stats.setdefault("cache_misses", 0)
+    model = get_embed_model()
+    pool = _get_embed_pool()
+    texts = iter(texts)
+    offset = 0
+    while True:
+        chunk = list(islice(texts, window))
+        if not chunk:
+            break
+        hit_positions, hit_vectors = cache.lookup(chunk) if cache is not None else ([], None)
+        hit_set = set(hit_positions)
+        misses = [i for i in range(len(chunk)) if i not in hit_set]
+
+        order = sorted(misses, key=lambda i: len(chunk[i]))
+        sorted_texts = [chunk[i] for i in order]
+        positions = np.asarray(hit_positions + order, dtype="int64")
+        if sorted_texts:
+            if pool is not None:
+                embeddings = model.encode(sorted_texts, pool=pool, batch_size=batch_size)
+            elif use_batcher and ingest_batcher.enabled:
+                embeddings = ingest_batcher.submit(sorted_texts)
+            else:
+                embeddings = model.encode(sorted_texts, batch_size=batch_size)
+            embeddings = np.asarray(embeddings, dtype="float32")
+            if cache is not None:
+                cache.add(sorted_texts, embeddings)
+            if hit_positions:
+                embeddings = np.vstack([hit_vectors, embeddings])
+        else:
+            embeddings = hit_vectors
+
+        if stats is not None:
+            stats["cache_hits"] += len(hit_positions)
+            stats["cache_misses"] += len(misses)
+        yield offset + positions, embeddings
+        offset += len(chunk)
+        if progress is not None:
+            progress(offset)
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Encode document chunks with the shared embedding model. Returns float32 array (n, d).
+    """
+    embeddings = None
+    for positions, batch in iter_embeddings(texts):
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch.shape[1]), dtype="float32")
+        embeddings[positions] = batch
+    return embeddings if embeddings is not None else np.zeros((0, 0), dtype="float32")
+
+def count_tokens(texts: list[str]) -> list[int]:
+    """
+    Number of embedding-model tokens in each text (without special tokens).
+    """
+    tokenizer = get_embed_model().tokenizer
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+def _encode_batch(queries: list[str]) -> np.ndarray:
+    return np.asarray(get_embed_model().encode(queries), dtype="float32")
+
+# Queries of concurrent requests are encoded together
+query_batcher = MicroBatcher(_encode_batch, name="query-embed-batcher")
+
+def encode_queries(queries: list[str]) -> np.ndarray:
+    """
+    Encode query strings with the shared embedding model. Returns float32 array (n, d).
+    """
+    with span("encode"):
+        return np.asarray(query_batcher.submit(queries), dtype="float32").reshape(len(queries), -1)
+
+def _search_file(file_id: str, query_vectors: np.ndarray, top_k: int, threshold: float = None,
+                 nprobe: int = None, ef_search: int = None) -> list[list[dict]]:
+    retriever = retriever_registry.get(file_id)
+    params = search_params(retriever.index, nprobe=nprobe, ef_search=ef_search)
+    distances, indices = retriever.index.search(query_vectors, top_k, params=params)
+    per_query = []
+    for row_dist, row_idx in zip(distances, indices):
+        hits = []
+        for dist, idx in zip(row_dist, row_idx):
+            if idx != -1 and (threshold is None or dist < threshold):
+                hits.append({**retriever.metadata.get(idx), "distance": float(dist)})
+        per_query.append(hits)
+    return per_query
+
+def search_indexes(query_vectors: np.ndarray, file_ids: list[str], top_k: int = 2,
+                   threshold: float = None, max_workers: int = SEARCH_MAX_WORKERS,
+                   nprobe: int = None, ef_search: int = None):
+    """
+    Search the indexes of several files with already-encoded query vector(s).
+    - query_vectors: shape (d,) for one query, or (n, d) for a batch of queries
+    - Each file contributes up to top_k hits per query; hits are merged and sorted by distance
+    - FAISS releases the GIL, so files are searched in parallel when max_workers > 1
+    - nprobe (IVF) / ef_search (HNSW) override the index defaults for this call
+    Returns list[dict] for a single vector, list[list[dict]] for a batch.
+    Every hit is a copy of the chunk metadata plus a "distance" key.
+    """
+    query_vectors = np.asarray(query_vectors, dtype="float32")
+    single = query_vectors.ndim == 1
+    if single:
+        query_vectors = query_vectors.reshape(1, -1)
+
+    if max_workers > 1 and len(file_ids) > 1:
+        pool = _get_search_pool()
+        futures = [
+            pool.submit(_search_file, file_id, query_vectors, top_k, threshold, nprobe, ef_search)
+            for file_id in file_ids
+        ]
+        per_file = [future.result() for future in futures]
+    else:
+        per_file = [_search_file(file_id, query_vectors, top_k, threshold, nprobe, ef_search) for file_id in file_ids]
+
+    merged = []
+    for q in range(len(query_vectors)):
+        hits = [hit for file_hits in per_file for hit in file_hits[q]]
+        hits.sort(key=lambda hit: hit["distance"])
+        merged.append(hits)
+    return merged[0] if single else merged
+
+def search_documents(query_vector: np.ndarray, file_ids: list[str], top_k: int = 2,
+                     threshold: float = None, nprobe: int = None, ef_search: int = None,
+                     query: str = None) -> list[dict]:
+    """
+    Retrieve context for one encoded query across file_ids.
+    Documents in the global index are searched together in a single filtered
+    search; files that only have a legacy per-file index fall back to search_indexes.
+    Returns hits merged and sorted by distance. With the query text (and hybrid
+    search enabled), the BM25 index of the same documents is searched too and both
+    rankings are fused with reciprocal rank fusion, within the same hit budget.
+    """
+    with span("search"):
+        indexed = [f for f in file_ids if global_index.has_document(f)]
+        legacy = [f for f in file_ids if f not in indexed]
+
+        hits = []
+        if indexed:
+            # Same candidate budget as searching each file separately
+            hits += global_index.search(
+                query_vector, indexed, top_k=top_k * len(indexed), threshold=threshold,
+                nprobe=nprobe, ef_search=ef_search,
+            )[0]
+        if legacy:
+            hits += search_indexes(
+                query_vector, legacy, top_k=top_k, threshold=threshold, nprobe=nprobe, ef_search=ef_search,
+            )
+        hits.sort(key=lambda hit: hit["distance"])
+
+    if query and HYBRID_SEARCH_ENABLED and indexed:
+        with span("bm25"):
+            lexical = bm25_store.search(query, indexed, top_k=top_k * len(indexed))
+            chunks = global_index.get_chunks(chunk_id for chunk_id, _ in lexical)
+            lexical_hits = [
+                {**chunk, "bm25_score": score} for chunk, (_, score) in zip(chunks, lexical) if chunk is not None
+            ]
+            hits = reciprocal_rank_fusion([hits, lexical_hits], key=chunk_key, k=RRF_K)[:top_k * len(file_ids)]
+    return hits
 
 def rerank_context(query: str, context_chunks: list[dict], top_n: int = 2) -> list[dict]:
-    if not context_chunks:
-        return []
-    pairs = [(query, chunk["content"]) for chunk in context_chunks]
-    scores = cross_encoder.predict(pairs)
-    ranked = sorted(zip(scores, context_chunks), key=lambda x: x[0], reverse=True)
-    return [chunk for score, chunk in ranked[:min(top_n, len(ranked))]]
+    """
+    The top_n context_chunks by cross-encoder relevance (bounded and cached, see Reranker).
+    """
+    with span("rerank"):
+        return reranker.rerank(query, context_chunks, top_n=top_n)
@@ -1,8 +1,18 @@
-from fastapi import APIRouter
+import asyncio
+import json
+from fastapi import APIRouter, Request, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
-from typing import List
-from fastapi.responses import JSONResponse
+from typing import Dict, List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.services import chat_service
+from app.rag.retriever import retriever_registry, query_batcher, ingest_batcher
+from app.rag.reranker import reranker
+from app.services.answer_cache import answer_cache
+from app.utils.llm_client import llm_engine
+from app.utils.executors import query_executors, StageBusyError
+from app.utils.timing import record_timings
+from app.config import LLM_PRELOAD, QUERY_TIMEOUT, QUERY_DISCONNECT_POLL, SERVER_TIMING_ENABLED
 
 router = APIRouter()
 
@@ -10,29 +20,140 @@ class QueryRequest(BaseModel):
     query: str = Field(..., min_length=1, description="User query text")
     top_k: int = Field(2, ge=1, description="Number of top results to retrieve")
     file_ids: List[str] = Field(..., description="List of uploaded PDF file IDs")
+    nprobe: Optional[int] = Field(None, ge=1, description="IVF indexes: number of lists to probe")
+    ef_search: Optional[int] = Field(None, ge=1, description="HNSW indexes: search beam width")
+    debug: bool = Field(False, description="Include per-stage timings (ms) in the response")
 
 class ContextChunk(BaseModel):
     file_id: str
     file_name: str
     page_number: int
+    page_end: Optional[int] = None  # last page, for chunks spanning pages
     content: str
 
 class QueryResponse(BaseModel):
     query: str
     context: List[ContextChunk]
+    filenames: Dict[str, str] = {}  # file_id -> original filename, for the files in context
     answer: str
+    cache: Optional[str] = None  # hit | semantic_hit | miss | bypass
+    timings: Optional[Dict[str, float]] = None  # stage -> ms, with debug=true
 
 @router.post("/query", response_model=QueryResponse)
-def query_route(request: QueryRequest):
+async def query_route(request: QueryRequest, http_request: Request, response: Response):
     """
     Handles document-based queries:
     - Validates input via Pydantic
-    - Calls chat_service to get answer
+    - Runs chat_service's stages on their executors, without blocking the event loop
     - Returns query, context, and answer
+    429 when a stage's queue is full, 504 after QUERY_TIMEOUT seconds. If the
+    client disconnects first, the query is cancelled (generation stops too).
+    Stage timings go to /metrics; with SERVER_TIMING_ENABLED or debug=true they are
+    also sent in a Server-Timing header, and with debug=true in "timings".
     """
+    if LLM_PRELOAD and not llm_engine.is_ready():
+        return JSONResponse(content={"error": "LLM engine is not ready yet."}, status_code=503)
+    with record_timings("query") as timings:
+        task = asyncio.ensure_future(chat_service.handle_query_async(
+            request.query, request.top_k, request.file_ids,
+            nprobe=request.nprobe, ef_search=request.ef_search,
+        ))
+        watcher = asyncio.ensure_future(_cancel_on_disconnect(http_request, task))
+        try:
+            result = await asyncio.wait_for(task, QUERY_TIMEOUT if QUERY_TIMEOUT > 0 else None)
+        except asyncio.TimeoutError:
+            return JSONResponse(content={"error": "Query timed out."}, status_code=504)
+        except StageBusyError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=429)
+        except asyncio.CancelledError:
+            if not watcher.done() or watcher.cancelled():
+                raise  # the route itself is being cancelled
+            return Response(status_code=499)  # client closed the request; nobody reads this
+        except Exception as e:
+            # Match test expectation: {"error": "..."} with status 500
+            return JSONResponse(content={"error": str(e)}, status_code=500)
+        finally:
+            watcher.cancel()
+    if SERVER_TIMING_ENABLED or request.debug:
+        response.headers["Server-Timing"] = timings.server_timing()
+    if request.debug:
+        result = {**result, "timings": timings.as_ms()}
+    return result
+
+async def _cancel_on_disconnect(http_request: Request, task: asyncio.Task):
+    while not task.done():
+        if await http_request.is_disconnected():
+            task.cancel()
+            return
+        await asyncio.sleep(QUERY_DISCONNECT_POLL)
+
+@router.post("/query/stream")
+async def query_stream_route(request: QueryRequest, http_request: Request):
+    """
+    Same as /query, but answers as Server-Sent Events:
+    - event "context": {"query", "context", "filenames", "cache"} as soon as retrieval is done
+    - event "token": {"text"} for each piece of the answer as the LLM produces it
+    - event "done": {"answer"} with the final cleaned answer (replaces the streamed text)
+    - event "error": {"error"} if generation fails (or passes QUERY_TIMEOUT) after the stream has started
+    Retrieval and generation run on the query stage executors, like /query: 429 when
+    a stage's queue is full, 504 when retrieval alone takes QUERY_TIMEOUT seconds.
+    A client disconnecting cancels the query, and generation stops at the next token.
+    """
+    if LLM_PRELOAD and not llm_engine.is_ready():
+        return JSONResponse(content={"error": "LLM engine is not ready yet."}, status_code=503)
+    timeout = QUERY_TIMEOUT if QUERY_TIMEOUT > 0 else None
+    task = asyncio.ensure_future(chat_service.stream_query_async(
+        request.query, request.top_k, request.file_ids,
+        nprobe=request.nprobe, ef_search=request.ef_search, timeout=timeout,
+    ))
+    watcher = asyncio.ensure_future(_cancel_on_disconnect(http_request, task))
     try:
-        result = chat_service.handle_query(request.query, request.top_k, request.file_ids)
-        return result
+        events = await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        return JSONResponse(content={"error": "Query timed out."}, status_code=504)
+    except StageBusyError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=429)
+    except asyncio.CancelledError:
+        if not watcher.done() or watcher.cancelled():
+            raise
+        return Response(status_code=499)
     except Exception as e:
-        # Match test expectation: {"error": "..."} with status 500
         return JSONResponse(content={"error": str(e)}, status_code=500)
+    finally:
+        watcher.cancel()
+
+    async def sse():
+        # Starlette cancels this when the client disconnects: closing events stops generation
+        try:
+            async for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        sse(), media_type="text/event-stream",
+        # Disable proxy buffering so tokens reach the client as they are produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/cache/stats")
+def cache_stats():
+    """
+    Hit/miss/eviction counters of the in-memory retriever, answer and rerank score caches.
+    """
+    return {"retrievers": retriever_registry.stats(), "answers": answer_cache.stats(), "rerank": reranker.stats()}
+
+@router.get("/batching/stats")
+def batching_stats():
+    """
+    Micro-batching counters (batch size histogram) of query embedding, reranking and ingestion embedding.
+    """
+    return {"query_embeddings": query_batcher.stats(), "rerank": reranker.batcher.stats(),
+            "ingest_embeddings": ingest_batcher.stats()}
+
+@router.get("/executors/stats")
+def executors_stats():
+    """
+    Load of the per-stage query executors (embed, search, rerank, llm): active, completed, rejected, cancelled calls.
+    """
+    return query_executors.stats()
@@ -1,10 +1,15 @@
 # app/routes/upload.py
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
 from app.services import document_service
-from app.config import UPLOAD_DIR
+from app.services.catalog import catalog
+from app.services.ingestion_service import job_manager, QueueFullError
+from app.config import UPLOAD_DIR, UPLOAD_BATCH_MAX_FILES
 import logging
-import json
+import re
 
 # Configure logging for this module
 logging.basicConfig(level=logging.INFO)  # ensures logs show in console
@@ -12,22 +17,17 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.propagate = True  # allow log to propagate to root logger (uvicorn)
 
-# Try to import PdfReadError from either pypdf or PyPDF2; fall back to a dummy class.
-try:
-    from pypdf.errors import PdfReadError  # type: ignore
-except Exception:
-    try:
-        from PyPDF2.errors import PdfReadError  # type: ignore
-    except Exception:
-        class PdfReadError(Exception):  # fallback
-            pass
-
 router = APIRouter()
 
 ALLOWED_EXTENSIONS = {".pdf"}
-
-@router.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+FILE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+async def accept_upload(file: UploadFile) -> tuple[int, dict]:
+    """
+    Validate, save and queue one uploaded PDF. Returns (status code, body):
+    202 "queued", or 200 "duplicate" when the same content is already indexed.
+    Raises HTTPException when the file is rejected.
+    """
     # Validate extension
     ext = file.filename.lower().rsplit(".", 1)
     if len(ext) < 2 or f".{ext[1]}" not in ALLOWED_EXTENSIONS:
@@ -35,39 +35,115 @@ async def upload_document(file: UploadFile = File(...)):
             status_code=415,
             detail=f"Unsupported file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
         )
+    if not job_manager.has_capacity():
+        raise HTTPException(status_code=429, detail="Too many documents are being processed, please retry later.")
 
     try:
-        # Save and process
-        saved_path, file_id = document_service.save_upload_file(file)
-        index_path, metadata_path, chunks = document_service.process_and_index_document(
-            saved_path, file_id=file_id
-        )
-
-        # If downstream returns empty chunks
-        if not chunks or all(not c["content"].strip() for c in chunks):
-            raise HTTPException(status_code=422, detail="Empty or no text extracted from PDF.")
-
-        logger.info("Uploaded PDF: %s, file_id: %s, chunks: %d", file.filename, file_id, len(chunks))
+        # Blocking disk I/O runs in the threadpool, not on the event loop
+        saved_path, file_id, content_hash = await run_in_threadpool(document_service.save_upload_file, file)
+    except document_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error during upload: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {
-            "status": "success",
-            "file_id": file_id,
+    # Same content already indexed: reuse it, skip parsing and embedding entirely
+    existing_id = await run_in_threadpool(document_service.find_document_by_hash, content_hash)
+    if existing_id:
+        await run_in_threadpool(document_service.delete_document, file_id)
+        logger.info("Duplicate upload %s, reusing file_id: %s", file.filename, existing_id)
+        return 200, {
+            "status": "duplicate",
+            "job_id": None,
+            "file_id": existing_id,
             "filename": file.filename,
-            "chunks": len(chunks),
-            "index_path": str(index_path),
-            "metadata_path": str(metadata_path),
-            "message": "File uploaded and indexed successfully."
+            "message": "Identical document already indexed."
         }
 
-    except ValueError as e:
-        raise HTTPException(status_code=422, detail=str(e))
-    except PdfReadError as e:
-        raise HTTPException(status_code=422, detail=f"Invalid or unreadable PDF: {e}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error("Unexpected error during upload: %s", e, exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        job = job_manager.submit(saved_path, file_id, file.filename, content_hash=content_hash)
+    except QueueFullError as e:
+        await run_in_threadpool(document_service.delete_document, file_id)
+        raise HTTPException(status_code=429, detail=str(e))
+
+    if job.get("duplicate"):
+        # Same content is being indexed right now: point the client at that job
+        await run_in_threadpool(document_service.delete_document, file_id)
+        file_id = job["file_id"]
+
+    logger.info("Uploaded PDF: %s, file_id: %s, job_id: %s", file.filename, file_id, job["job_id"])
+
+    return 202, {
+        "status": "queued",
+        "job_id": job["job_id"],
+        "file_id": file_id,
+        "filename": file.filename,
+        "message": "File uploaded, indexing started."
+    }
+
+@router.post("/upload", status_code=202)
+async def upload_document(file: UploadFile = File(...)):
+    """
+    Save the PDF and queue it for indexing. Returns immediately with a job_id;
+    poll GET /documents/jobs/{job_id} for progress.
+    """
+    status_code, body = await accept_upload(file)
+    return JSONResponse(status_code=status_code, content=body)
+
+
+@router.post("/upload/batch", status_code=202)
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """
+    Upload several PDFs in one multipart request (field "files", repeated).
+    Every file is handled as by POST /upload, concurrently; the jobs then run on
+    the ingestion worker pool, where documents indexed at the same time share
+    embedding batches. One file failing does not fail the others:
+    {"files": [per-file result, in request order], "queued", "duplicates", "failed"},
+    where a failed file has "status": "error", "status_code" and "error".
+    Returns 202 if any file was queued, 200 otherwise.
+    """
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files: limit is {UPLOAD_BATCH_MAX_FILES} per request.")
+
+    async def one(file: UploadFile) -> dict:
+        try:
+            return (await accept_upload(file))[1]
+        except HTTPException as e:
+            return {"status": "error", "status_code": e.status_code, "error": e.detail,
+                    "job_id": None, "file_id": None, "filename": file.filename}
+
+    results = await asyncio.gather(*(one(file) for file in files))
+    counts = {status: sum(r["status"] == status for r in results) for status in ("queued", "duplicate", "error")}
+    return JSONResponse(status_code=202 if counts["queued"] else 200, content={
+        "files": results,
+        "queued": counts["queued"],
+        "duplicates": counts["duplicate"],
+        "failed": counts["error"],
+    })
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Ingestion job status: state (queued/running/done/failed), progress and error.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.delete("/{file_id}")
+def delete_document(file_id: str):
+    """
+    Remove a document from the index and delete its stored PDF.
+    """
+    if not FILE_ID_PATTERN.fullmatch(file_id):
+        raise HTTPException(status_code=400, detail="Invalid file_id")
+    if not document_service.delete_document(file_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    logger.info("Deleted document file_id: %s", file_id)
+    return {"status": "deleted", "file_id": file_id}
 
 
 @router.get("/pdf/{file_id}")
@@ -86,14 +162,17 @@ def get_pdf(file_id: str):
     return FileResponse(str(pdf_path), media_type="application/pdf")
 
 
+@router.get("/filenames")
+def get_filenames(file_ids: List[str] = Query(..., description="Repeat for each file: ?file_ids=a&file_ids=b")):
+    """
+    Original filenames of several documents in one call: {"filenames": {file_id: filename}}.
+    Unknown file_ids are left out.
+    """
+    return {"filenames": catalog.filenames(file_ids)}
+
 @router.get("/filename/{file_id}")
 def get_filename(file_id: str):
-    map_path = UPLOAD_DIR / "file_map.json"
-    if not map_path.exists():
-        raise HTTPException(status_code=404, detail="File map not found")
-    with open(map_path, "r", encoding="utf-8") as f:
-        file_map = json.load(f)
-    filename = file_map.get(file_id)
+    filename = catalog.filename(file_id)
     if not filename:
         raise HTTPException(status_code=404, detail="Original filename not found")
     return {"file_id": file_id, "filename": filename}
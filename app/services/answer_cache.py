@@ -0,0 +1,155 @@
+# app/services/answer_cache.py
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+from app.config import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_SEMANTIC_THRESHOLD,
+    EMBED_MODEL_NAME, LLM_MODEL_PATH,
+)
+from app.rag.global_index import global_index
+
+def normalize_query(query: str) -> str:
+    query = " ".join(unicodedata.normalize("NFC", query).casefold().split())
+    return query.rstrip("?!.。 ")
+
+class AnswerCache:
+    """
+    In-memory cache of query results, LRU-evicted and expiring after ttl seconds.
+    Keyed by (normalized query, sorted file_ids, their index versions, model id,
+    retrieval parameters): re-indexing a document bumps its version, so stale
+    answers can never be served, and invalidate(file_id) frees them eagerly.
+    With semantic_threshold > 0, a miss falls back to the cached query (same
+    files, versions and parameters) whose embedding has the highest cosine
+    similarity, if it is above the threshold.
+    """
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL,
+                 semantic_threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD, enabled: bool = ANSWER_CACHE_ENABLED,
+                 model_id: str = f"{EMBED_MODEL_NAME}|{LLM_MODEL_PATH}", versions=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.enabled = enabled
+        self.model_id = model_id
+        self._versions = versions or global_index.version
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._scopes: dict[tuple, set] = {}  # scope -> keys, for semantic lookups
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, query: str, file_ids: list[str], **params) -> tuple:
+        """
+        Cache key of a query. Take it before retrieval and pass the same key to
+        put(), so an answer computed while a document was being re-indexed is
+        stored under the versions it was computed from.
+        params are the retrieval parameters that shape the answer (top_k, nprobe...).
+        """
+        files = tuple(sorted(set(file_ids)))
+        return (
+            normalize_query(query), files, tuple(self._versions(f) for f in files), self.model_id,
+            tuple(sorted((k, v) for k, v in params.items() if v is not None)),
+        )
+
+    def get(self, key: tuple, query_vector=None) -> tuple[dict, str]:
+        """
+        Returns (cached result, "hit" | "semantic_hit") or (None, "miss" | "bypass").
+        """
+        if not self.enabled:
+            return None, "bypass"
+        scope = key[1:]
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created_at"] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["result"], "hit"
+
+            if self.semantic_threshold > 0 and query_vector is not None:
+                best_key, best_sim = None, self.semantic_threshold
+                q = _unit(query_vector)
+                for other in list(self._scopes.get(scope, ())):
+                    candidate = self._entries[other]
+                    if now - candidate["created_at"] > self.ttl:
+                        self._drop(other)
+                        continue
+                    if candidate["vector"] is not None:
+                        sim = float(np.dot(q, candidate["vector"]))
+                        if sim >= best_sim:
+                            best_key, best_sim = other, sim
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key]["result"], "semantic_hit"
+            self.misses += 1
+            return None, "miss"
+
+    def put(self, key: tuple, result: dict, query_vector=None):
+        if not self.enabled:
+            return
+        scope = key[1:]
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {
+                "result": result,
+                "vector": None if query_vector is None else _unit(query_vector),
+                "created_at": time.monotonic(),
+                "file_ids": key[1],
+            }
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, file_id: str):
+        """
+        Drop every cached answer that involved file_id (call when it is re-indexed or deleted).
+        """
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if file_id in e["file_ids"]]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "semantic_threshold": self.semantic_threshold,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _drop(self, key: tuple):
+        self._entries.pop(key, None)
+        scope = key[1:]
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype="float32").ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,228 @@
+# app/services/catalog.py
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from app.config import CATALOG_PATH, CATALOG_CACHE_SIZE, UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        file_id       TEXT PRIMARY KEY,
+        filename      TEXT NOT NULL,
+        content_hash  TEXT,
+        chunk_count   INTEGER,
+        index_version INTEGER,
+        created_at    REAL NOT NULL,
+        updated_at    REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)",
+)
+COLUMNS = ("file_id", "filename", "content_hash", "chunk_count", "index_version", "created_at", "updated_at")
+
+class DocumentCatalog:
+    """
+    Catalog of uploaded documents (file_id, original filename, content hash, chunk
+    count, index version, timestamps) in SQLite, in WAL mode: readers never block
+    the writer, every write is one atomic transaction, and lookups use indexes.
+    Each thread gets its own connection. Rows read by file_id are kept in an
+    in-process LRU cache that this process's writes invalidate.
+    On first use, the JSON maps of older versions (file_map.json: file_id ->
+    filename, hash_map.json: content hash -> file_id) are imported.
+    """
+    def __init__(self, db_path: Path = CATALOG_PATH, legacy_dir: Path = UPLOAD_DIR,
+                 cache_size: int = CATALOG_CACHE_SIZE):
+        self.db_path = Path(db_path)
+        self.legacy_dir = Path(legacy_dir)
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._generation = 0  # bumped by every write, so a read racing with one is not cached
+
+    # ==== Connections / schema ====
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # Autocommit mode: transactions are explicit (see _write)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        self._init_schema(conn)
+                        self._initialized = True
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._import_legacy_maps(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy_maps(self, conn: sqlite3.Connection):
+        file_map = _read_json(self.legacy_dir / "file_map.json")
+        hash_map = _read_json(self.legacy_dir / "hash_map.json")
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO documents (file_id, filename, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            [(file_id, filename, now, now) for file_id, filename in file_map.items()],
+        )
+        conn.executemany(
+            "UPDATE documents SET content_hash = ? WHERE file_id = ?",
+            [(content_hash, file_id) for content_hash, file_id in hash_map.items()],
+        )
+        if file_map or hash_map:
+            logger.info("Imported %d documents and %d content hashes into the catalog",
+                        len(file_map), len(hash_map))
+
+    def _write(self, sql: str, params: tuple) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = conn.execute(sql, params).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rowcount
+
+    def _invalidate(self, file_id: str):
+        with self._cache_lock:
+            self._cache.pop(file_id, None)
+            self._generation += 1
+
+    # ==== Writes ====
+    def add(self, file_id: str, filename: str):
+        """
+        Record an uploaded document (or rename it, if file_id is already known).
+        """
+        now = time.time()
+        self._write(
+            "INSERT INTO documents (file_id, filename, created_at, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (file_id) DO UPDATE SET filename = excluded.filename, updated_at = excluded.updated_at",
+            (file_id, filename, now, now),
+        )
+        self._invalidate(file_id)
+
+    def set_content_hash(self, file_id: str, content_hash: str):
+        self._write("UPDATE documents SET content_hash = ?, updated_at = ? WHERE file_id = ?",
+                    (content_hash, time.time(), file_id))
+        self._invalidate(file_id)
+
+    def mark_indexed(self, file_id: str, chunk_count: int, index_version: int):
+        self._write("UPDATE documents SET chunk_count = ?, index_version = ?, updated_at = ? WHERE file_id = ?",
+                    (chunk_count, index_version, time.time(), file_id))
+        self._invalidate(file_id)
+
+    def remove(self, file_id: str) -> bool:
+        removed = self._write("DELETE FROM documents WHERE file_id = ?", (file_id,)) > 0
+        self._invalidate(file_id)
+        return removed
+
+    # ==== Reads ====
+    def get(self, file_id: str) -> dict:
+        """
+        The catalog row of file_id as a dict, or None.
+        """
+        with self._cache_lock:
+            row = self._cache.get(file_id)
+            if row is not None:
+                self._cache.move_to_end(file_id)
+                return dict(row)
+            generation = self._generation
+        found = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE file_id = ?", (file_id,),
+        ).fetchone()
+        if found is None:
+            return None
+        row = dict(found)
+        with self._cache_lock:
+            if self._generation != generation:
+                return dict(row)
+            self._cache[file_id] = row
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(row)
+
+    def filename(self, file_id: str) -> str:
+        row = self.get(file_id)
+        return row["filename"] if row else None
+
+    def filenames(self, file_ids: list[str]) -> dict[str, str]:
+        """
+        {file_id: filename} for the known file_ids: cached rows, plus one query for the rest.
+        """
+        result, missing = {}, []
+        with self._cache_lock:
+            for file_id in dict.fromkeys(file_ids):
+                row = self._cache.get(file_id)
+                if row is not None:
+                    result[file_id] = row["filename"]
+                else:
+                    missing.append(file_id)
+        # One query per 500 ids keeps below SQLite's bound-parameter limit
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            rows = self._conn().execute(
+                f"SELECT file_id, filename FROM documents WHERE file_id IN ({', '.join('?' * len(batch))})", batch,
+            )
+            result.update((row["file_id"], row["filename"]) for row in rows)
+        return result
+
+    def find_by_hash(self, content_hash: str) -> str:
+        """
+        file_id of the most recently updated document with this content, or None.
+        """
+        found = self._conn().execute(
+            "SELECT file_id FROM documents WHERE content_hash = ? ORDER BY updated_at DESC LIMIT 1",
+            (content_hash,),
+        ).fetchone()
+        return found["file_id"] if found else None
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        """
+        Close the calling thread's connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _read_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+            return json.loads(content) if content else {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not import %s: %s", path, e)
+        return {}
+
+
+catalog = DocumentCatalog()
@@ -1,14 +1,16 @@
 # app/services/chat_service.py
-from app.rag.retriever import get_relevant_context_for_file, rerank_context
-from app.rag.rag_pipeline import generate_answer
-
-def handle_query(user_query: str, top_k: int = 2, file_ids: list = None) -> dict:
-    """
-    Process a user's query:
-    1. Retrieve top_k relevant context from EACH FAISS index (each file)
-    2. Pass all context + query to LLM for generating answer
-    """
+import asyncio
+import threading
+import weakref
+from typing import AsyncIterator
+from app.rag.retriever import encode_queries, search_documents, rerank_context
+from app.rag.rag_pipeline import generate_answer, stream_answer
+from app.utils.llm_client import AnswerCleaner
+from app.services.answer_cache import answer_cache
+from app.services.catalog import catalog
+from app.utils.executors import query_executors
 
+def validate_query(user_query: str, top_k: int, file_ids: list):
     if not user_query.strip():
         raise ValueError("Query cannot be empty.")
     if top_k <= 0:
@@ -16,10 +18,22 @@ def handle_query(user_query: str, top_k: int = 2, file_ids: list = None) -> dict
     if not file_ids or not isinstance(file_ids, list):
         raise ValueError("file_ids is required and must be a list.")
 
-    # Get top_k context for each file_id
-    context_docs = []
-    for file_id in file_ids:
-        context_docs += get_relevant_context_for_file(user_query, file_id, top_k=top_k)
+def retrieve_context(user_query: str, top_k: int = 2, file_ids: list = None,
+                     nprobe: int = None, ef_search: int = None, query_vector=None) -> list[dict]:
+    """
+    Validate a query and return its reranked context docs.
+    Encodes the query once (unless query_vector is given) and retrieves top_k
+    relevant context per file (one filtered search on the global index, fused
+    with a BM25 keyword search of the same documents).
+    nprobe / ef_search are optional ANN search knobs (IVF / HNSW indexes).
+    """
+    validate_query(user_query, top_k, file_ids)
+
+    # Get top_k context for each file_id, merged by distance
+    if query_vector is None:
+        query_vector = encode_queries([user_query])[0]
+    context_docs = search_documents(query_vector, file_ids, top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+                                    query=user_query)
 
     # Optionally, limit total context_docs if needed (e.g. max 10)
     # MAX_CONTEXT = 10
@@ -28,19 +42,266 @@ def handle_query(user_query: str, top_k: int = 2, file_ids: list = None) -> dict
     # Rerank entire context_docs, get top_k most relevant (if any)
     if context_docs:
         context_docs = rerank_context(user_query, context_docs, top_n=top_k)
+    return context_docs
+
+def context_filenames(context_docs: list[dict]) -> dict[str, str]:
+    """
+    Original (uploaded) filenames of the documents in context_docs, by file_id.
+    """
+    return catalog.filenames([doc["file_id"] for doc in context_docs if doc.get("file_id")])
+
+def handle_query(user_query: str, top_k: int = 2, file_ids: list = None,
+                 nprobe: int = None, ef_search: int = None) -> dict:
+    """
+    Process a user's query:
+    1. Serve it from the answer cache if the same (or a near-duplicate) question
+       was answered on the same document versions
+    2. Otherwise retrieve the reranked context (see retrieve_context)
+    3. Pass all context + query to LLM for generating answer
+    The result has "filenames": the original filename of every file_id in the context.
+    The result's "cache" is "hit", "semantic_hit", "miss" or "bypass" (cache disabled).
+    """
+    validate_query(user_query, top_k, file_ids)
+    query_vector = encode_queries([user_query])[0]
+    cache_key = answer_cache.key(user_query, file_ids, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
+    cached, cache_status = answer_cache.get(cache_key, query_vector)
+    if cached is not None:
+        return {**cached, "query": user_query, "cache": cache_status}
+
+    context_docs = retrieve_context(user_query, top_k, file_ids, nprobe=nprobe, ef_search=ef_search,
+                                    query_vector=query_vector)
 
     # If still blank, we can return a message or pass it to the LLM to answer "I don't know"
     if not context_docs:
-        return {
-            "query": user_query,
-            "context": context_docs,
-            "answer": "I don't know"
-        }
-
-    answer = generate_answer(user_query, context_docs)
+        answer = "I don't know"
+    else:
+        answer = generate_answer(user_query, context_docs)
 
-    return {
+    result = {
         "query": user_query,
         "context": context_docs,
+        "filenames": context_filenames(context_docs),
         "answer": answer
     }
+    answer_cache.put(cache_key, result, query_vector)
+    return {**result, "cache": cache_status}
+
+async def handle_query_async(user_query: str, top_k: int = 2, file_ids: list = None,
+                             nprobe: int = None, ef_search: int = None) -> dict:
+    """
+    handle_query for the async route: embedding, search, reranking and generation
+    each run on their own executor (see utils.executors), so the event loop is never
+    blocked and a slow stage only queues requests for that stage. Raises
+    StageBusyError when a stage's queue is full.
+    Cancelling the calling task (timeout, client gone) skips the remaining stages
+    and stops generation at the next token.
+    """
+    validate_query(user_query, top_k, file_ids)
+    query_vector = (await query_executors.embed.run(encode_queries, [user_query]))[0]
+    cache_key, cached, cache_status = await query_executors.search.run(
+        _cached_answer, user_query, file_ids, query_vector, top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+    )
+    if cached is not None:
+        return {**cached, "query": user_query, "cache": cache_status}
+
+    context_docs, filenames = await _retrieve_async(user_query, query_vector, top_k, file_ids, nprobe, ef_search)
+
+    if not context_docs:
+        answer = "I don't know"
+    else:
+        cancelled = threading.Event()
+        try:
+            answer = await query_executors.llm.run(_generate_until_cancelled, user_query, context_docs, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    result = {"query": user_query, "context": context_docs, "filenames": filenames, "answer": answer}
+    await query_executors.search.run(answer_cache.put, cache_key, result, query_vector)
+    return {**result, "cache": cache_status}
+
+def _cached_answer(user_query: str, file_ids: list, query_vector, **params) -> tuple[tuple, dict, str]:
+    # The key reads the documents' index versions: kept off the event loop with the lookup
+    cache_key = answer_cache.key(user_query, file_ids, **params)
+    cached, cache_status = answer_cache.get(cache_key, query_vector)
+    return cache_key, cached, cache_status
+
+async def _retrieve_async(user_query: str, query_vector, top_k: int, file_ids: list,
+                          nprobe: int = None, ef_search: int = None) -> tuple[list[dict], dict[str, str]]:
+    """
+    retrieve_context on the search and rerank executors, plus the context's filenames.
+    """
+    context_docs = await query_executors.search.run(
+        search_documents, query_vector, file_ids, top_k=top_k, nprobe=nprobe, ef_search=ef_search, query=user_query,
+    )
+    if context_docs:
+        context_docs = await query_executors.rerank.run(rerank_context, user_query, context_docs, top_n=top_k)
+    filenames = await query_executors.search.run(context_filenames, context_docs)
+    return context_docs, filenames
+
+def _generate_until_cancelled(user_query: str, context_docs: list[dict], cancelled: threading.Event) -> str:
+    """
+    The cleaned answer, generated token by token so that generation stops (and
+    frees the LLM) as soon as cancelled is set. Returns None when cancelled.
+    """
+    cleaner = AnswerCleaner()
+    tokens = stream_answer(user_query, context_docs)
+    try:
+        for text in tokens:
+            if cancelled.is_set():
+                return None
+            cleaner.feed(text)
+    finally:
+        close = getattr(tokens, "close", None)
+        if close is not None:
+            close()  # releases the engine slot held by the generator
+    cleaner.finish()
+    return cleaner.answer
+
+async def stream_query_async(user_query: str, top_k: int = 2, file_ids: list = None,
+                             nprobe: int = None, ef_search: int = None,
+                             timeout: float = None) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Streaming variant of handle_query_async. Retrieval (and validation) happen on the
+    stage executors before this returns, and generation is admitted to the llm
+    executor, so StageBusyError is raised before anything is streamed. The returned
+    async generator then yields (event, data) pairs:
+    ("context", {"query", "context", "filenames", "cache"}), ("token", {"text"}) for each cleaned
+    piece of the answer, and ("done", {"answer"}) with the final cleaned answer,
+    which may be shorter than the streamed text. Errors while generating (or going past
+    timeout seconds from this call) end the stream with ("error", {"error"}). Cached answers
+    are sent as a single token. Closing the stream (client gone), even before it is
+    iterated, stops generation at the next token.
+    """
+    validate_query(user_query, top_k, file_ids)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+    query_vector = (await query_executors.embed.run(encode_queries, [user_query]))[0]
+    cache_key, cached, cache_status = await query_executors.search.run(
+        _cached_answer, user_query, file_ids, query_vector, top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+    )
+    if cached is not None:
+        return _EventStream(_iterate([
+            ("context", {"query": user_query, "context": cached["context"],
+                         "filenames": cached.get("filenames", {}), "cache": cache_status}),
+            ("token", {"text": cached["answer"]}),
+            ("done", {"answer": cached["answer"]}),
+        ]))
+    context_docs, filenames = await _retrieve_async(user_query, query_vector, top_k, file_ids, nprobe, ef_search)
+    result = {"query": user_query, "context": context_docs, "filenames": filenames}
+
+    tokens = None
+    if context_docs:
+        tokens = _TokenStream(loop)
+        tokens.future = query_executors.llm.submit(_produce_tokens, user_query, context_docs, tokens)
+
+    async def events():
+        # Everything is inside the try: the producer is already running when the first event is sent
+        try:
+            yield "context", {**result, "cache": cache_status}
+            if tokens is None:
+                answer = "I don't know"
+                yield "done", {"answer": answer}
+                await query_executors.search.run(answer_cache.put, cache_key, {**result, "answer": answer},
+                                                 query_vector)
+                return
+            cleaner = AnswerCleaner()
+            try:
+                async for text in tokens.receive(deadline):
+                    delta = cleaner.feed(text)
+                    if delta:
+                        yield "token", {"text": delta}
+                tail = cleaner.finish()
+                if tail:
+                    yield "token", {"text": tail}
+            except asyncio.TimeoutError:
+                yield "error", {"error": "Query timed out."}
+                return
+            except Exception as e:
+                yield "error", {"error": str(e)}
+                return
+            await query_executors.search.run(answer_cache.put, cache_key, {**result, "answer": cleaner.answer},
+                                             query_vector)
+            yield "done", {"answer": cleaner.answer}
+        finally:
+            if tokens is not None:
+                tokens.close()
+
+    return _EventStream(events(), tokens)
+
+async def _iterate(items: list):
+    for item in items:
+        yield item
+
+class _EventStream:
+    """
+    The (event, data) pairs of stream_query_async. aclose() also stops generation when
+    the stream was never iterated (an unstarted async generator runs no finally), and
+    so does dropping it unclosed.
+    """
+    def __init__(self, events: AsyncIterator[tuple[str, dict]], tokens: "_TokenStream" = None):
+        self._events = events
+        self._tokens = tokens
+        if tokens is not None:
+            weakref.finalize(self, tokens.cancelled.set)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple[str, dict]:
+        return await self._events.__anext__()
+
+    async def aclose(self):
+        if self._tokens is not None:
+            self._tokens.close()
+        await self._events.aclose()
+
+class _TokenStream:
+    """
+    Hands the raw tokens produced on the llm executor to the event loop. The producer
+    stops at the next token once close() is called (stream finished or abandoned).
+    """
+    _END = object()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future: asyncio.Future = None
+        self.cancelled = threading.Event()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, text: str):
+        # Producer thread; queued in order, ahead of the future's completion
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, text)
+
+    async def receive(self, deadline: float = None) -> AsyncIterator[str]:
+        """
+        The tokens, then the producer's exception if it failed. Raises
+        asyncio.TimeoutError once the loop's time passes deadline.
+        """
+        self.future.add_done_callback(lambda _: self._queue.put_nowait(self._END))
+        while True:
+            remaining = deadline - self.loop.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            text = await asyncio.wait_for(self._queue.get(), remaining)
+            if text is self._END:
+                break
+            yield text
+        self.future.result()
+
+    def close(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()  # drops it if it has not started yet
+
+def _produce_tokens(user_query: str, context_docs: list[dict], stream: _TokenStream):
+    tokens = stream_answer(user_query, context_docs)
+    try:
+        for text in tokens:
+            if stream.cancelled.is_set():
+                return
+            stream.put(text)
+    finally:
+        close = getattr(tokens, "close", None)
+        if close is not None:
+            close()  # releases the engine slot held by the generator
@@ -1,46 +1,92 @@
 # app/services/document_service.py
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 from fastapi import UploadFile
+import hashlib
+import os
+import tempfile
 import uuid
-import json
 
-from app.config import UPLOAD_DIR, INDEX_DIR
-from app.utils.pdf_parser import extract_text_chunks
-from app.rag.retriever import build_faiss_index
+from app.config import (
+    UPLOAD_DIR, INDEX_DIR, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, CHUNK_UNIT, CHUNK_SIZE, CHUNK_OVERLAP,
+    LLM_TOKENIZER_NAME,
+)
+from app.utils.chunker import chunk_pages, char_length
+from app.utils.pdf_parser import iter_pages
+from app.rag.retriever import build_faiss_index, retriever_registry, iter_embeddings, count_tokens
+from app.rag.global_index import global_index
+from app.rag.bm25 import bm25_store
+from app.utils.llm_client import count_context_tokens
+from app.utils.timing import span, timed_iter
+from app.services.answer_cache import answer_cache
+from app.services.catalog import catalog
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+class UploadTooLargeError(Exception):
+    pass
 
-def save_upload_file(file: UploadFile, upload_dir: Path = UPLOAD_DIR) -> Path:
+def save_upload_file(file: UploadFile, upload_dir: Path = UPLOAD_DIR,
+                     max_bytes: int = UPLOAD_MAX_BYTES) -> tuple[Path, str, str]:
     """
-    Save the uploaded file to the given upload_dir with original filename.
-    Automatically uses separate folders for prod/test depending on APP_ENV.
+    Save the uploaded file to upload_dir as {file_id}{ext}, copying it in chunks.
+    - Rejects files above max_bytes, from the declared size when known, otherwise while copying
+    - Computes the SHA-256 of the content during the same pass
+    - Writes to a temp file and renames it, so a half-written PDF never appears in upload_dir
+    Returns (saved_path, file_id, content_hash).
     """
+    with span("save", pipeline="ingest"):
+        return _save_upload_file(file, upload_dir, max_bytes)
+
+def _save_upload_file(file: UploadFile, upload_dir: Path, max_bytes: int) -> tuple[Path, str, str]:
+    declared_size = getattr(file, "size", None)
+    if max_bytes and declared_size is not None and declared_size > max_bytes:
+        raise UploadTooLargeError(f"File too large: limit is {max_bytes} bytes.")
+
     file_id = str(uuid.uuid4())
     ext = Path(file.filename).suffix
     file_path = upload_dir / f"{file_id}{ext}"
     upload_dir.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
-    update_file_map(file_id, file.filename)
-    return file_path, file_id
 
-def split_text_to_docs(pages: list[dict], file_id: str, file_name: str, chunk_size: int = 500) -> list[dict]:
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=upload_dir, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = file.file.read(UPLOAD_CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(f"File too large: limit is {max_bytes} bytes.")
+                digest.update(block)
+                f.write(block)
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+    catalog.add(file_id, file.filename)
+    return file_path, file_id, digest.hexdigest()
+
+def iter_text_docs(pages: Iterable[dict], file_id: str, file_name: str, chunk_size: int = CHUNK_SIZE,
+                   chunk_overlap: int = CHUNK_OVERLAP, unit: str = CHUNK_UNIT) -> Iterator[dict]:
+    """
+    Split text from PDF pages (any iterable, consumed once) into chunks for indexing, lazily.
+    unit: "tokens" sizes chunks with the embedding model's tokenizer, "chars" in characters.
+    """
+    if unit not in ("tokens", "chars"):
+        raise ValueError(f"Unknown chunk unit: {unit}. Allowed: tokens, chars")
+    length_fn = count_tokens if unit == "tokens" else char_length
+    for chunk in chunk_pages(pages, chunk_size, chunk_overlap, length_fn):
+        if chunk["content"]:
+            yield {"file_id": file_id, "file_name": file_name, **chunk}
+
+def split_text_to_docs(pages: Iterable[dict], file_id: str, file_name: str, chunk_size: int = CHUNK_SIZE,
+                       chunk_overlap: int = CHUNK_OVERLAP, unit: str = CHUNK_UNIT) -> list[dict]:
     """
-    Split text from PDF pages into smaller chunks for indexing.
+    Split text from PDF pages into chunks for indexing.
     """
-    docs = []
-    for page in pages:
-        page_number = page["page_number"]
-        text = page["content"]
-        for i in range(0, len(text), chunk_size):
-            chunk_text = text[i:i + chunk_size]
-            docs.append({
-                "file_id": file_id,
-                "file_name": file_name,
-                "page_number": page_number,
-                "content": chunk_text
-            })
-    return docs
+    return list(iter_text_docs(pages, file_id, file_name, chunk_size, chunk_overlap, unit))
 
 def create_faiss_index_and_save(docs: list[dict], index_path: Path, metadata_path: Path):
     """
@@ -48,36 +94,89 @@ def create_faiss_index_and_save(docs: list[dict], index_path: Path, metadata_pat
     """
     build_faiss_index(docs, index_path, metadata_path)
 
-def process_and_index_document(file_path: Path, file_id: str):
+def process_and_index_document(file_path: Path, file_id: str, progress: Callable[[dict], None] = None):
     """
-    Extract text from PDF, split into chunks, and build FAISS index.
-    Index/metadata are saved using file_id.
+    Extract text from PDF, split into chunks, embed them and add them to the
+    global FAISS index under file_id (replacing any previous version).
+    The stages form one pipeline: pages are extracted in parallel (see
+    pdf_parser.iter_pages), chunked as they arrive, and embedded / added to the
+    index in batches while later pages are still being read. The chunks are
+    then added to the document's BM25 keyword index (see rag.bm25).
+    Time is recorded per stage (parse, chunk, embed, write; see utils.timing):
+    as the stages are interleaved, each counts only its own share.
+    progress(update) receives partial status dicts (stage, pages, chunks_total, chunks_done,
+    cache_hits, cache_misses: chunks served from / missing in the embedding cache);
+    pages and chunks_total grow while the document is being read.
+    Returns the global index path, its segments directory and the chunks.
     """
-    text = extract_text_chunks(file_path)
-
-    if not text or all(not page["content"].strip() for page in text):
-        raise ValueError("Empty or no text extracted from PDF.")
-
-    chunks = split_text_to_docs(text, file_id, file_path.name)
-    if not chunks or all(not c["content"].strip() for c in chunks):
-        raise ValueError("Empty or no text extracted from PDF.")
-
-    index_path = INDEX_DIR / f"{file_id}.faiss"
-    metadata_path = INDEX_DIR / f"{file_id}.pkl"
-    create_faiss_index_and_save(chunks, index_path, metadata_path)
-    return index_path, metadata_path, chunks
-
-def update_file_map(file_id: str, original_name: str):
-    map_path = UPLOAD_DIR / "file_map.json"
-    file_map = {}
-    if map_path.exists():
-        try:
-            with open(map_path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    file_map = json.loads(content)
-        except Exception:
-            file_map = {}
-    file_map[file_id] = original_name
-    with open(map_path, "w", encoding="utf-8") as f:
-        json.dump(file_map, f, ensure_ascii=False, indent=2)
+    report = progress or (lambda update: None)
+    report({"stage": "indexing"})
+    chunks: list[dict] = []
+    pages = 0
+
+    def counted(page_iter):
+        nonlocal pages
+        for page in page_iter:
+            pages += 1
+            yield page
+
+    def chunk_texts():
+        pages_read = timed_iter(counted(iter_pages(file_path)), "parse", pipeline="ingest")
+        for doc in iter_text_docs(pages_read, file_id, file_path.name):
+            # Prompt size of the chunk, so context packing does not re-tokenize it per query
+            # (needs the LLM tokenizer here; tagged with its name, so a change of tokenizer is detected)
+            doc["n_tokens"] = count_context_tokens(doc["content"])
+            doc["tokenizer"] = LLM_TOKENIZER_NAME
+            chunks.append(doc)
+            yield doc["content"]
+        if not chunks:
+            raise ValueError("Empty or no text extracted from PDF.")
+
+    stats = {}
+    embeddings = iter_embeddings(
+        timed_iter(chunk_texts(), "chunk", pipeline="ingest"), stats=stats, use_batcher=True,
+        progress=lambda done: report({"pages": pages, "chunks_total": len(chunks), "chunks_done": done, **stats}),
+    )
+    with span("write", pipeline="ingest"):
+        ids = global_index.add_document(file_id, chunks, timed_iter(embeddings, "embed", pipeline="ingest"))
+        # Keyword index of the same chunks, for hybrid search
+        bm25_store.write(file_id, ids, (chunk["content"] for chunk in chunks))
+        catalog.mark_indexed(file_id, len(chunks), global_index.version(file_id))
+    # Drop any cached per-file retriever / answers still based on an older index for this file
+    retriever_registry.invalidate(file_id)
+    answer_cache.invalidate(file_id)
+    return global_index.index_path, global_index.segments_dir, chunks
+
+def delete_document(file_id: str, upload_dir: Path = UPLOAD_DIR) -> bool:
+    """
+    Remove a document from the global index and delete its stored files.
+    Returns False if nothing was known about file_id.
+    """
+    found = global_index.remove_document(file_id) > 0
+    if bm25_store.remove(file_id):
+        found = True
+    retriever_registry.invalidate(file_id)
+    answer_cache.invalidate(file_id)
+
+    legacy_files = [INDEX_DIR / f"{file_id}.faiss", INDEX_DIR / f"{file_id}.chunks",
+                    INDEX_DIR / f"{file_id}.pkl"]  # pre-chunk-store metadata
+    for path in legacy_files + list(upload_dir.glob(f"{file_id}.*")):
+        if path.exists():
+            path.unlink()
+            found = True
+
+    if catalog.remove(file_id):
+        found = True
+    return found
+
+def find_document_by_hash(content_hash: str):
+    """
+    Return the file_id of an already indexed document with this content, or None.
+    """
+    file_id = catalog.find_by_hash(content_hash)
+    if file_id and global_index.has_document(file_id):
+        return file_id
+    return None
+
+def register_content_hash(content_hash: str, file_id: str):
+    catalog.set_content_hash(file_id, content_hash)
@@ -0,0 +1,149 @@
+# app/services/ingestion_service.py
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.config import INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_JOB_HISTORY
+from app.services import document_service
+from app.utils.timing import record_timings
+
+logger = logging.getLogger(__name__)
+
+# Try to import PdfReadError from either pypdf or PyPDF2; fall back to a dummy class.
+try:
+    from pypdf.errors import PdfReadError  # type: ignore
+except Exception:
+    try:
+        from PyPDF2.errors import PdfReadError  # type: ignore
+    except Exception:
+        class PdfReadError(Exception):  # fallback
+            pass
+
+class QueueFullError(Exception):
+    pass
+
+class JobManager:
+    """
+    Runs document ingestion (parse -> chunk -> embed -> index) on a bounded
+    worker pool, so uploads return immediately and never block the event loop.
+    Job state is kept in memory: queued | running | done | failed.
+    Finished jobs report the milliseconds spent per ingestion stage in "timings".
+    """
+    def __init__(self, max_workers: int = INGEST_WORKERS, max_queue: int = INGEST_QUEUE_SIZE,
+                 history: int = INGEST_JOB_HISTORY):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._active_by_hash: dict[str, str] = {}  # content_hash -> job_id of queued/running job
+        self._active = 0  # queued + running
+        self._lock = threading.Lock()
+
+    def has_capacity(self) -> bool:
+        with self._lock:
+            return self._active < self.max_workers + self.max_queue
+
+    def submit(self, file_path: Path, file_id: str, filename: str, content_hash: str = None) -> dict:
+        """
+        Queue a saved upload for indexing. Raises QueueFullError when the queue is full.
+        If a job for the same content is already queued/running, that job is returned
+        instead, with "duplicate": True, and nothing new is queued.
+        """
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            if content_hash and content_hash in self._active_by_hash:
+                active = self._jobs[self._active_by_hash[content_hash]]
+                return {**active, "progress": dict(active["progress"]), "duplicate": True}
+            if self._active >= self.max_workers + self.max_queue:
+                raise QueueFullError("Too many documents are being processed, please retry later.")
+            self._active += 1
+            job = {
+                "job_id": job_id,
+                "file_id": file_id,
+                "filename": filename,
+                "content_hash": content_hash,
+                "state": "queued",
+                "progress": {"stage": "queued", "pages": 0, "chunks_total": 0, "chunks_done": 0,
+                             "cache_hits": 0, "cache_misses": 0},
+                "error": None,
+                "timings": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._jobs[job_id] = job
+            if content_hash:
+                self._active_by_hash[content_hash] = job_id
+            self._prune()
+        self._executor.submit(self._run, job_id, file_path, file_id, content_hash)
+        return dict(job)
+
+    def get(self, job_id: str) -> dict:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, "progress": dict(job["progress"])}
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job["state"] for job in self._jobs.values()]
+            return {
+                "active": self._active,
+                "queued": states.count("queued"),
+                "running": states.count("running"),
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            progress = fields.pop("progress", None)
+            if progress:
+                job["progress"].update(progress)
+            job.update(fields)
+
+    def _run(self, job_id: str, file_path: Path, file_id: str, content_hash: str = None):
+        self._update(job_id, state="running", progress={"stage": "parsing"})
+        try:
+            with record_timings("ingest") as timings:
+                _, _, chunks = document_service.process_and_index_document(
+                    file_path, file_id=file_id, progress=lambda update: self._update(job_id, progress=update),
+                )
+            if content_hash:
+                document_service.register_content_hash(content_hash, file_id)
+            self._update(job_id, state="done", progress={"stage": "done"}, timings=timings.as_ms(),
+                         finished_at=time.time())
+            progress = self.get(job_id)["progress"]
+            logger.info("Indexed file_id: %s, chunks: %d, embedding cache hits: %d/%d", file_id, len(chunks),
+                        progress["cache_hits"], progress["cache_hits"] + progress["cache_misses"])
+        except Exception as e:
+            if isinstance(e, PdfReadError):
+                error = f"Invalid or unreadable PDF: {e}"
+            elif isinstance(e, ValueError):
+                error = str(e)
+            else:
+                logger.error("Unexpected error while indexing %s: %s", file_id, e, exc_info=True)
+                error = str(e)
+            self._update(job_id, state="failed", error=error, finished_at=time.time())
+            # Don't keep PDFs (or catalog entries) that never made it into the index
+            document_service.delete_document(file_id)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._active_by_hash.pop(content_hash, None)
+
+    def _prune(self):
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [jid for jid, job in self._jobs.items() if job["state"] in ("done", "failed")]
+        for jid in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[jid]
+
+
+job_manager = JobManager()
@@ -0,0 +1,120 @@
+# app/utils/batching.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Sequence
+
+from app.config import MICROBATCH_MAX_WAIT_MS, MICROBATCH_MAX_SIZE
+
+class MicroBatcher:
+    """
+    Groups the items submitted by concurrent callers into one call of fn.
+    A background thread takes the first pending request, then keeps collecting
+    requests for up to max_wait seconds or until max_batch items are gathered,
+    calls fn once on all their items and hands each caller its slice of the
+    results. fn must return one result per item, in order.
+    With sort_key, the items of a batch merged from several requests are passed
+    to fn sorted by it (e.g. text length, to keep padding low) and the results
+    put back in submission order.
+    With max_wait <= 0 (or max_batch <= 1), submit() calls fn directly.
+    """
+    def __init__(self, fn: Callable[[list], Sequence], max_wait: float = MICROBATCH_MAX_WAIT_MS / 1000,
+                 max_batch: int = MICROBATCH_MAX_SIZE, name: str = "microbatch", sort_key: Callable = None):
+        self.fn = fn
+        self.sort_key = sort_key
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.name = name
+        self._queue: "queue.Queue[tuple[list, Future]]" = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.histogram: dict[int, int] = {}  # batch size bucket (power of 2, upper bound) -> batches
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_wait > 0 and self.max_batch > 1
+
+    def submit(self, items: list) -> list:
+        """
+        Results of fn for items, computed in a batch shared with concurrent callers.
+        Exceptions raised by fn are re-raised in every caller of the batch.
+        """
+        items = list(items)
+        if not items:
+            return []
+        if not self.enabled:
+            self._record(1, len(items))
+            return list(self.fn(items))
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((items, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._process(batch, size)
+
+    def _process(self, batch: list[tuple[list, Future]], size: int):
+        self._record(len(batch), size)
+        items = [item for request, _ in batch for item in request]
+        try:
+            if self.sort_key is not None and len(batch) > 1:
+                order = sorted(range(len(items)), key=lambda i: self.sort_key(items[i]))
+                results = [None] * len(items)
+                for i, result in zip(order, self.fn([items[i] for i in order])):
+                    results[i] = result
+            else:
+                results = self.fn(items)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        offset = 0
+        for items, future in batch:
+            future.set_result(list(results[offset:offset + len(items)]))
+            offset += len(items)
+
+    def _record(self, requests: int, size: int):
+        bucket = 1 << (size - 1).bit_length()
+        with self._lock:
+            self.requests += requests
+            self.batches += 1
+            self.items += size
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_batch": self.max_batch,
+                "requests": self.requests,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "batch_size_histogram": {f"<={b}": n for b, n in sorted(self.histogram.items())},
+            }
@@ -0,0 +1,77 @@
+# app/utils/chunker.py
+import re
+from typing import Callable, Iterable, Iterator
+
+from app.config import CHUNK_SIZE, CHUNK_OVERLAP
+
+# A piece is a word plus its trailing whitespace; chunks are built from whole pieces
+_PIECE = re.compile(r"\S+\s*")
+_SENTENCE_END = re.compile(r"[.!?:;]['\")\]]?\s*$|\n\s*$")
+
+def char_length(pieces: list[str]) -> list[int]:
+    return [len(p) for p in pieces]
+
+def chunk_pages(pages: Iterable[dict], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                length_fn: Callable[[list[str]], list[int]] = char_length) -> Iterator[dict]:
+    """
+    Single-pass chunker over a stream of pages ({"page_number", "content"}).
+    - length_fn measures pieces (characters by default, or tokens of the embedding model),
+      chunk_size / chunk_overlap are in the same unit
+    - Chunks may span pages: page_number is the page a chunk starts on, page_end the one it ends on
+    - A chunk is cut at the last sentence end in its final quarter when there is one
+    Yields {"page_number", "page_end", "content"} as soon as each chunk is complete.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size.")
+    buffer: list[tuple[str, int, int]] = []  # (piece, length, page_number)
+    size = 0
+
+    def emit(n: int) -> dict:
+        taken = buffer[:n]
+        return {
+            "page_number": taken[0][2],
+            "page_end": taken[-1][2],
+            "content": "".join(p for p, _, _ in taken).strip(),
+        }
+
+    def cut_point() -> int:
+        # Number of leading pieces that fit in chunk_size, moved back to a sentence end if one is close
+        total, n = 0, 0
+        while n < len(buffer) and (n == 0 or total + buffer[n][1] <= chunk_size):
+            total += buffer[n][1]
+            n += 1
+        floor, running = chunk_size * 3 // 4, total
+        for i in range(n, 1, -1):
+            if running < floor:
+                break
+            if _SENTENCE_END.search(buffer[i - 1][0]):
+                return i
+            running -= buffer[i - 1][1]
+        return n
+
+    def overlap_start(n: int) -> int:
+        # First piece of the next chunk: keep the last chunk_overlap units of this one
+        kept, i = 0, n
+        while i > 1 and kept + buffer[i - 1][1] <= chunk_overlap:
+            i -= 1
+            kept += buffer[i][1]
+        return i
+
+    for page in pages:
+        pieces = _PIECE.findall(page["content"])
+        if not pieces:
+            continue
+        if not pieces[-1][-1].isspace():
+            pieces[-1] += "\n"  # keep words of consecutive pages apart
+        for piece, length in zip(pieces, length_fn(pieces)):
+            buffer.append((piece, length, page["page_number"]))
+            size += length
+        while size > chunk_size and len(buffer) > 1:
+            n = cut_point()
+            yield emit(n)
+            start = overlap_start(n)
+            size -= sum(length for _, length, _ in buffer[:start])
+            del buffer[:start]
+
+    if buffer:
+        yield emit(len(buffer))
@@ -0,0 +1,100 @@
+# app/utils/executors.py
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from app.config import (
+    QUERY_EMBED_WORKERS, QUERY_SEARCH_WORKERS, QUERY_RERANK_WORKERS, QUERY_LLM_WORKERS, QUERY_STAGE_QUEUE_SIZE,
+)
+
+class StageBusyError(Exception):
+    pass
+
+class StageExecutor:
+    """
+    A thread pool dedicated to one query stage, with bounded admission: at most
+    max_workers calls run and max_queue wait; beyond that run() raises
+    StageBusyError instead of queueing more work (the route answers 429).
+    Cancelling the awaiting task drops its call if it has not started yet.
+    Calls run in a copy of the caller's context (context variables such as the
+    query's Timings follow them).
+    """
+    def __init__(self, name: str, max_workers: int, max_queue: int = QUERY_STAGE_QUEUE_SIZE):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"query-{name}")
+        self._active = 0  # queued + running
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        return await self.submit(fn, *args, **kwargs)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Admit a call and return its future without awaiting it (from the event loop):
+        StageBusyError is raised here, before the caller commits to anything.
+        """
+        with self._lock:
+            if self._active >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise StageBusyError(f"Too many queries in progress ({self.name}), please retry later.")
+            self._active += 1
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        # Cancelling the wrapper cancels the pool future too, unless it is already running
+        return asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self._lock:
+            self._active -= 1
+            if future is not None and future.cancelled():
+                self.cancelled += 1
+            elif future is not None:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class QueryExecutors:
+    """
+    One executor per query stage, sized separately: a slow stage (usually the
+    LLM) fills its own queue without holding threads the other stages need.
+    """
+    def __init__(self):
+        self.embed = StageExecutor("embed", QUERY_EMBED_WORKERS)
+        self.search = StageExecutor("search", QUERY_SEARCH_WORKERS)
+        self.rerank = StageExecutor("rerank", QUERY_RERANK_WORKERS)
+        self.llm = StageExecutor("llm", QUERY_LLM_WORKERS)
+
+    def all(self) -> list[StageExecutor]:
+        return [self.embed, self.search, self.rerank, self.llm]
+
+    def stats(self) -> dict:
+        return {executor.name: executor.stats() for executor in self.all()}
+
+    def shutdown(self):
+        for executor in self.all():
+            executor.shutdown()
+
+query_executors = QueryExecutors()
@@ -1,7 +1,17 @@
 import os
+import threading
+import logging
+from functools import lru_cache
+from typing import Iterator
 import requests
-from langchain.llms import CTransformers
-from transformers import AutoTokenizer
+
+from app.config import (
+    LLM_MODEL_PATH, LLM_MAX_CONCURRENCY, LLM_ACQUIRE_TIMEOUT, LLM_PROMPT_MAX_TOKENS, LLM_TOKENIZER_NAME,
+)
+from app.utils.model_provider import get_llm_tokenizer
+from app.utils.timing import span, timed_iter
+
+logger = logging.getLogger(__name__)
 
 PROMPT_TEMPLATE = (
     "Use ONLY the context below to answer the user's question.\n"
@@ -19,7 +29,7 @@ class HuggingFaceLLM:
         if not self.token:
             raise RuntimeError("HF_TOKEN environment variable not set.")
 
-    def generate(self, question: str, context_docs: list[str]) -> str:
+    def generate(self, question: str, context_docs: list[str], token_counts: list[int] = None) -> str:
         headers = {"Authorization": f"Bearer {self.token}"}
         context_text = "\n".join(context_docs)
         payload = {
@@ -28,7 +38,8 @@ class HuggingFaceLLM:
                 "context": context_text
             }
         } 
-        response = requests.post(self.api_url, headers=headers, json=payload)
+        with span("llm"):
+            response = requests.post(self.api_url, headers=headers, json=payload)
         try:
             response.raise_for_status()
             result = response.json()
@@ -44,6 +55,8 @@ class HuggingFaceLLM:
 
 class LocalLLM:
     def __init__(self, model_path="models/llama-2-7b-chat.ggmlv3.q4_1.bin"):
+        from langchain.llms import CTransformers  # heavy import: only when the model is loaded
+
         self.llm = CTransformers(
             model=model_path,
             model_type="llama",
@@ -53,34 +66,151 @@ class LocalLLM:
             }
         )
 
-    def generate(self, question: str, context_docs: list[str]) -> str:
-        context_text = truncate_context(context_docs, question, max_tokens=512)
+    def generate(self, question: str, context_docs: list[str], token_counts: list[int] = None) -> str:
+        context_text = truncate_context(context_docs, question, max_tokens=LLM_PROMPT_MAX_TOKENS,
+                                        token_counts=token_counts)
         prompt = PROMPT_TEMPLATE.format(context=context_text, question=question)
-        raw_answer = self.llm(prompt)
+        with span("llm"):
+            raw_answer = self.llm(prompt)
         return clean_llm_answer(raw_answer)
 
-tokenizer = AutoTokenizer.from_pretrained("hf-internal-testing/llama-tokenizer")
+    def stream(self, question: str, context_docs: list[str], token_counts: list[int] = None) -> Iterator[str]:
+        """
+        Yield raw answer text as the model produces it (ctransformers generator mode).
+        """
+        context_text = truncate_context(context_docs, question, max_tokens=LLM_PROMPT_MAX_TOKENS,
+                                        token_counts=token_counts)
+        prompt = PROMPT_TEMPLATE.format(context=context_text, question=question)
+        yield from timed_iter(self.llm.client(prompt, stream=True), "llm")
+
+class ContextPacker:
+    """
+    Packs context docs into the prompt token budget in one pass.
+    - Every doc is tokenized at most once (counts are memoized, or passed in when
+      they were stored at ingestion, see count_context_tokens)
+    - The budget covers the whole prompt: PROMPT_TEMPLATE and the question included
+    - Docs are taken in order (or by descending score); the first doc that does not
+      fit is cut to the remaining budget instead of being dropped, if enough is left
+    Without a tokenizer, the shared LLM tokenizer is loaded on first use.
+    """
+    def __init__(self, tokenizer=None, template: str = PROMPT_TEMPLATE, cache_size: int = 4096,
+                 min_partial_tokens: int = 32):
+        self._tokenizer = tokenizer
+        self.template = template
+        self.min_partial_tokens = min_partial_tokens
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer if self._tokenizer is not None else get_llm_tokenizer()
+
+    def _count(self, doc: str) -> int:
+        # A doc is measured as it appears in the context: followed by a newline
+        return len(self.tokenizer.encode(doc + "\n", add_special_tokens=False))
 
-def truncate_context(context_docs, question, max_tokens=512):
-    context = ""
-    for doc in context_docs:
-        temp_context = context + doc + "\n"
+    def overhead(self, question: str) -> int:
+        return len(self.tokenizer.encode(self.template.format(context="", question=question)))
 
-        # Just count the tokens for the context part, do not concatenate the template
-        num_tokens = len(tokenizer.encode(temp_context + question))
-        if num_tokens > max_tokens:
+    def pack(self, context_docs: list[str], question: str, max_tokens: int,
+             token_counts: list[int] = None, scores: list[float] = None) -> str:
+        budget = max_tokens - self.overhead(question)
+        order = range(len(context_docs))
+        if scores is not None:
+            order = sorted(order, key=lambda i: scores[i], reverse=True)
+
+        parts = []
+        for i in order:
+            doc = context_docs[i]
+            n = token_counts[i] if token_counts is not None and token_counts[i] is not None else self.count(doc)
+            if n <= budget:
+                parts.append(doc + "\n")
+                budget -= n
+                continue
+            if budget >= self.min_partial_tokens:
+                ids = self.tokenizer.encode(doc, add_special_tokens=False)[:budget - 1]  # 1 for the newline
+                parts.append(self.tokenizer.decode(ids, skip_special_tokens=True) + "\n")
             break
-        context = temp_context
-    return context
+        return "".join(parts)
 
-def clean_llm_answer(answer: str) -> str:
-    answer = answer.strip()
+context_packer = ContextPacker()
+
+def count_context_tokens(doc: str) -> int:
+    """
+    Prompt tokens a chunk takes in the context (stored with chunks at ingestion as "n_tokens",
+    along with "tokenizer": LLM_TOKENIZER_NAME).
+    """
+    return context_packer.count(doc)
+
+def stored_token_counts(context_docs: list[dict]) -> list[int]:
+    """
+    The "n_tokens" stored with each context doc at ingestion, or None where there is none
+    or it was counted with another tokenizer than LLM_TOKENIZER_NAME (re-counted when packing).
+    """
+    return [c.get("n_tokens") if c.get("tokenizer") == LLM_TOKENIZER_NAME else None for c in context_docs]
+
+def truncate_context(context_docs, question, max_tokens=LLM_PROMPT_MAX_TOKENS, token_counts=None, scores=None):
+    with span("context_pack"):
+        return context_packer.pack(context_docs, question, max_tokens, token_counts=token_counts, scores=scores)
+
+class AnswerCleaner:
+    """
+    clean_llm_answer for a stream of text: feed() returns the cleaned text that
+    is safe to show so far, finish() the rest. Only a short tail is held back
+    (to spot "Unhelpful answers:" across chunk boundaries and to strip the end).
+    The trailing "I don't know" rule needs the whole answer, so .answer holds the
+    final cleaned text once finish() has been called; it may be shorter than
+    what was streamed.
+    """
+    MARKER = "unhelpful answers:"
+
+    def __init__(self):
+        self._pending = ""
+        self._skip_space = True
+        self._replaced = False
+        self._emitted = []
+        self.answer = None
 
-    # Change "Unhelpful answers:" by "Additional information:"
-    unhelpful_idx = answer.lower().find("unhelpful answers:")
-    if unhelpful_idx != -1:
-        answer = answer[:unhelpful_idx].strip() + "\nAdditional information: " + answer[unhelpful_idx + len("unhelpful answers:"):].strip()
+    def feed(self, text: str) -> str:
+        if self._skip_space:
+            # Start of the answer, or right after the replaced marker
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._skip_space = False
+        self._pending += text
+        out = ""
+        if not self._replaced:
+            idx = self._pending.lower().find(self.MARKER)
+            if idx != -1:
+                # Change "Unhelpful answers:" by "Additional information:"
+                before = self._pending[:idx].rstrip()
+                separator = "\n" if before or any(self._emitted) else ""
+                out = before + separator + "Additional information: "
+                self._pending = self._pending[idx + len(self.MARKER):].lstrip()
+                self._replaced = True
+                self._skip_space = not self._pending
+        # Hold back a possible partial marker and trailing whitespace (stripped at the end)
+        hold = 0 if self._replaced else len(self.MARKER) - 1
+        safe = len(self._pending[:max(0, len(self._pending) - hold)].rstrip())
+        out += self._pending[:safe]
+        self._pending = self._pending[safe:]
+        self._emitted.append(out)
+        return out
 
+    def finish(self) -> str:
+        tail = self._pending.rstrip()
+        self._pending = ""
+        self._emitted.append(tail)
+        self.answer = _drop_trailing_unknown("".join(self._emitted).strip())
+        return tail
+
+def clean_llm_answer(answer: str) -> str:
+    cleaner = AnswerCleaner()
+    cleaner.feed(answer)
+    cleaner.finish()
+    return cleaner.answer
+
+def _drop_trailing_unknown(answer: str) -> str:
     if answer.lower().endswith("i don't know.") or answer.lower().endswith("i don't know"):
         # If there is a period before, cut to the last period
         last_dot = answer[:-12].rfind(".")
@@ -91,5 +221,82 @@ def clean_llm_answer(answer: str) -> str:
         return answer[:-12].strip()
     return answer
 
+class LLMEngine:
+    """
+    Long-lived LLM shared by all requests.
+    The model is loaded once (at startup or on first use) and calls are gated
+    by a semaphore, since the underlying model is not re-entrant.
+    """
+    def __init__(self, factory=None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 acquire_timeout: float = LLM_ACQUIRE_TIMEOUT):
+        self._factory = factory or (lambda: LocalLLM(model_path=LLM_MODEL_PATH))
+        self._llm = None
+        self._load_lock = threading.Lock()
+        self._gate = threading.BoundedSemaphore(max_concurrency)
+        self.acquire_timeout = acquire_timeout
+        self.state = "idle"  # idle | loading | ready | failed
+        self.error = None
+
+    def load(self):
+        if self._llm is not None:
+            return self._llm
+        with self._load_lock:
+            if self._llm is None:
+                self.state = "loading"
+                try:
+                    self._llm = self._factory()
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = str(e)
+                    raise
+                self.state = "ready"
+                self.error = None
+        return self._llm
+
+    def warmup(self):
+        """
+        Load the model and run one short generation so the first real request
+        does not pay for lazy initialisation inside the backend.
+        """
+        try:
+            self.load()
+            self.state = "loading"
+            self.generate("Hello", ["Warm-up."])
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error("LLM warm-up failed: %s", e, exc_info=True)
+
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def generate(self, question: str, context_docs: list[str], token_counts: list[int] = None) -> str:
+        llm = self.load()
+        if not self._gate.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError("LLM engine is busy, please retry later.")
+        try:
+            if token_counts is not None:
+                return llm.generate(question, context_docs, token_counts=token_counts)
+            return llm.generate(question, context_docs)
+        finally:
+            self._gate.release()
+
+    def stream(self, question: str, context_docs: list[str], token_counts: list[int] = None) -> Iterator[str]:
+        """
+        Yield raw answer text as it is generated (clean it with AnswerCleaner).
+        The slot is held until the generator is exhausted or closed (e.g. when
+        the client disconnects).
+        """
+        llm = self.load()
+        if not self._gate.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError("LLM engine is busy, please retry later.")
+        try:
+            yield from llm.stream(question, context_docs, token_counts=token_counts)
+        finally:
+            self._gate.release()
+
+llm_engine = LLMEngine()
+
 def get_default_llm():
-    return LocalLLM()
+    return llm_engine
@@ -0,0 +1,111 @@
+# app/utils/model_provider.py
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from app.config import (
+    EMBED_MODEL_NAME, RERANK_MODEL_NAME, RERANK_MAX_LENGTH, LLM_TOKENIZER_NAME, MODEL_CACHE_DIR, MODELS_OFFLINE,
+)
+
+logger = logging.getLogger(__name__)
+
+if MODELS_OFFLINE:
+    # Only use files already on disk (local paths or the HF cache): never hit the network
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+class LazyModel:
+    """
+    A model loaded on first use. get() is thread-safe: concurrent first callers
+    wait for a single load. The heavy libraries are imported by the factory, so
+    importing the app does not import torch/transformers.
+    """
+    def __init__(self, name: str, factory: Callable[[], object]):
+        self.name = name
+        self._factory = factory
+        self._model = None
+        self._lock = threading.Lock()
+        self.state = "idle"  # idle | loading | ready | failed
+        self.error = None
+        self.load_seconds = None
+
+    def get(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                self.state = "loading"
+                start = time.perf_counter()
+                try:
+                    self._model = self._factory()
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                self.state = "ready"
+                self.error = None
+                logger.info("Loaded model %s in %.2fs", self.name, self.load_seconds)
+        return self._model
+
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+class ModelProvider:
+    """
+    Registry of the models the service uses, each loaded lazily (see LazyModel).
+    warmup() loads them eagerly, e.g. from a background thread at startup.
+    """
+    def __init__(self):
+        self._models: dict[str, LazyModel] = {}
+
+    def register(self, name: str, factory: Callable[[], object]) -> LazyModel:
+        self._models[name] = LazyModel(name, factory)
+        return self._models[name]
+
+    def get(self, name: str):
+        return self._models[name].get()
+
+    def warmup(self, names: list[str] = None):
+        for name in names or list(self._models):
+            try:
+                self._models[name].get()
+            except Exception as e:
+                logger.error("Warm-up of model %s failed: %s", name, e, exc_info=True)
+
+    def is_ready(self) -> bool:
+        return all(model.is_loaded() for model in self._models.values())
+
+    def stats(self) -> dict:
+        return {
+            name: {"state": model.state, "load_seconds": model.load_seconds, "error": model.error}
+            for name, model in self._models.items()
+        }
+
+def _load_embedder():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL_NAME, cache_folder=MODEL_CACHE_DIR)
+
+def _load_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL_NAME, max_length=RERANK_MAX_LENGTH, cache_folder=MODEL_CACHE_DIR)
+
+def _load_llm_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(LLM_TOKENIZER_NAME, cache_dir=MODEL_CACHE_DIR)
+
+model_provider = ModelProvider()
+model_provider.register("embedder", _load_embedder)
+model_provider.register("cross_encoder", _load_cross_encoder)
+model_provider.register("llm_tokenizer", _load_llm_tokenizer)
+
+def get_embed_model():
+    return model_provider.get("embedder")
+
+def get_cross_encoder():
+    return model_provider.get("cross_encoder")
+
+def get_llm_tokenizer():
+    return model_provider.get("llm_tokenizer")
@@ -1,23 +1,199 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import Iterator
+from pypdf import PdfReader
 
-def extract_text_chunks(file_path: Path, chunk_size: int = 500, chunk_overlap: int = 50) -> list[dict]:
+from app.config import PDF_EXTRACT_WORKERS, PDF_PAGES_PER_TASK, PDF_PAGE_TIMEOUT
+from app.utils.chunker import chunk_pages
+
+logger = logging.getLogger(__name__)
+
+# ==== Worker side (runs in the extraction processes) ====
+class _PageTimeout(Exception):
+    pass
+
+_worker_reader = None  # (path, mtime, PdfReader): reused across the ranges of one file
+
+def _open_reader(file_path: str) -> PdfReader:
+    global _worker_reader
+    mtime = os.path.getmtime(file_path)
+    if _worker_reader is None or _worker_reader[:2] != (file_path, mtime):
+        _worker_reader = (file_path, mtime, PdfReader(file_path))
+    return _worker_reader[2]
+
+def _on_alarm(signum, frame):
+    raise _PageTimeout()
+
+def _extract_range(file_path: str, start: int, stop: int, page_timeout: float) -> list[str]:
     """
-    Load PDF, split into chunks, and keep metadata (page, file).
-    Returns: list of dict with keys: content, page_number, file_name
+    Text of pages [start, stop). A page taking longer than page_timeout
+    (POSIX only: enforced with SIGALRM) is logged and returned as "".
     """
-    loader = PyPDFLoader(str(file_path))
-    documents = loader.load()  # Each document has .page_content and .metadata['page']
+    reader = _open_reader(file_path)
+    use_alarm = hasattr(signal, "setitimer") and page_timeout > 0
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+    texts = []
+    for page_number in range(start, stop):
+        try:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, page_timeout)
+            texts.append(reader.pages[page_number].extract_text() or "")
+        except _PageTimeout:
+            logger.warning("Page %d of %s timed out after %.0fs, skipped", page_number, file_path, page_timeout)
+            texts.append("")
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    return texts
+
+# ==== Pool ====
+class _ExtractPool:
+    """
+    The extraction process pool plus the futures still pending on it. A worker stuck
+    in a page cannot be interrupted, so a pool with a hung task is retired instead:
+    new tasks go to a fresh pool, the tasks other jobs already queued on it still run,
+    and once only hung tasks are left its processes are terminated.
+    """
+    def __init__(self, workers: int):
+        # spawn: forking a process that runs threads (uvicorn, ingestion workers) is unsafe
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._pending = set()
+        self._hung = set()
+        self._retired = False
+        self._cond = threading.Condition()
+
+    def submit(self, fn, *args) -> Future:
+        """
+        Returns None once the pool is retired (the caller gets a fresh pool and retries).
+        """
+        with self._cond:
+            if self._retired:
+                return None
+            future = self.executor.submit(fn, *args)
+            self._pending.add(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future):
+        with self._cond:
+            self._pending.discard(future)
+            self._hung.discard(future)
+            self._cond.notify_all()
+
+    def retire(self, hung: Future):
+        with self._cond:
+            if not hung.done():
+                self._hung.add(hung)
+            self._cond.notify_all()
+            if self._retired:
+                return
+            self._retired = True
+        threading.Thread(target=self._reap, name="pdf-extract-reaper", daemon=True).start()
+
+    def _reap(self):
+        with self._cond:
+            while self._pending - self._hung:
+                self._cond.wait()
+        # Only hung tasks are left: stop their workers (the pool has no public API for it;
+        # taken before shutdown(), which forgets them)
+        processes = list((getattr(self.executor, "_processes", None) or {}).values())
+        self.shutdown()
+        for process in processes:
+            process.terminate()
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_documents(documents)
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-    results = []
-    for chunk in chunks:
-        results.append({
-            "content": chunk.page_content,
-            "page_number": chunk.metadata.get("page", None),
-            "file_name": file_path.name
-        })
-    return results
+_extract_pool: _ExtractPool = None
+_extract_pool_lock = threading.Lock()
+
+def _get_extract_pool(workers: int) -> _ExtractPool:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = _ExtractPool(workers)
+        return _extract_pool
+
+def _retire_extract_pool(pool: _ExtractPool, hung: Future):
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    pool.retire(hung)
+
+def stop_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown()
+            _extract_pool = None
+
+# ==== Public API ====
+def iter_pages(file_path: Path, workers: int = PDF_EXTRACT_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK,
+               page_timeout: float = PDF_PAGE_TIMEOUT) -> Iterator[dict]:
+    """
+    Yield the text of a PDF one page at a time, in order: {"page_number": 0-based, "content": str}.
+    With workers > 1, page ranges are extracted in parallel by a process pool (each
+    worker opens the file itself) and pages are yielded as soon as they and all
+    earlier pages are ready, so chunking and embedding start before extraction ends.
+    Short documents (a single range) are read in-thread, without a timeout.
+    """
+    reader = PdfReader(str(file_path))
+    n_pages = len(reader.pages)
+    if workers <= 1 or n_pages <= pages_per_task:
+        for page_number, page in enumerate(reader.pages):
+            yield {"page_number": page_number, "content": page.extract_text() or ""}
+        return
+
+    ranges = iter([(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task)])
+    in_flight = deque()
+
+    def submit_next():
+        page_range = next(ranges, None)
+        if page_range is None:
+            return
+        future = None
+        while future is None:
+            # Looked up per task: the pool is replaced when a task of any job hangs
+            pool = _get_extract_pool(workers)
+            future = pool.submit(_extract_range, str(file_path), *page_range, page_timeout)
+        in_flight.append((page_range, pool, future))
+
+    # A bounded look-ahead keeps memory flat however long the document is
+    for _ in range(workers * 2):
+        submit_next()
+    try:
+        while in_flight:
+            (start, stop), pool, future = in_flight.popleft()
+            # Backstop for hosts without SIGALRM: a range may also wait behind one other task
+            try:
+                texts = future.result(timeout=page_timeout * (stop - start) * 2 if page_timeout > 0 else None)
+            except FutureTimeout:
+                # Only this job fails: its other tasks are cancelled below. A task still
+                # queued was just slow to start; a running one hung its worker
+                if not future.cancel():
+                    _retire_extract_pool(pool, future)
+                raise TimeoutError(f"PDF text extraction timed out on pages {start + 1}-{stop}.")
+            submit_next()
+            for offset, text in enumerate(texts):
+                yield {"page_number": start + offset, "content": text}
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
+
+def extract_text_chunks(file_path: Path, chunk_size: int = 500, chunk_overlap: int = 50) -> list[dict]:
+    """
+    Load PDF, split into chunks (sized in characters), and keep metadata (pages, file).
+    Returns: list of dict with keys: content, page_number, page_end, file_name
+    """
+    return [
+        {**chunk, "file_name": file_path.name}
+        for chunk in chunk_pages(iter_pages(file_path), chunk_size, chunk_overlap)
+    ]
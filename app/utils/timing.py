@@ -0,0 +1,174 @@
+# app/utils/timing.py
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from app.config import METRICS_BUCKETS
+
+class Histogram:
+    """
+    Histogram with one series per label set, rendered in the Prometheus text
+    format (cumulative buckets, _sum and _count).
+    """
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self._series: dict[tuple, list] = {}  # sorted label items -> [bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(series.items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in key]
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                bucket_labels = ",".join(labels + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            series_labels = ",".join(labels)
+            lines.append(f"{self.name}_sum{{{series_labels}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{series_labels}}} {cumulative}")
+        return lines
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+stage_seconds = Histogram("rag_stage_duration_seconds", "Time spent per pipeline stage (query, ingest).")
+
+class Timings:
+    """
+    Seconds spent per stage by one query or ingestion job. Stage times are
+    exclusive (time in nested spans is counted for those only), so they add up
+    to at most the total.
+    """
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.stages: dict[str, float] = {}
+        self.total = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        self.total = time.perf_counter() - self._started
+        with self._lock:
+            stages = dict(self.stages)
+        for stage, seconds in stages.items():
+            stage_seconds.observe(seconds, pipeline=self.pipeline, stage=stage)
+        stage_seconds.observe(self.total, pipeline=self.pipeline, stage="total")
+
+    def as_ms(self) -> dict[str, float]:
+        with self._lock:
+            timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        if self.total is not None:
+            timings["total"] = round(self.total * 1000, 3)
+        return timings
+
+    def server_timing(self) -> str:
+        """
+        The Server-Timing header value: "stage;dur=<ms>, ...".
+        """
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.as_ms().items())
+
+# The Timings of the query / job being processed. Query stage executors run their
+# calls in a copy of the caller's context, so it follows a query across threads.
+_current: "contextvars.ContextVar[Timings]" = contextvars.ContextVar("timings", default=None)
+_frames = threading.local()  # per thread: stack of [seconds spent in nested spans]
+
+@contextmanager
+def record_timings(pipeline: str) -> Iterator[Timings]:
+    """
+    Collect the spans of the enclosed work into one Timings; on exit, each stage's
+    total (and the overall total) is observed once in the stage histogram.
+    """
+    timings = Timings(pipeline)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        timings.finish()
+
+def _push() -> list:
+    frame = [0.0]
+    _frames.__dict__.setdefault("stack", []).append(frame)
+    return frame
+
+def _pop(frame: list, elapsed: float) -> float:
+    stack = _frames.stack
+    stack.pop()
+    if stack:
+        stack[-1][0] += elapsed
+    return elapsed - frame[0]
+
+def _record(stage: str, seconds: float, pipeline: str, timings: Timings = None):
+    if timings is not None:
+        timings.add(stage, seconds)
+    else:
+        stage_seconds.observe(seconds, pipeline=pipeline, stage=stage)
+
+@contextmanager
+def span(stage: str, pipeline: str = "query"):
+    """
+    Time the enclosed block as stage: added to the current Timings, or observed
+    directly (under pipeline) when there is none.
+    """
+    frame = _push()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(stage, _pop(frame, time.perf_counter() - start), pipeline, _current.get())
+
+def timed_iter(iterable: Iterable, stage: str, pipeline: str = "query") -> Iterator:
+    """
+    Yield from iterable, timing the production of its items (not the consumer's
+    work between them) as a single span of stage, recorded when it is exhausted or closed.
+    """
+    timings = _current.get()
+    iterator = iter(iterable)
+    seconds = 0.0
+    done = object()
+    try:
+        while True:
+            frame = _push()
+            start = time.perf_counter()
+            try:
+                item = next(iterator, done)
+            finally:
+                seconds += _pop(frame, time.perf_counter() - start)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        _record(stage, seconds, pipeline, timings)
+
+def render_metrics() -> str:
+    return "\n".join(stage_seconds.render()) + "\n"
@@ -1,5 +1,6 @@
+import time
 import streamlit as st
-from mvp_ui.utils.api import upload_pdf, ask_question, get_original_filename
+from mvp_ui.utils.api import upload_pdfs, get_job, stream_question, get_original_filenames
 
 st.set_page_config(page_title="Ask My Document", layout="wide")
 st.title("Ask My Document")
@@ -12,18 +13,35 @@ file_ids = st.session_state.get("file_ids", [])
 if uploaded_files:
     if st.button("Upload PDFs"):
         new_file_ids = []
-        for uploaded_file in uploaded_files:
-            with st.spinner(f"Uploading {uploaded_file.name}..."):
-                response = upload_pdf(uploaded_file)
-            if response.ok:
-                data = response.json()
-                st.success(f"Uploaded {uploaded_file.name}!")
-                st.write(data)
-                file_id = data.get("file_id")
-                if file_id:
-                    new_file_ids.append(file_id)
+        with st.spinner(f"Uploading {len(uploaded_files)} file(s)..."):
+            response = upload_pdfs(uploaded_files)
+        results = response.json().get("files", []) if response.ok else []
+        if not response.ok:
+            st.error(response.text)
+
+        # Indexing runs in the background, all files at once: poll the jobs until they finish
+        jobs = {}  # position in results -> job
+        for i, result in enumerate(results):
+            if result["status"] == "error":
+                st.error(f"{result['filename']}: {result['error']}")
+            elif result["status"] == "duplicate":
+                jobs[i] = {**result, "state": "done"}
+            else:
+                jobs[i] = {"job_id": result["job_id"], "state": "queued"}
+        with st.spinner(f"Indexing {len(jobs)} file(s)..."):
+            while any(job.get("state") in ("queued", "running") for job in jobs.values()):
+                time.sleep(0.5)
+                for i, job in jobs.items():
+                    if job.get("state") in ("queued", "running"):
+                        jobs[i] = get_job(job["job_id"]).json()
+        for i, job in jobs.items():
+            name = results[i]["filename"]
+            if job.get("state") == "done":
+                st.success(f"Uploaded {name}!")
+                st.write(job)
+                new_file_ids.append(results[i]["file_id"])
             else:
-                st.error(response.text)
+                st.error(f"{name}: {job.get('error') or job}")
 
         # Save the new file IDs to session
         st.session_state["file_ids"] = new_file_ids
@@ -37,24 +55,42 @@ file_ids_input = st.session_state.get("file_ids", [])
 
 st.write(f"Current file IDs: {file_ids_input}")
 
+def render_context(context_chunks, filenames=None):
+    # Original file names come with the answer; anything missing is fetched in one batch call
+    filenames = dict(filenames or {})
+    missing = [chunk['file_id'] for chunk in context_chunks if chunk['file_id'] not in filenames]
+    if missing:
+        filenames.update(get_original_filenames(missing))
+    for chunk in context_chunks:
+        original_name = filenames.get(chunk['file_id']) or chunk['file_name']
+        pages = f"{chunk['page_number'] + 1}"
+        if chunk.get("page_end") is not None and chunk["page_end"] != chunk["page_number"]:
+            pages += f"-{chunk['page_end'] + 1}"
+        st.markdown(f"**File:** {original_name} | **Page:** {pages}")
+        st.write(chunk['content'])
+        pdf_url = f"http://localhost:8000/documents/pdf/{chunk['file_id']}"
+        st.markdown(
+            f"[Open PDF at {original_name} (page {chunk['page_number'] + 1})]({pdf_url})",
+            unsafe_allow_html=True
+        )
+
 if st.button("Ask") and query and file_ids_input:
-    with st.spinner("Getting answer..."):
-        response = ask_question(query, top_k, file_ids_input)
-    if response.ok:
-        result = response.json()
-        st.subheader("Answer")
-        st.write(result.get("answer", "No answer"))
-        st.subheader("Context")
-        context_chunks = result.get("context", [])
-        for chunk in context_chunks:
-            # Get original file name from API
-            original_name = get_original_filename(chunk['file_id']) or chunk['file_name']
-            st.markdown(f"**File:** {original_name} | **Page:** {chunk['page_number'] + 1}")
-            st.write(chunk['content'])
-            pdf_url = f"http://localhost:8000/documents/pdf/{chunk['file_id']}"
-            st.markdown(
-                f"[Open PDF at {original_name} (page {chunk['page_number'] + 1})]({pdf_url})",
-                unsafe_allow_html=True
-            )
-    else:
-        st.error(response.text)
+    # Answer tokens are rendered as they arrive; the context shows up first, below the answer
+    st.subheader("Answer")
+    answer_box = st.empty()
+    answer_box.info("Retrieving context...")
+    context_area = st.container()
+    answer = ""
+    for event, data in stream_question(query, top_k, file_ids_input):
+        if event == "context":
+            answer_box.info("Generating answer...")
+            with context_area:
+                st.subheader("Context")
+                render_context(data.get("context", []), data.get("filenames"))
+        elif event == "token":
+            answer += data["text"]
+            answer_box.markdown(answer + " ▌")
+        elif event == "done":
+            answer_box.markdown(data.get("answer") or "No answer")
+        elif event == "error":
+            answer_box.error(data.get("error"))
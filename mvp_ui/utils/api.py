@@ -1,17 +1,72 @@
+import json
 import requests
+from requests.adapters import HTTPAdapter
 
 API_URL = "http://localhost:8000"
 
+# One pooled session: connections are kept alive across calls instead of reconnecting per request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# file_id -> original filename; a file_id never changes its file, so entries never go stale
+_filenames: dict = {}
+
 def upload_pdf(file):
     files = {"file": (file.name, file, "application/pdf")}
-    return requests.post(f"{API_URL}/documents/upload", files=files)
+    return session.post(f"{API_URL}/documents/upload", files=files)
+
+def upload_pdfs(files):
+    """
+    Upload several PDFs in one request; the response lists a result per file, in order.
+    """
+    parts = [("files", (file.name, file, "application/pdf")) for file in files]
+    return session.post(f"{API_URL}/documents/upload/batch", files=parts)
+
+def get_job(job_id):
+    return session.get(f"{API_URL}/documents/jobs/{job_id}")
 
 def ask_question(query, top_k, file_ids):
     payload = {"query": query, "top_k": top_k, "file_ids": file_ids}
-    return requests.post(f"{API_URL}/documents/query", json=payload)
+    response = session.post(f"{API_URL}/documents/query", json=payload)
+    if response.ok:
+        remember_filenames(response.json().get("filenames"))
+    return response
+
+def stream_question(query, top_k, file_ids):
+    """
+    Yield (event, data) pairs from the streaming query endpoint (Server-Sent Events).
+    """
+    payload = {"query": query, "top_k": top_k, "file_ids": file_ids}
+    with session.post(f"{API_URL}/documents/query/stream", json=payload, stream=True) as response:
+        if not response.ok:
+            yield "error", {"error": response.text}
+            return
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "context":
+                    remember_filenames(data.get("filenames"))
+                yield event, data
+                event = "message"
+
+def remember_filenames(filenames):
+    if filenames:
+        _filenames.update(filenames)
+
+def get_original_filenames(file_ids):
+    """
+    {file_id: original filename}, memoized: only unknown file_ids are fetched, in one request.
+    """
+    missing = [f for f in dict.fromkeys(file_ids) if f not in _filenames]
+    if missing:
+        response = session.get(f"{API_URL}/documents/filenames", params={"file_ids": missing})
+        if response.ok:
+            remember_filenames(response.json().get("filenames"))
+    return {f: _filenames[f] for f in file_ids if f in _filenames}
 
 def get_original_filename(file_id):
-    response = requests.get(f"{API_URL}/documents/filename/{file_id}")
-    if response.ok:
-        return response.json().get("filename")
-    return None
+    return get_original_filenames([file_id]).get(file_id)
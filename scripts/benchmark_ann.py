@@ -0,0 +1,91 @@
+# scripts/benchmark_ann.py
+"""
+Recall-vs-latency report of the ANN index types against the exact (flat) baseline.
+
+Usage:
+    python scripts/benchmark_ann.py                       # synthetic clustered vectors
+    python scripts/benchmark_ann.py --n 200000 --dim 384
+    python scripts/benchmark_ann.py --index data/index/global.faiss   # vectors of the real corpus
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+import faiss
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.rag.index_factory import make_index, reconstruct_all
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    # Sentence embeddings are clustered by topic; uniform noise would flatter IVF/PQ less realistically
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, size=n)
+    return centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype("float32")
+
+def load_vectors(index_path: Path) -> np.ndarray:
+    index = faiss.read_index(str(index_path))
+    if isinstance(index, faiss.IndexIDMap2):
+        return reconstruct_all(index)[1]
+    return index.reconstruct_n(0, index.ntotal)
+
+def timed_search(index, queries: np.ndarray, k: int, params=None) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    _, ids = index.search(queries, k, params=params)
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f != -1]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", type=Path, help="Existing FAISS index to take vectors from")
+    parser.add_argument("--n", type=int, default=100_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index) if args.index else synthetic_vectors(args.n, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), size=args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype("float32")
+    build_threads = faiss.omp_get_max_threads()
+
+    print(f"corpus={len(vectors)} dim={vectors.shape[1]} queries={len(queries)} k={args.k}\n")
+    print(f"{'index':<10} {'knob':<14} {'build s':>8} {'recall@k':>9} {'ms/query':>9} {'MB':>8}")
+
+    rows = []
+    for kind in ("flat", "hnsw", "ivf_flat", "ivf_pq"):
+        faiss.omp_set_num_threads(build_threads)
+        start = time.perf_counter()
+        index = make_index(vectors.shape[1], kind, vectors)
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+        faiss.omp_set_num_threads(1)  # per-query latency, as seen by a single request
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+
+        if kind == "flat":
+            truth, ms = timed_search(index, queries, args.k)
+            rows.append((kind, "-", build_s, 1.0, ms, size_mb))
+            continue
+
+        if kind == "hnsw":
+            knobs = [("efSearch", v, faiss.SearchParametersHNSW(efSearch=v)) for v in (16, 32, 64, 128, 256)]
+        else:
+            nlist = faiss.extract_index_ivf(index).nlist
+            knobs = [
+                ("nprobe", v, faiss.SearchParametersIVF(nprobe=v))
+                for v in (1, 4, 8, 16, 32, 64, 128) if v <= nlist
+            ]
+        for name, value, params in knobs:
+            found, ms = timed_search(index, queries, args.k, params)
+            rows.append((kind, f"{name}={value}", build_s, recall_at_k(found, truth), ms, size_mb))
+
+    for kind, knob, build_s, recall, ms, size_mb in rows:
+        print(f"{kind:<10} {knob:<14} {build_s:>8.2f} {recall:>9.3f} {ms:>9.3f} {size_mb:>8.1f}")
+
+if __name__ == "__main__":
+    main()
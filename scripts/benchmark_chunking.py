@@ -0,0 +1,76 @@
+# scripts/benchmark_chunking.py
+"""
+Chunk counts and ingestion time: old double split vs the single-pass chunker.
+
+  legacy : LangChain RecursiveCharacterTextSplitter (500/50), then every chunk re-sliced at 500 chars
+  chars  : single pass, CHUNK_SIZE/CHUNK_OVERLAP in characters (500/50)
+  tokens : single pass, sized with the embedding model tokenizer (CHUNK_SIZE/CHUNK_OVERLAP)
+
+Usage:
+    python scripts/benchmark_chunking.py file1.pdf file2.pdf
+    python scripts/benchmark_chunking.py --embed file.pdf    # also time embedding of the chunks
+    python scripts/benchmark_chunking.py                     # generated sample PDF
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.config import CHUNK_SIZE, CHUNK_OVERLAP
+from app.rag.retriever import iter_embeddings
+from app.services.document_service import split_text_to_docs
+from app.utils.pdf_parser import iter_pages
+
+def legacy_chunks(pdf_path: Path) -> list[str]:
+    from langchain.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    documents = PyPDFLoader(str(pdf_path)).load()
+    chunks = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50).split_documents(documents)
+    return [c.page_content[i:i + 500] for c in chunks for i in range(0, len(c.page_content), 500)]
+
+def single_pass_chunks(pdf_path: Path, unit: str) -> list[str]:
+    size, overlap = (500, 50) if unit == "chars" else (CHUNK_SIZE, CHUNK_OVERLAP)
+    docs = split_text_to_docs(iter_pages(pdf_path), "bench", pdf_path.name, size, overlap, unit)
+    return [d["content"] for d in docs]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", type=Path, nargs="*")
+    parser.add_argument("--embed", action="store_true", help="Also embed the chunks (loads the model)")
+    args = parser.parse_args()
+
+    pdfs = args.pdfs
+    if not pdfs:
+        from scripts.make_sample_pdf import make_pdf
+        sample = Path(tempfile.mkdtemp()) / "sample.pdf"
+        make_pdf(sample)
+        pdfs = [sample]
+
+    strategies = {
+        "legacy": legacy_chunks,
+        "chars": lambda p: single_pass_chunks(p, "chars"),
+        "tokens": lambda p: single_pass_chunks(p, "tokens"),
+    }
+    if args.embed:
+        list(iter_embeddings(["warm up"], cache=False))  # exclude model loading from the timings
+
+    print(f"{'strategy':<8} {'chunks':>8} {'avg chars':>10} {'<100 chars':>11} {'chunk s':>8} {'embed s':>8}")
+    for name, chunker in strategies.items():
+        start = time.perf_counter()
+        texts = [t for pdf in pdfs for t in chunker(pdf)]
+        chunk_s = time.perf_counter() - start
+        embed_s = float("nan")
+        if args.embed:
+            start = time.perf_counter()
+            for _ in iter_embeddings(texts, cache=False):  # no embedding cache: time the model itself
+                pass
+            embed_s = time.perf_counter() - start
+        avg = sum(map(len, texts)) / max(1, len(texts))
+        tiny = sum(len(t) < 100 for t in texts)
+        print(f"{name:<8} {len(texts):>8} {avg:>10.0f} {tiny:>11} {chunk_s:>8.2f} {embed_s:>8.2f}")
+
+if __name__ == "__main__":
+    main()
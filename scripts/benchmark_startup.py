@@ -0,0 +1,65 @@
+# scripts/benchmark_startup.py
+"""
+Startup time of the API: import of app.main, time until the app answers /ready,
+and the one-off load time of each lazily loaded model.
+
+Every run is a fresh interpreter (nothing is shared through sys.modules), so
+the numbers are what a new worker process pays.
+
+Usage:
+    python scripts/benchmark_startup.py              # 5 runs, models loaded lazily
+    python scripts/benchmark_startup.py --runs 10
+    python scripts/benchmark_startup.py --models     # also time loading each model
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+STARTUP = """
+import json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    client.get("/ready")
+    ready = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "ready_s": ready - start}))
+"""
+
+MODELS = """
+import json
+from app.utils.model_provider import model_provider
+model_provider.warmup()
+print(json.dumps({name: s["load_seconds"] for name, s in model_provider.stats().items()}))
+"""
+
+def run(code: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--models", action="store_true", help="Also load every model once and time it")
+    args = parser.parse_args()
+
+    results = [run(STARTUP) for _ in range(args.runs)]
+    print(f"{'phase':<14} {'median s':>9} {'min s':>7} {'max s':>7}")
+    for key, label in (("import_s", "import"), ("ready_s", "first /ready")):
+        values = [r[key] for r in results]
+        print(f"{label:<14} {statistics.median(values):>9.3f} {min(values):>7.3f} {max(values):>7.3f}")
+
+    if args.models:
+        print()
+        print(f"{'model':<14} {'load s':>9}")
+        for name, seconds in run(MODELS).items():
+            print(f"{name:<14} {'failed' if seconds is None else f'{seconds:.3f}':>9}")
+
+if __name__ == "__main__":
+    main()
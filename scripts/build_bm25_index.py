@@ -0,0 +1,35 @@
+# scripts/build_bm25_index.py
+"""
+Build the BM25 keyword indexes of documents already in the global index
+(documents indexed before hybrid search existed have none).
+
+Usage:
+    python scripts/build_bm25_index.py            # only documents without a BM25 index
+    python scripts/build_bm25_index.py --all      # rebuild every document
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.rag.bm25 import bm25_store
+from app.rag.global_index import global_index
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="Rebuild existing BM25 indexes too")
+    args = parser.parse_args()
+
+    global_index.load()
+    built = 0
+    for file_id, ids in sorted(global_index.doc_ids.items()):
+        if not args.all and bm25_store.path(file_id).exists():
+            continue
+        chunks = global_index.get_chunks(ids)
+        bm25_store.write(file_id, ids, (chunk["content"] for chunk in chunks))
+        built += 1
+        print(f"{file_id}: {len(ids)} chunks")
+    print(f"Built {built} BM25 index(es).")
+
+if __name__ == "__main__":
+    main()
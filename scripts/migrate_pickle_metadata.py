@@ -0,0 +1,51 @@
+# scripts/migrate_pickle_metadata.py
+"""
+Convert pickled chunk metadata written by older versions to chunk stores.
+Only run this on index directories you created yourself: unpickling executes code.
+
+Usage:
+    python scripts/migrate_pickle_metadata.py data/index
+    python scripts/migrate_pickle_metadata.py data/index --delete   # remove the .pkl files afterwards
+"""
+import argparse
+import json
+import pickle
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.rag.chunk_store import ChunkStore
+
+def migrate(pkl_path: Path) -> Path:
+    with open(pkl_path, "rb") as f:
+        state = pickle.load(f)
+    target = pkl_path.with_suffix(".chunks")
+    if isinstance(state, dict) and "chunks" in state:
+        # Global index: chunks by FAISS id plus document bookkeeping
+        ChunkStore.write(target, state["chunks"].items())
+        with open(pkl_path.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump({
+                # Pickled versions always gave a document one contiguous id range
+                "doc_ids": {k: [[int(v[0]), len(v)]] for k, v in state["doc_ids"].items() if len(v)},
+                "versions": state["versions"],
+                "next_id": state["next_id"],
+            }, f)
+    else:
+        # Per-file index: list of chunks, FAISS id == position
+        ChunkStore.write(target, enumerate(state))
+    return target
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("index_dir", type=Path)
+    parser.add_argument("--delete", action="store_true", help="Delete each .pkl once converted")
+    args = parser.parse_args()
+
+    for pkl_path in sorted(args.index_dir.glob("*.pkl")):
+        target = migrate(pkl_path)
+        print(f"{pkl_path.name} -> {target.name} ({len(ChunkStore(target))} chunks)")
+        if args.delete:
+            pkl_path.unlink()
+
+if __name__ == "__main__":
+    main()
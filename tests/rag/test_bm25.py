@@ -0,0 +1,77 @@
+# tests/rag/test_bm25.py
+import numpy as np
+import pytest
+from app.rag import retriever
+from app.rag.bm25 import Bm25Store, tokenize, encode_varints, decode_varints, reciprocal_rank_fusion
+from app.rag.global_index import GlobalIndex
+
+def test_tokenize_keeps_identifiers_whole_and_split():
+    assert tokenize("Error ERR-1042 in clause 3.2.1") == [
+        "error", "err-1042", "err", "1042", "in", "clause", "3.2.1", "3", "2", "1",
+    ]
+
+@pytest.mark.parametrize("values", [[0], [1, 127, 128, 300, 16384], [2**40, 5, 2**63 - 1]])
+def test_varint_roundtrip(values):
+    encoded = np.frombuffer(encode_varints(values), dtype="uint8")
+    assert decode_varints(encoded).tolist() == values
+
+def test_exact_identifier_ranks_first(tmp_path):
+    store = Bm25Store(index_dir=tmp_path)
+    store.write("a", [10, 11, 12], [
+        "The pump reported error ERR-1042 after restart.",
+        "Errors are listed in the maintenance manual.",
+        "Restart the pump before checking the valve.",
+    ])
+    store.write("b", [20, 21], ["Part number PN-77 is the valve.", "Error codes overview."])
+
+    hits = store.search("what does ERR-1042 mean", ["a", "b"], top_k=5)
+    assert hits[0][0] == 10
+    assert all(score > 0 for _, score in hits)
+
+    assert [chunk_id for chunk_id, _ in store.search("PN-77", ["a", "b"], top_k=5)] == [20]
+    assert store.search("PN-77", ["a"], top_k=5) == [], "Only the requested documents are searched"
+
+def test_rewrite_and_remove(tmp_path):
+    store = Bm25Store(index_dir=tmp_path)
+    store.write("a", [1], ["alpha beta"])
+    assert store.search("alpha", ["a"], top_k=1)[0][0] == 1
+
+    store.write("a", [7], ["gamma"])
+    assert store.search("alpha", ["a"], top_k=1) == []
+    assert store.search("gamma", ["a"], top_k=1)[0][0] == 7
+
+    assert store.remove("a")
+    assert store.get("a") is None
+    assert store.search("gamma", ["a"], top_k=1) == []
+
+def test_reciprocal_rank_fusion_merges_and_rewards_agreement():
+    dense = [{"chunk_id": 1, "distance": 0.1}, {"chunk_id": 2, "distance": 0.2}, {"chunk_id": 3, "distance": 0.3}]
+    lexical = [{"chunk_id": 3, "bm25_score": 9.0}, {"chunk_id": 4, "bm25_score": 5.0}]
+
+    fused = reciprocal_rank_fusion([dense, lexical], key=lambda hit: hit["chunk_id"], k=60)
+
+    assert [hit["chunk_id"] for hit in fused] == [3, 1, 2, 4]
+    assert fused[0]["distance"] == 0.3 and fused[0]["bm25_score"] == 9.0
+
+def test_search_documents_fuses_keyword_hits(tmp_path, monkeypatch):
+    index = GlobalIndex(index_dir=tmp_path)
+    store = Bm25Store(index_dir=tmp_path / "bm25")
+    docs = [
+        {"file_id": "a", "content": "general introduction to the product"},
+        {"file_id": "a", "content": "fault code E-7731 means the sensor is offline"},
+        {"file_id": "a", "content": "warranty terms and conditions"},
+    ]
+    vectors = np.eye(3, dtype="float32")
+    ids = index.add_document("a", docs, vectors)
+    store.write("a", ids, [d["content"] for d in docs])
+    monkeypatch.setattr(retriever, "global_index", index)
+    monkeypatch.setattr(retriever, "bm25_store", store)
+
+    # The query vector is nearest to chunk 0: only keyword search finds the fault code
+    dense_only = retriever.search_documents(vectors[0], ["a"], top_k=1)
+    assert [hit["content"] for hit in dense_only] == [docs[0]["content"]]
+
+    hybrid = retriever.search_documents(vectors[0], ["a"], top_k=2, query="What is E-7731?")
+    assert len(hybrid) == 2
+    assert docs[1]["content"] in [hit["content"] for hit in hybrid]
+    assert all("rrf_score" in hit for hit in hybrid)
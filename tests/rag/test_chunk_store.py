@@ -0,0 +1,34 @@
+# tests/rag/test_chunk_store.py
+import pytest
+from app.rag.chunk_store import ChunkStore
+
+def test_chunk_store_round_trip(tmp_path):
+    path = tmp_path / "chunks.chunks"
+    chunks = {
+        10: {"file_id": "a", "file_name": "a.pdf", "page_number": 0, "content": "first chunk"},
+        12: {"file_id": "a", "file_name": "a.pdf", "page_number": 3, "content": "tiếng Việt ✓"},
+        15: {"file_id": "b", "file_name": "b.pdf", "page_number": 1, "content": ""},
+        20: "bare string chunk",
+    }
+    ChunkStore.write(path, chunks.items())
+    store = ChunkStore(path)
+
+    assert len(store) == 4
+    assert store.get(12) == chunks[12]
+    assert store.get(15) == chunks[15]
+    assert store.get(20) == {"content": "bare string chunk"}, "missing fields are omitted"
+    assert store.get(11) is None and store.get(9) is None and store.get(99) is None
+    assert 10 in store and 11 not in store
+    assert store.strings == ["a", "a.pdf", "b", "b.pdf"], "file ids/names are interned"
+    assert dict(store.items()) == {**chunks, 20: {"content": "bare string chunk"}}
+
+def test_chunk_store_empty_and_invalid(tmp_path):
+    ChunkStore.write(tmp_path / "empty.chunks", [])
+    store = ChunkStore(tmp_path / "empty.chunks")
+    assert len(store) == 0 and store.get(0) is None
+
+    with pytest.raises(ValueError):
+        ChunkStore.write(tmp_path / "bad.chunks", [(0, {"content": "x", "embedding": [1.0]})])
+    (tmp_path / "legacy.pkl").write_bytes(b"\x80\x04not a chunk store")
+    with pytest.raises(ValueError):
+        ChunkStore(tmp_path / "legacy.pkl")
@@ -0,0 +1,254 @@
+# tests/rag/test_global_index.py
+import numpy as np
+import pytest
+from app.rag.global_index import GlobalIndex
+
+def make_docs(file_id: str, n: int) -> list[dict]:
+    return [
+        {"file_id": file_id, "file_name": f"{file_id}.pdf", "page_number": i, "content": f"{file_id} chunk {i}"}
+        for i in range(n)
+    ]
+
+def test_search_is_restricted_to_requested_files(tmp_path):
+    rng = np.random.default_rng(0)
+    index = GlobalIndex(index_dir=tmp_path)
+    emb_a = rng.standard_normal((5, 16)).astype("float32")
+    emb_b = rng.standard_normal((3, 16)).astype("float32")
+    index.add_document("a", make_docs("a", 5), emb_a)
+    index.add_document("b", make_docs("b", 3), emb_b)
+
+    # Query with a vector of "b" but only allow file "a"
+    hits = index.search(emb_b[0], ["a"], top_k=10)[0]
+    assert len(hits) == 5
+    assert all(hit["file_id"] == "a" for hit in hits)
+
+    hits = index.search(emb_b[0], ["a", "b"], top_k=1)[0]
+    assert hits[0]["file_id"] == "b" and hits[0]["distance"] == 0.0
+
+def test_remove_and_reload_from_disk(tmp_path):
+    rng = np.random.default_rng(1)
+    index = GlobalIndex(index_dir=tmp_path)
+    index.add_document("a", make_docs("a", 4), rng.standard_normal((4, 8)).astype("float32"))
+    index.add_document("b", make_docs("b", 2), rng.standard_normal((2, 8)).astype("float32"))
+
+    assert index.remove_document("a") == 4
+    assert index.remove_document("a") == 0
+
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    assert not reloaded.has_document("a")
+    assert reloaded.has_document("b")
+    assert reloaded.index.ntotal == 2
+    assert reloaded.version("a") == 2, "Removal should bump the document version"
+
+def test_reindex_replaces_previous_chunks(tmp_path):
+    rng = np.random.default_rng(2)
+    index = GlobalIndex(index_dir=tmp_path)
+    index.add_document("a", make_docs("a", 4), rng.standard_normal((4, 8)).astype("float32"))
+    index.add_document("a", make_docs("a", 2), rng.standard_normal((2, 8)).astype("float32"))
+
+    assert index.index.ntotal == 2
+    assert len(index.search(np.zeros(8), ["a"], top_k=10)[0]) == 2
+
+def test_auto_index_type_is_upgraded_as_corpus_grows(tmp_path, monkeypatch):
+    from app.rag import index_factory
+    from app.rag.index_factory import index_type_of
+    monkeypatch.setattr(index_factory, "INDEX_IVF_MIN_VECTORS", 500)
+
+    rng = np.random.default_rng(3)
+    index = GlobalIndex(index_dir=tmp_path, index_type="auto")
+    index.add_document("a", make_docs("a", 100), rng.standard_normal((100, 8)).astype("float32"))
+    assert index_type_of(index.index) == "flat"
+
+    emb_b = rng.standard_normal((600, 8)).astype("float32")
+    index.add_document("b", make_docs("b", 600), emb_b)
+    assert index_type_of(index.index) == "ivf_flat"
+    assert index.index.ntotal == 700
+
+    hits = index.search(emb_b[0], ["b"], top_k=1, nprobe=64)[0]
+    assert hits[0]["content"] == "b chunk 0"
+    assert index.remove_document("a") == 100
+
+def test_hnsw_index_supports_removal(tmp_path):
+    rng = np.random.default_rng(4)
+    index = GlobalIndex(index_dir=tmp_path, index_type="hnsw")
+    emb_a = rng.standard_normal((50, 8)).astype("float32")
+    index.add_document("a", make_docs("a", 50), emb_a)
+    index.add_document("b", make_docs("b", 20), rng.standard_normal((20, 8)).astype("float32"))
+
+    assert index.remove_document("b") == 20
+    hits = index.search(emb_a[3], ["a"], top_k=1, ef_search=128)[0]
+    assert hits[0]["content"] == "a chunk 3"
+
+def test_add_document_from_streamed_batches(tmp_path):
+    rng = np.random.default_rng(5)
+    emb = rng.standard_normal((6, 8)).astype("float32")
+    # Batches arrive out of input order, as produced by length-sorted encoding
+    batches = [(np.array([4, 1, 5]), emb[[4, 1, 5]]), (np.array([0, 3, 2]), emb[[0, 3, 2]])]
+
+    index = GlobalIndex(index_dir=tmp_path)
+    index.add_document("a", make_docs("a", 6), iter(batches))
+
+    for i in range(6):
+        assert index.search(emb[i], ["a"], top_k=1)[0][0]["content"] == f"a chunk {i}"
+
+def test_failed_stream_leaves_previous_version_searchable(tmp_path):
+    rng = np.random.default_rng(6)
+    index = GlobalIndex(index_dir=tmp_path)
+    index.add_document("a", make_docs("a", 3), rng.standard_normal((3, 8)).astype("float32"))
+
+    def broken_batches():
+        yield np.array([0]), rng.standard_normal((1, 8)).astype("float32")
+        raise RuntimeError("encoder crashed")
+
+    with pytest.raises(RuntimeError):
+        index.add_document("a", make_docs("a", 2), broken_batches())
+
+    assert index.index.ntotal == 3
+    assert len(index.search(np.zeros(8), ["a"], top_k=10)[0]) == 3
+
+def test_streamed_add_accepts_docs_growing_with_the_batches(tmp_path):
+    rng = np.random.default_rng(3)
+    index = GlobalIndex(index_dir=tmp_path)
+    index.add_document("other", make_docs("other", 2), rng.standard_normal((2, 8)).astype("float32"))
+
+    docs, all_docs = [], make_docs("a", 6)
+    vectors = rng.standard_normal((6, 8)).astype("float32")
+
+    def batches():
+        for start in (0, 3):
+            docs.extend(all_docs[start:start + 3])  # chunks appear as pages are read
+            yield np.arange(start, start + 3), vectors[start:start + 3]
+
+    ids = index.add_document("a", docs, batches())
+    assert len(ids) == 6
+
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    hits = reloaded.search(vectors[4], ["a"], top_k=1)[0]
+    assert hits[0]["content"] == "a chunk 4"
+    assert sorted(reloaded.doc_ids["a"].tolist()) == sorted(ids.tolist())
+
+def test_small_changes_are_replayed_without_rewriting_the_index_file(tmp_path):
+    rng = np.random.default_rng(7)
+    index = GlobalIndex(index_dir=tmp_path, checkpoint_ratio=0.5)
+    emb_a = rng.standard_normal((20, 8)).astype("float32")
+    emb_b = rng.standard_normal((2, 8)).astype("float32")
+    index.add_document("a", make_docs("a", 20), emb_a)
+    checkpointed = index.index_path.read_bytes()
+
+    index.add_document("b", make_docs("b", 2), emb_b)
+    assert index.index_path.read_bytes() == checkpointed
+    assert list(index.segments_dir.glob("*.npz")), "b's vectors should be kept until the next checkpoint"
+
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    reloaded.load()
+    assert reloaded.index.ntotal == 22
+    assert reloaded.search(emb_b[1], ["b"], top_k=1)[0][0]["content"] == "b chunk 1"
+
+    index.checkpoint()
+    assert not list(index.segments_dir.glob("*.npz"))
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    reloaded.load()
+    assert reloaded.index.ntotal == 22
+
+def test_removal_is_replayed_on_load(tmp_path):
+    rng = np.random.default_rng(8)
+    index = GlobalIndex(index_dir=tmp_path, checkpoint_ratio=0.5)
+    index.add_document("a", make_docs("a", 20), rng.standard_normal((20, 8)).astype("float32"))
+    index.add_document("b", make_docs("b", 2), rng.standard_normal((2, 8)).astype("float32"))
+    index.checkpoint()
+
+    index.remove_document("b")
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    reloaded.load()
+    assert reloaded.index.ntotal == 20
+    assert not reloaded.has_document("b")
+    assert reloaded.search(np.zeros(8), ["b"], top_k=5) == [[]]
+
+def test_single_chunk_store_is_migrated_to_segments(tmp_path):
+    import json
+    import faiss
+    from app.rag.chunk_store import ChunkStore
+
+    rng = np.random.default_rng(9)
+    emb = rng.standard_normal((5, 8)).astype("float32")
+    docs = make_docs("a", 3) + make_docs("b", 2)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(8))
+    index.add_with_ids(emb, np.arange(5, dtype="int64"))
+    faiss.write_index(index, str(tmp_path / "global.faiss"))
+    ChunkStore.write(tmp_path / "global.chunks", enumerate(docs))
+    state = {"doc_ids": {"a": [[0, 3]], "b": [[3, 2]]}, "versions": {"a": 1, "b": 1}, "next_id": 5}
+    (tmp_path / "global.json").write_text(json.dumps(state))
+
+    migrated = GlobalIndex(index_dir=tmp_path)
+    assert migrated.search(emb[4], ["b"], top_k=1)[0][0]["content"] == "b chunk 1"
+    assert not (tmp_path / "global.chunks").exists()
+    assert json.loads((tmp_path / "global.json").read_text())["format"] == 2
+    assert GlobalIndex(index_dir=tmp_path).get_chunks([2])[0]["content"] == "a chunk 2"
+
+def test_explicit_ivf_pq_is_not_rebuilt_on_every_upload_below_its_training_minimum(tmp_path, monkeypatch):
+    from app.rag.index_factory import index_type_of
+    rebuilds = []
+    original = GlobalIndex._rebuild
+    monkeypatch.setattr(GlobalIndex, "_rebuild", lambda self, *a, **kw: rebuilds.append(a) or original(self, *a, **kw))
+
+    rng = np.random.default_rng(10)
+    index = GlobalIndex(index_dir=tmp_path, index_type="ivf_pq")
+    index.add_document("first", make_docs("first", 1000), rng.standard_normal((1000, 8)).astype("float32"))
+    # Uploads that stay below both the PQ training minimum and the re-training growth
+    for i in range(6):
+        index.add_document(f"doc{i}", make_docs(f"doc{i}", 100), rng.standard_normal((100, 8)).astype("float32"))
+
+    assert index_type_of(index.index) == "ivf_flat", "too few vectors to train PQ"
+    assert rebuilds == []
+
+def test_ivf_index_is_retrained_as_the_corpus_grows(tmp_path):
+    import faiss
+    from app.rag.index_factory import index_type_of
+    rng = np.random.default_rng(11)
+    index = GlobalIndex(index_dir=tmp_path, index_type="ivf_flat")
+    index.add_document("first", make_docs("first", 100), rng.standard_normal((100, 8)).astype("float32"))
+    assert index.trained_on == 100
+    nlist = faiss.downcast_index(index.index.index).nlist
+
+    index.add_document("second", make_docs("second", 50), rng.standard_normal((50, 8)).astype("float32"))
+    assert index.trained_on == 100, "below the growth factor: not re-trained"
+
+    emb = rng.standard_normal((400, 8)).astype("float32")
+    index.add_document("third", make_docs("third", 400), emb)
+    assert index_type_of(index.index) == "ivf_flat"
+    assert index.trained_on == 550
+    assert faiss.downcast_index(index.index.index).nlist > nlist
+    assert index.search(emb[7], ["third"], top_k=1, nprobe=64)[0][0]["content"] == "third chunk 7"
+
+    reloaded = GlobalIndex(index_dir=tmp_path)
+    reloaded.load()
+    assert reloaded.trained_on == 550
+
+def test_hnsw_removals_are_tombstoned_until_compaction(tmp_path, monkeypatch):
+    from app.rag import global_index as global_index_module
+    monkeypatch.setattr(global_index_module, "INDEX_TOMBSTONE_RATIO", 0.25)
+    rebuilds = []
+    original = GlobalIndex._rebuild
+    monkeypatch.setattr(GlobalIndex, "_rebuild", lambda self, *a, **kw: rebuilds.append(a) or original(self, *a, **kw))
+
+    rng = np.random.default_rng(12)
+    index = GlobalIndex(index_dir=tmp_path, index_type="hnsw")
+    emb_a = rng.standard_normal((50, 8)).astype("float32")
+    emb_b = rng.standard_normal((10, 8)).astype("float32")
+    index.add_document("a", make_docs("a", 50), emb_a)
+    index.add_document("b", make_docs("b", 10), emb_b)
+    index.add_document("c", make_docs("c", 10), rng.standard_normal((10, 8)).astype("float32"))
+
+    assert index.remove_document("b") == 10
+    assert rebuilds == [], "one removal should not rebuild the graph"
+    assert index.index.ntotal == 70
+    hits = index.search(emb_b[0], ["a", "b", "c"], top_k=70, ef_search=128)[0]
+    assert len(hits) == 60 and all(hit["file_id"] != "b" for hit in hits)
+
+    reloaded = GlobalIndex(index_dir=tmp_path, index_type="hnsw")
+    assert reloaded.search(emb_b[0], ["b"], top_k=5) == [[]]
+
+    index.remove_document("c")  # 20 of 70 tombstoned: past the ratio, compacted
+    assert len(rebuilds) == 1
+    assert index.index.ntotal == 50
+    assert index.search(emb_a[3], ["a"], top_k=1, ef_search=128)[0][0]["content"] == "a chunk 3"
@@ -12,7 +12,7 @@ def test_pipeline_runs_with_mock_llm():
     DATA_DIR = Path(f"data_{APP_ENV}") if APP_ENV != "dev" else Path("data")
     file_id = "mock-file-id"
     index_path = DATA_DIR / "index" / f"{file_id}.faiss"
-    meta_path = DATA_DIR / "index" / f"{file_id}.pkl"
+    meta_path = DATA_DIR / "index" / f"{file_id}.chunks"
 
     assert index_path.exists(), f"FAISS index file missing: {index_path}"
     assert meta_path.exists(), f"Metadata file missing: {meta_path}"
@@ -0,0 +1,105 @@
+from app.rag.reranker import Reranker
+
+class CountingCrossEncoder:
+    """Scores a pair by the number of query words found in the chunk."""
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32):
+        self.calls.append((len(pairs), batch_size))
+        return [len(set(q.lower().split()) & set(c.lower().split())) for q, c in pairs]
+
+def make_chunks(distances, contents=None):
+    contents = contents or [f"chunk {i}" for i in range(len(distances))]
+    return [
+        {"chunk_id": i, "content": content, "distance": d}
+        for i, (d, content) in enumerate(zip(distances, contents))
+    ]
+
+def test_rerank_orders_by_cross_encoder_score():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=0, batch_size=8)
+    chunks = make_chunks([0.1, 0.2, 0.3], ["nothing here", "python is great", "python fastapi"])
+
+    top = reranker.rerank("python fastapi", chunks, top_n=2)
+
+    assert [c["chunk_id"] for c in top] == [2, 1]
+    assert model.calls == [(3, 8)]
+
+def test_candidate_cap_and_distance_prefilter_bound_the_scored_pairs():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=3, max_distance_ratio=2.0)
+    chunks = make_chunks([0.5, 0.6, 0.7, 0.9, 1.2, 5.0])
+
+    candidates = reranker.candidates(chunks)
+    assert [c["distance"] for c in candidates] == [0.5, 0.6, 0.7]
+
+    reranker.rerank("chunk", chunks, top_n=2)
+    assert model.calls[0][0] == 3
+
+    reranker.max_candidates = 10
+    assert [c["distance"] for c in reranker.candidates(chunks)] == [0.5, 0.6, 0.7, 0.9]
+
+def test_distance_prefilter_is_skipped_on_an_exact_match():
+    reranker = Reranker(model_fn=CountingCrossEncoder, max_candidates=0, max_distance_ratio=2.0)
+    chunks = make_chunks([0.0, 0.3, 0.6])
+    assert reranker.candidates(chunks) == chunks
+
+def test_scores_are_cached_per_query_and_chunk():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=0)
+    chunks = make_chunks([0.1, 0.2, 0.3])
+
+    first = reranker.rerank("chunk 1", chunks, top_n=2)
+    second = reranker.rerank("chunk 1", chunks, top_n=2)
+
+    assert first == second
+    assert [n for n, _ in model.calls] == [3], "Repeated pairs should not be scored again"
+    reranker.rerank("chunk 2", chunks, top_n=2)
+    assert [n for n, _ in model.calls] == [3, 3], "Another query is scored on its own"
+    assert reranker.stats()["cache_hits"] == 3
+
+def test_cache_is_bounded():
+    reranker = Reranker(model_fn=CountingCrossEncoder, max_candidates=0, cache_size=4)
+    reranker.rerank("chunk", make_chunks([0.1] * 10), top_n=1)
+    assert reranker.stats()["cached_scores"] == 4
+
+def test_early_exit_when_vector_distances_clearly_separate():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=0, early_exit_gap=0.5)
+
+    top = reranker.rerank("chunk", make_chunks([0.1, 0.2, 1.5, 1.6]), top_n=2)
+    assert [c["chunk_id"] for c in top] == [0, 1]
+    assert model.calls == []
+    assert reranker.stats()["early_exits"] == 1
+
+    reranker.rerank("chunk", make_chunks([0.1, 0.2, 0.3, 1.6]), top_n=2)
+    assert len(model.calls) == 1, "Close candidates must still be reranked"
+
+    top = reranker.rerank("chunk 1", make_chunks([0.1, 0.2]), top_n=2)
+    assert len(model.calls) == 2, "With no chunk past the top_n there is no gap: still reranked"
+    assert [c["chunk_id"] for c in top] == [1, 0]
+
+def test_early_exit_gap_is_measured_by_distance_for_fused_order():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=0, early_exit_gap=0.5)
+
+    # RRF order: a far keyword match ranked second. By distance there is no gap after the top 2
+    fused = make_chunks([0.1, 1.6, 0.2, 0.3])
+    reranker.rerank("chunk", fused, top_n=2)
+    assert len(model.calls) == 1, "Close candidates must still be reranked"
+
+    # By distance the top 2 (0.1, 0.2) lead clearly, though fused order interleaves them
+    fused = make_chunks([0.2, 1.5, 0.1, 1.6])
+    top = reranker.rerank("chunk", fused, top_n=2)
+    assert len(model.calls) == 1
+    assert [c["chunk_id"] for c in top] == [2, 0]
+
+def test_legacy_chunks_without_id_are_keyed_by_content():
+    model = CountingCrossEncoder()
+    reranker = Reranker(model_fn=lambda: model, max_candidates=0)
+    chunks = [{"content": "alpha"}, {"content": "beta"}]
+
+    reranker.rerank("alpha", chunks, top_n=1)
+    assert reranker.rerank("alpha", chunks, top_n=1) == [{"content": "alpha"}]
+    assert len(model.calls) == 1
@@ -1,14 +1,17 @@
 # tests/rag/test_retriever.py
 import os
+import shutil
 from pathlib import Path
-from app.rag.retriever import FaissRetriever
+import numpy as np
+import pytest
+from app.rag.retriever import FaissRetriever, RetrieverRegistry, INDEX_DIR, encode_queries, search_indexes, iter_embeddings, EmbeddingCache
 
 def test_retriever_returns_results():
     APP_ENV = os.getenv("APP_ENV", "dev")
     DATA_DIR = Path(f"data_{APP_ENV}") if APP_ENV != "dev" else Path("data")
     file_id = "mock-file-id"
     index_path = DATA_DIR / "index" / f"{file_id}.faiss"
-    meta_path = DATA_DIR / "index" / f"{file_id}.pkl"
+    meta_path = DATA_DIR / "index" / f"{file_id}.chunks"
 
     assert index_path.exists(), f"FAISS index file missing: {index_path}"
     assert meta_path.exists(), f"Metadata file missing: {meta_path}"
@@ -18,7 +21,131 @@ def test_retriever_returns_results():
 
     assert isinstance(results, list), "Results should be a list"
     assert len(results) > 0, "No results returned"
-    assert any("Python" in r or "programming" in r for r in results), \
+    assert any("Python" in r["content"] or "programming" in r["content"] for r in results), \
         "Relevant content not found in results"
 
     print("Retriever test passed. Sample results:", results)
+
+@pytest.mark.usefixtures("build_mock_faiss_index")
+def test_retriever_registry_caches_and_invalidates():
+    registry = RetrieverRegistry(index_dir=INDEX_DIR)
+
+    first = registry.get("mock-file-id")
+    assert registry.get("mock-file-id") is first, "Second lookup should be served from cache"
+
+    registry.invalidate("mock-file-id")
+    assert registry.get("mock-file-id") is not first, "Invalidated entry should be reloaded"
+
+    stats = registry.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["entries"] == 1
+
+@pytest.mark.usefixtures("build_mock_faiss_index")
+def test_retriever_registry_evicts_least_recently_used(tmp_path):
+    for file_id in ("a", "b", "c"):
+        shutil.copy(INDEX_DIR / "mock-file-id.faiss", tmp_path / f"{file_id}.faiss")
+        shutil.copy(INDEX_DIR / "mock-file-id.chunks", tmp_path / f"{file_id}.chunks")
+
+    registry = RetrieverRegistry(index_dir=tmp_path, max_entries=2)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # "b" is now least recently used
+    registry.get("c")
+
+    stats = registry.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    registry.get("a")
+    assert registry.stats()["hits"] == 2, "'a' should have survived eviction"
+
+@pytest.mark.usefixtures("build_mock_faiss_index")
+def test_search_indexes_merges_results_across_files():
+    query_vectors = encode_queries(["What is Python?", "What is FAISS?"])
+
+    single = search_indexes(query_vectors[0], ["mock-file-id", "mock-file-id"], top_k=2, max_workers=2)
+    assert len(single) == 4, "Each file should contribute top_k hits"
+    distances = [hit["distance"] for hit in single]
+    assert distances == sorted(distances), "Merged hits should be sorted by distance"
+
+    batch = search_indexes(query_vectors, ["mock-file-id"], top_k=2)
+    assert len(batch) == 2 and all(len(hits) == 2 for hits in batch)
+
+def test_iter_embeddings_streams_batches_in_input_positions():
+    texts = [f"chunk {'x' * (i % 7)} number {i}" for i in range(25)]
+
+    batches = list(iter_embeddings(texts, batch_size=4, window=10, cache=False))
+    assert len(batches) == 3, "25 texts in windows of 10 -> 3 batches"
+
+    positions = np.concatenate([p for p, _ in batches])
+    assert sorted(positions.tolist()) == list(range(25))
+
+    expected = encode_queries(texts)
+    for pos, emb in batches:
+        np.testing.assert_allclose(emb, expected[pos], rtol=1e-4, atol=1e-5)
+
+def test_embedding_cache_round_trip_and_reopen(tmp_path):
+    texts = ["alpha  beta", "gamma delta", "epsilon"]
+    vectors = encode_queries(texts)
+    cache = EmbeddingCache(tmp_path, "test-model")
+    cache.add(texts, vectors)
+    cache.add(texts[:1], vectors[:1])  # already present: not appended again
+    assert len(cache) == 3
+
+    # Whitespace-normalized text hits; reopening reads keys/vectors back from disk
+    reopened = EmbeddingCache(tmp_path, "test-model")
+    positions, cached = reopened.lookup(["unknown", "alpha beta ", "epsilon"])
+    assert positions == [1, 2]
+    np.testing.assert_allclose(cached, vectors[[0, 2]], atol=1e-2)
+    assert EmbeddingCache(tmp_path, "other-model").lookup(texts)[0] == [], "cache is per model"
+
+def test_embedding_cache_instances_sharing_a_dir_stay_aligned(tmp_path):
+    # Two instances stand in for two worker processes appending to the same cache
+    texts = [f"text {i}" for i in range(6)]
+    vectors = encode_queries(texts)
+    first, second = EmbeddingCache(tmp_path, "test-model"), EmbeddingCache(tmp_path, "test-model")
+    first.add(texts[:3], vectors[:3])
+    second.add(texts[2:5], vectors[2:5])  # picks up first's rows before appending its own
+    first.add(texts[5:], vectors[5:])
+
+    reopened = EmbeddingCache(tmp_path, "test-model")
+    assert len(reopened) == 6
+    positions, cached = reopened.lookup(texts)
+    assert positions == list(range(6))
+    np.testing.assert_allclose(cached, vectors, atol=1e-2)
+
+def test_embedding_cache_starts_over_when_its_files_are_deleted(tmp_path):
+    import shutil
+    texts = ["one", "two", "three"]
+    vectors = encode_queries(texts)
+    cache = EmbeddingCache(tmp_path, "test-model")
+    cache.add(texts[:2], vectors[:2])
+
+    shutil.rmtree(tmp_path / "test-model")
+    cache.add(texts[2:], vectors[2:])
+
+    reopened = EmbeddingCache(tmp_path, "test-model")
+    positions, cached = reopened.lookup(texts)
+    assert positions == [2]
+    np.testing.assert_allclose(cached, vectors[2:], atol=1e-2)
+
+def test_iter_embeddings_only_encodes_cache_misses(tmp_path, monkeypatch):
+    from app.rag import retriever
+    cache = EmbeddingCache(tmp_path, "test-model")
+    texts = [f"chunk number {i}" for i in range(10)]
+    cache.add(texts[:6], encode_queries(texts[:6]))
+
+    model = retriever.get_embed_model()
+    encoded = []
+    original_encode = model.encode
+    monkeypatch.setattr(model, "encode", lambda batch, **kw: encoded.extend(batch) or original_encode(batch, **kw))
+
+    stats = {}
+    batches = list(iter_embeddings(texts, window=4, cache=cache, stats=stats))
+    assert sorted(encoded) == sorted(texts[6:])
+    assert stats == {"cache_hits": 6, "cache_misses": 4}
+    assert len(cache) == 10
+
+    expected = encode_queries(texts)
+    for pos, emb in batches:
+        np.testing.assert_allclose(emb, expected[pos], atol=1e-2)
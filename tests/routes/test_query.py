@@ -7,12 +7,15 @@ from unittest.mock import patch
 client = TestClient(app)
 
 def test_query_route_returns_expected_fields():
-    payload = {"query": "What is Python?", "top_k": 2, "file_id": "mock-file-id"}
-    # Mock handle_query for returning fixed values, avoiding real logic that may cause 500 errors
-    with patch("app.services.chat_service.handle_query") as mock_handle_query:
+    payload = {"query": "What is Python?", "top_k": 2, "file_ids": ["mock-file-id"]}
+    # Mock handle_query_async for returning fixed values, avoiding real logic that may cause 500 errors
+    with patch("app.services.chat_service.handle_query_async") as mock_handle_query:
         mock_handle_query.return_value = {
             "query": payload["query"],
-            "context": ["mocked context 1", "mocked context 2"],
+            "context": [
+                {"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 0, "content": "mocked context 1"},
+                {"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 1, "content": "mocked context 2"},
+            ],
             "answer": "mocked answer"
         }
         response = client.post("/documents/query", json=payload)
@@ -51,12 +54,12 @@ def test_query_route_empty_context(monkeypatch):
     """
     from app.services import chat_service
 
-    def mock_handle_query(query, top_k, file_id=None):
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
         return {"query": query, "context": [], "answer": "No relevant documents found."}
 
-    monkeypatch.setattr(chat_service, "handle_query", mock_handle_query)
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
 
-    payload = {"query": "Random string that matches nothing", "top_k": 2, "file_id": "mock-file-id"}
+    payload = {"query": "Random string that matches nothing", "top_k": 2, "file_ids": ["mock-file-id"]}
     response = client.post("/documents/query", json=payload)
 
     assert response.status_code == 200
@@ -66,19 +69,172 @@ def test_query_route_empty_context(monkeypatch):
 
 def test_query_route_llm_error(monkeypatch):
     """
-    Mock handle_query to raise an exception → should return 500 Internal Server Error
+    Mock handle_query_async to raise an exception → should return 500 Internal Server Error
     """
     from app.services import chat_service
 
-    def mock_handle_query(query, top_k, file_id=None):
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
         raise RuntimeError("LLM service unavailable")
 
-    monkeypatch.setattr(chat_service, "handle_query", mock_handle_query)
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
 
-    payload = {"query": "Test", "top_k": 2, "file_id": "mock-file-id"}
+    payload = {"query": "Test", "top_k": 2, "file_ids": ["mock-file-id"]}
     response = client.post("/documents/query", json=payload)
 
     assert response.status_code == 500
     data = response.json()
     assert "error" in data
     assert "LLM service unavailable" in data["error"]
+
+def test_query_route_forwards_ann_search_knobs(monkeypatch):
+    """
+    nprobe / ef_search from the request are passed through to chat_service
+    """
+    from app.services import chat_service
+    seen = {}
+
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
+        seen.update(kwargs)
+        return {"query": query, "context": [], "answer": "ok"}
+
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
+
+    payload = {"query": "Test", "top_k": 2, "file_ids": ["mock-file-id"], "nprobe": 8, "ef_search": 128}
+    response = client.post("/documents/query", json=payload)
+
+    assert response.status_code == 200
+    assert seen == {"nprobe": 8, "ef_search": 128}
+
+def test_query_route_returns_429_when_a_stage_is_full(monkeypatch):
+    from app.services import chat_service
+    from app.utils.executors import StageBusyError
+
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
+        raise StageBusyError("Too many queries in progress (llm), please retry later.")
+
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
+
+    response = client.post("/documents/query", json={"query": "Test", "top_k": 2, "file_ids": ["mock-file-id"]})
+
+    assert response.status_code == 429
+    assert "retry later" in response.json()["error"]
+
+def test_query_route_times_out_and_cancels_the_query(monkeypatch):
+    import asyncio
+    from app.routes import query as query_route_module
+    from app.services import chat_service
+    state = {}
+
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
+    monkeypatch.setattr(query_route_module, "QUERY_TIMEOUT", 0.05)
+
+    response = client.post("/documents/query", json={"query": "Test", "top_k": 2, "file_ids": ["mock-file-id"]})
+
+    assert response.status_code == 504
+    assert state == {"cancelled": True}
+
+def test_query_route_debug_reports_stage_timings(monkeypatch):
+    from app.services import chat_service
+    from app.utils.timing import span
+
+    async def mock_handle_query(query, top_k, file_ids=None, **kwargs):
+        with span("search"):
+            pass
+        return {"query": query, "context": [], "answer": "ok"}
+
+    monkeypatch.setattr(chat_service, "handle_query_async", mock_handle_query)
+    payload = {"query": "Test", "top_k": 2, "file_ids": ["mock-file-id"]}
+
+    plain = client.post("/documents/query", json=payload)
+    assert plain.json()["timings"] is None
+    assert "server-timing" not in plain.headers
+
+    response = client.post("/documents/query", json={**payload, "debug": True})
+    assert set(response.json()["timings"]) == {"search", "total"}
+    assert response.headers["server-timing"].startswith("search;dur=")
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'rag_stage_duration_seconds_count{pipeline="query",stage="search"}' in metrics.text
+
+def parse_sse(text: str) -> list[tuple[str, dict]]:
+    import json
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_query_stream_sends_context_then_tokens():
+    from app.services.answer_cache import answer_cache
+    answer_cache.clear()
+    context = [{"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 0, "content": "mocked context"}]
+    raw = ["  Python is", " a language.", " Unhelpful ans", "wers: none.", " I don't know."]
+    with patch("app.services.chat_service.search_documents", return_value=context), \
+         patch("app.services.chat_service.rerank_context", return_value=context), \
+         patch("app.services.chat_service.stream_answer", return_value=iter(raw)), \
+         patch("app.services.chat_service.context_filenames", return_value={"mock-file-id": "Report.pdf"}):
+        response = client.post("/documents/query/stream", json={"query": "What?", "file_ids": ["mock-file-id"]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert events[0] == ("context", {
+        "query": "What?", "context": context, "filenames": {"mock-file-id": "Report.pdf"}, "cache": "miss",
+    })
+    streamed = "".join(data["text"] for event, data in events if event == "token")
+    assert streamed == "Python is a language.\nAdditional information: none. I don't know."
+    assert events[-1] == ("done", {"answer": "Python is a language.\nAdditional information: none."})
+
+def test_query_stream_validation_error_is_not_streamed():
+    response = client.post("/documents/query/stream", json={"query": " ", "file_ids": ["mock-file-id"]})
+    assert response.status_code == 500
+    assert "error" in response.json()
+
+def test_query_stream_returns_429_before_streaming_when_a_stage_is_full(monkeypatch):
+    from app.services import chat_service
+    from app.utils.executors import StageBusyError
+
+    async def mock_stream_query(query, top_k, file_ids=None, **kwargs):
+        raise StageBusyError("Too many queries in progress (llm), please retry later.")
+
+    monkeypatch.setattr(chat_service, "stream_query_async", mock_stream_query)
+
+    response = client.post("/documents/query/stream", json={"query": "Test", "file_ids": ["mock-file-id"]})
+
+    assert response.status_code == 429
+    assert "retry later" in response.json()["error"]
+
+def test_query_stream_ends_with_an_error_event_past_the_timeout(monkeypatch):
+    import time
+    from app.routes import query as query_route_module
+    from app.services.answer_cache import answer_cache
+    answer_cache.clear()
+    context = [{"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 0, "content": "mocked context"}]
+    produced = []
+
+    def slow_tokens(query, context_docs):
+        for text in ["one", " two", " three", " four"]:
+            produced.append(text)
+            yield text
+            time.sleep(0.2)
+
+    monkeypatch.setattr(query_route_module, "QUERY_TIMEOUT", 0.3)
+    with patch("app.services.chat_service.search_documents", return_value=context), \
+         patch("app.services.chat_service.rerank_context", return_value=context), \
+         patch("app.services.chat_service.stream_answer", slow_tokens), \
+         patch("app.services.chat_service.context_filenames", return_value={}):
+        response = client.post("/documents/query/stream", json={"query": "Slow?", "file_ids": ["mock-file-id"]})
+        time.sleep(0.5)
+
+    events = parse_sse(response.text)
+    assert events[0][0] == "context"
+    assert events[-1] == ("error", {"error": "Query timed out."})
+    assert len(produced) < 4, "Generation should stop once the stream is abandoned"
@@ -2,10 +2,23 @@
 from fastapi.testclient import TestClient
 from app.main import app
 from app.config import UPLOAD_DIR, INDEX_DIR
+from app.services.catalog import catalog
 import shutil
+import time
+import uuid
 
 client = TestClient(app)
 
+def wait_for_job(job_id: str, timeout: float = 120) -> dict:
+    """Poll the ingestion job until it finishes."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/documents/jobs/{job_id}").json()
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout}s")
+
 # def clean_dirs():
 #     """Ensure upload and index directories are clean before each test."""
 #     for d in [UPLOAD_DIR, INDEX_DIR]:
@@ -39,21 +52,26 @@ def test_upload_pdf(sample_pdf_path):
         )
 
     json_data = response.json()
-    assert response.status_code == 200
-    assert json_data["status"].lower() == "success"
+    assert response.status_code == 202
+    assert json_data["status"].lower() == "queued"
     assert json_data["filename"] == "sample.pdf"
-    assert isinstance(json_data["chunks"], int) and json_data["chunks"] > 0
-    assert json_data["index_path"].endswith(".faiss")
-    assert "uploaded and indexed successfully" in json_data["message"].lower()
+    assert "indexing started" in json_data["message"].lower()
+
+    job = wait_for_job(json_data["job_id"])
+    assert job["state"] == "done", job["error"]
+    assert job["progress"]["chunks_total"] > 0
+    assert job["progress"]["chunks_done"] == job["progress"]["chunks_total"]
 
     # Verify file saved
     file_id = json_data.get("file_id")
     assert file_id is not None
+    assert job["file_id"] == file_id
     assert any(file_id in p.name for p in UPLOAD_DIR.iterdir())
 
     # Verify index files created
     assert any(p.suffix == ".faiss" for p in INDEX_DIR.iterdir())
-    assert any(p.suffix == ".pkl" for p in INDEX_DIR.iterdir())
+    assert (INDEX_DIR / "global.json").exists()
+    assert any(p.suffix == ".chunks" for p in (INDEX_DIR / "global.segments").iterdir())
 
 def test_upload_empty_pdf_should_fail(tmp_path):
     # clean_dirs()
@@ -67,14 +85,17 @@ def test_upload_empty_pdf_should_fail(tmp_path):
             files={"file": ("empty.pdf", f, "application/pdf")}
         )
 
-    json_data = response.json()
-    assert response.status_code in (400, 422)
+    assert response.status_code == 202
+    job = wait_for_job(response.json()["job_id"])
+    assert job["state"] == "failed"
     assert (
-        "empty" in json_data["detail"].lower()
-        or "no text" in json_data["detail"].lower()
-        or "invalid or unreadable pdf" in json_data["detail"].lower()
-        or "eof marker not found" in json_data["detail"].lower()
+        "empty" in job["error"].lower()
+        or "no text" in job["error"].lower()
+        or "invalid or unreadable pdf" in job["error"].lower()
+        or "eof marker not found" in job["error"].lower()
     )
+    # Failed uploads are not kept
+    assert not any(job["file_id"] in p.name for p in UPLOAD_DIR.iterdir())
 
 def test_upload_large_pdf(tmp_path):
     # clean_dirs()
@@ -93,8 +114,93 @@ def test_upload_large_pdf(tmp_path):
             files={"file": ("large.pdf", f, "application/pdf")}
         )
 
-    json_data = response.json()
+    assert response.status_code == 202
+    job = wait_for_job(response.json()["job_id"])
+    assert job["state"] == "done", job["error"]
+    assert job["progress"]["chunks_total"] > 1
+    assert job["progress"]["pages"] == 100
+
+def make_unique_pdf(path):
+    from reportlab.pdfgen import canvas
+    c = canvas.Canvas(str(path))
+    c.drawString(100, 750, f"Unique test document {uuid.uuid4()} about deduplication.")
+    c.save()
+    return path
+
+def test_delete_document(tmp_path):
+    pdf_path = make_unique_pdf(tmp_path / "unique.pdf")
+    with pdf_path.open("rb") as f:
+        response = client.post(
+            "/documents/upload",
+            files={"file": ("unique.pdf", f, "application/pdf")}
+        )
+    file_id = response.json()["file_id"]
+    wait_for_job(response.json()["job_id"])
+
+    response = client.delete(f"/documents/{file_id}")
+    assert response.status_code == 200
+    assert not any(file_id in p.name for p in UPLOAD_DIR.iterdir())
+
+    response = client.delete(f"/documents/{file_id}")
+    assert response.status_code == 404
+
+def test_duplicate_upload_reuses_existing_document(tmp_path):
+    pdf_path = make_unique_pdf(tmp_path / "dup.pdf")
+    with pdf_path.open("rb") as f:
+        first = client.post("/documents/upload", files={"file": ("dup.pdf", f, "application/pdf")})
+    assert wait_for_job(first.json()["job_id"])["state"] == "done"
+    pdfs_before = len(list(UPLOAD_DIR.glob("*.pdf")))
+
+    with pdf_path.open("rb") as f:
+        second = client.post("/documents/upload", files={"file": ("copy.pdf", f, "application/pdf")})
+
+    assert second.status_code == 200
+    json_data = second.json()
+    assert json_data["status"] == "duplicate"
+    assert json_data["file_id"] == first.json()["file_id"]
+    assert json_data["job_id"] is None
+    # The second copy is not kept on disk
+    assert len(list(UPLOAD_DIR.glob("*.pdf"))) == pdfs_before
+
+def test_get_unknown_job_returns_404():
+    response = client.get("/documents/jobs/does-not-exist")
+    assert response.status_code == 404
+
+def test_get_filenames_in_one_call():
+    catalog.add("filenames-test-a", "Alpha.pdf")
+    catalog.add("filenames-test-b", "Beta.pdf")
+    try:
+        response = client.get("/documents/filenames", params={
+            "file_ids": ["filenames-test-a", "filenames-test-b", "unknown-id"],
+        })
+    finally:
+        catalog.remove("filenames-test-a")
+        catalog.remove("filenames-test-b")
+
     assert response.status_code == 200
-    assert json_data["status"].lower() == "success"
-    assert json_data["chunks"] > 1
-    assert json_data["index_path"].endswith(".faiss")
+    assert response.json() == {"filenames": {"filenames-test-a": "Alpha.pdf", "filenames-test-b": "Beta.pdf"}}
+
+def test_batch_upload_reports_each_file(tmp_path):
+    first = make_unique_pdf(tmp_path / "first.pdf")
+    second = make_unique_pdf(tmp_path / "second.pdf")
+    not_pdf = tmp_path / "notes.txt"
+    not_pdf.write_text("not a pdf")
+
+    with first.open("rb") as f1, second.open("rb") as f2, not_pdf.open("rb") as f3:
+        response = client.post("/documents/upload/batch", files=[
+            ("files", ("first.pdf", f1, "application/pdf")),
+            ("files", ("second.pdf", f2, "application/pdf")),
+            ("files", ("notes.txt", f3, "text/plain")),
+        ])
+
+    assert response.status_code == 202
+    data = response.json()
+    assert (data["queued"], data["duplicates"], data["failed"]) == (2, 0, 1)
+    results = data["files"]
+    assert [r["filename"] for r in results] == ["first.pdf", "second.pdf", "notes.txt"]
+    assert results[2]["status"] == "error" and results[2]["status_code"] == 415
+
+    for result in results[:2]:
+        job = wait_for_job(result["job_id"])
+        assert job["state"] == "done", job["error"]
+        assert catalog.filename(result["file_id"]) == result["filename"]
@@ -0,0 +1,43 @@
+# tests/services/test_answer_cache.py
+import numpy as np
+from app.services.answer_cache import AnswerCache
+
+def make_cache(versions: dict, **kwargs) -> AnswerCache:
+    return AnswerCache(versions=lambda f: versions.get(f, 0), enabled=True, **kwargs)
+
+def test_reindexed_document_changes_the_key():
+    versions = {"a": 1}
+    cache = make_cache(versions)
+    cache.put(cache.key("Q?", ["a"], top_k=2), {"answer": "old"})
+    assert cache.get(cache.key("q", ["a"], top_k=2))[1] == "hit"
+
+    versions["a"] = 2
+    assert cache.get(cache.key("q", ["a"], top_k=2)) == (None, "miss")
+
+def test_ttl_and_lru_eviction(monkeypatch):
+    cache = make_cache({}, max_entries=2, ttl=10)
+    clock = [100.0]
+    monkeypatch.setattr("app.services.answer_cache.time.monotonic", lambda: clock[0])
+    for q in ("one", "two"):
+        cache.put(cache.key(q, ["a"]), {"answer": q})
+    cache.get(cache.key("one", ["a"]))  # "two" becomes least recently used
+    cache.put(cache.key("three", ["a"]), {"answer": "three"})
+    assert cache.get(cache.key("two", ["a"]))[1] == "miss"
+    assert cache.stats()["evictions"] == 1
+
+    clock[0] += 11
+    assert cache.get(cache.key("one", ["a"]))[1] == "miss", "expired"
+
+def test_semantic_mode_matches_near_duplicates_in_same_scope():
+    cache = make_cache({}, semantic_threshold=0.95)
+    v = np.array([1.0, 0.0, 0.0], dtype="float32")
+    cache.put(cache.key("what is faiss", ["a"]), {"answer": "a library"}, v)
+
+    near = np.array([1.0, 0.1, 0.0], dtype="float32")
+    far = np.array([0.0, 1.0, 0.0], dtype="float32")
+    assert cache.get(cache.key("whats faiss", ["a"]), near) == ({"answer": "a library"}, "semantic_hit")
+    assert cache.get(cache.key("whats faiss", ["a"]), far)[1] == "miss"
+    assert cache.get(cache.key("whats faiss", ["b"]), near)[1] == "miss", "other documents"
+
+    cache.invalidate("a")
+    assert cache.get(cache.key("whats faiss", ["a"]), near)[1] == "miss"
@@ -0,0 +1,68 @@
+import json
+import threading
+from app.services.catalog import DocumentCatalog
+
+def test_add_get_and_remove(tmp_path):
+    catalog = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+    catalog.add("f1", "report.pdf")
+    catalog.set_content_hash("f1", "abc")
+    catalog.mark_indexed("f1", chunk_count=12, index_version=3)
+
+    row = catalog.get("f1")
+    assert row["filename"] == "report.pdf"
+    assert row["content_hash"] == "abc"
+    assert (row["chunk_count"], row["index_version"]) == (12, 3)
+    assert row["created_at"] <= row["updated_at"]
+    assert catalog.find_by_hash("abc") == "f1"
+
+    assert catalog.remove("f1")
+    assert not catalog.remove("f1")
+    assert catalog.get("f1") is None, "Removal must invalidate the read cache"
+    assert catalog.find_by_hash("abc") is None
+
+def test_cached_reads_see_this_process_writes(tmp_path):
+    catalog = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+    catalog.add("f1", "old.pdf")
+    assert catalog.filename("f1") == "old.pdf"
+    catalog.add("f1", "new.pdf")
+    assert catalog.filename("f1") == "new.pdf"
+
+def test_filenames_batch_lookup(tmp_path):
+    catalog = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+    for i in range(3):
+        catalog.add(f"f{i}", f"doc{i}.pdf")
+    catalog.get("f0")  # one cached, the others read in a single query
+
+    assert catalog.filenames(["f0", "f1", "f2", "missing", "f1"]) == {
+        "f0": "doc0.pdf", "f1": "doc1.pdf", "f2": "doc2.pdf",
+    }
+
+def test_concurrent_writes_lose_nothing(tmp_path):
+    catalog = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+
+    def upload(worker):
+        for i in range(25):
+            catalog.add(f"w{worker}-{i}", f"doc-{worker}-{i}.pdf")
+        catalog.close()
+
+    threads = [threading.Thread(target=upload, args=(w,)) for w in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert catalog.count() == 200
+    assert catalog.filename("w7-24") == "doc-7-24.pdf"
+
+def test_legacy_json_maps_are_imported_once(tmp_path):
+    (tmp_path / "file_map.json").write_text(json.dumps({"f1": "a.pdf", "f2": "b.pdf"}), encoding="utf-8")
+    (tmp_path / "hash_map.json").write_text(json.dumps({"h2": "f2"}), encoding="utf-8")
+
+    catalog = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+    assert catalog.filename("f1") == "a.pdf"
+    assert catalog.find_by_hash("h2") == "f2"
+
+    catalog.remove("f1")
+    reopened = DocumentCatalog(db_path=tmp_path / "catalog.sqlite3", legacy_dir=tmp_path)
+    assert reopened.get("f1") is None, "A removed document must not be re-imported"
+    assert reopened.count() == 1
@@ -1,56 +1,150 @@
+import asyncio
+import threading
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, ANY
 from app.services import chat_service
+from app.services.answer_cache import answer_cache
+
+@pytest.fixture(autouse=True)
+def empty_answer_cache():
+    answer_cache.clear()
+    yield
+    answer_cache.clear()
 
 # ===== UNIT TEST (mock retriever + LLM) =====
 
 @pytest.fixture
 def mock_context():
     return [
-        "Document snippet 1 about Python.",
-        "Document snippet 2 about FastAPI.",
-        "Document snippet 3 about testing."
+        {"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 0, "content": "Document snippet 1 about Python."},
+        {"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 0, "content": "Document snippet 2 about FastAPI."},
+        {"file_id": "mock-file-id", "file_name": "a.pdf", "page_number": 1, "content": "Document snippet 3 about testing."},
     ]
 
 @pytest.fixture
 def mock_answer():
     return "This is a mocked LLM answer."
 
+@pytest.fixture
+def passthrough_rerank():
+    with patch("app.services.chat_service.rerank_context", side_effect=lambda q, docs, top_n: docs[:top_n]):
+        with patch("app.services.chat_service.encode_queries", return_value=[[0.0, 0.0]]):
+            yield
+
+@pytest.mark.usefixtures("passthrough_rerank")
 def test_handle_query_returns_expected_keys(mock_context, mock_answer):
     """
     UNIT TEST: Ensure handle_query returns dict with correct keys and values when dependencies are mocked.
     """
-    with patch("app.services.chat_service.get_relevant_context_for_file", return_value=mock_context):
+    with patch("app.services.chat_service.search_documents", return_value=mock_context):
         with patch("app.services.chat_service.generate_answer", return_value=mock_answer):
-            result = chat_service.handle_query("What is FastAPI?", file_id="mock-file-id")
+            result = chat_service.handle_query("What is FastAPI?", top_k=3, file_ids=["mock-file-id"])
 
     assert isinstance(result, dict)
-    assert set(result.keys()) == {"query", "context", "answer"}
+    assert set(result.keys()) == {"query", "context", "filenames", "answer", "cache"}
     assert result["query"] == "What is FastAPI?"
     assert result["context"] == mock_context
     assert result["answer"] == mock_answer
 
+@pytest.mark.usefixtures("passthrough_rerank")
 def test_handle_query_calls_dependencies_with_correct_args(mock_context, mock_answer):
     """
-    UNIT TEST: Verify get_relevant_context and generate_answer are called with correct arguments.
+    UNIT TEST: Verify the query is encoded once and all file indexes are searched in one call.
     """
-    with patch("app.services.chat_service.get_relevant_context_for_file", return_value=mock_context) as mock_retriever:
+    with patch("app.services.chat_service.search_documents", return_value=mock_context) as mock_search:
         with patch("app.services.chat_service.generate_answer", return_value=mock_answer) as mock_llm:
-            chat_service.handle_query("Explain pytest", top_k=5, file_id="mock-file-id")
+            chat_service.handle_query("Explain pytest", top_k=5, file_ids=["file-a", "file-b"])
 
-    mock_retriever.assert_called_once_with("Explain pytest", "mock-file-id", top_k=5)
+    chat_service.encode_queries.assert_called_once_with(["Explain pytest"])
+    mock_search.assert_called_once_with(
+        ANY, ["file-a", "file-b"], top_k=5, nprobe=None, ef_search=None, query="Explain pytest",
+    )
     mock_llm.assert_called_once_with("Explain pytest", mock_context)
 
+@pytest.mark.usefixtures("passthrough_rerank")
 def test_handle_query_with_empty_results(mock_answer):
     """
     UNIT TEST: Handle case where retriever returns no documents.
     """
-    with patch("app.services.chat_service.get_relevant_context_for_file", return_value=[]):
+    with patch("app.services.chat_service.search_documents", return_value=[]):
         with patch("app.services.chat_service.generate_answer", return_value=mock_answer):
-            result = chat_service.handle_query("Unknown topic", file_id="mock-file-id")
+            result = chat_service.handle_query("Unknown topic", file_ids=["mock-file-id"])
 
     assert result["context"] == []
-    assert result["answer"] == mock_answer
+    assert result["answer"] == "I don't know"
+
+@pytest.mark.usefixtures("passthrough_rerank")
+def test_handle_query_serves_repeated_questions_from_cache(mock_context, mock_answer):
+    with patch("app.services.chat_service.search_documents", return_value=mock_context) as mock_search:
+        with patch("app.services.chat_service.generate_answer", return_value=mock_answer) as mock_llm:
+            first = chat_service.handle_query("What is FastAPI?", top_k=3, file_ids=["b", "a"])
+            second = chat_service.handle_query("  what is  FASTAPI ", top_k=3, file_ids=["a", "b"])
+            other_k = chat_service.handle_query("What is FastAPI?", top_k=2, file_ids=["a", "b"])
+
+    assert (first["cache"], second["cache"], other_k["cache"]) == ("miss", "hit", "miss")
+    assert second["answer"] == mock_answer and second["query"] == "  what is  FASTAPI "
+    assert mock_search.call_count == 2 and mock_llm.call_count == 2
+
+    answer_cache.invalidate("a")
+    with patch("app.services.chat_service.search_documents", return_value=mock_context):
+        with patch("app.services.chat_service.generate_answer", return_value=mock_answer):
+            assert chat_service.handle_query("What is FastAPI?", top_k=3, file_ids=["a", "b"])["cache"] == "miss"
+
+@pytest.mark.usefixtures("passthrough_rerank")
+def test_handle_query_async_matches_handle_query(mock_context):
+    with patch("app.services.chat_service.search_documents", return_value=mock_context):
+        with patch("app.services.chat_service.stream_answer", return_value=iter(["FastAPI is ", "a web framework."])):
+            result = asyncio.run(chat_service.handle_query_async("What is FastAPI?", top_k=3, file_ids=["mock-file-id"]))
+
+    assert set(result.keys()) == {"query", "context", "filenames", "answer", "cache"}
+    assert result["context"] == mock_context
+    assert result["answer"] == "FastAPI is a web framework."
+    assert result["cache"] == "miss"
+
+def test_generation_stops_once_cancelled(mock_context):
+    cancelled = threading.Event()
+    produced = []
+
+    def tokens():
+        for text in ["one ", "two ", "three"]:
+            produced.append(text)
+            cancelled.set()  # the request goes away while the first token is produced
+            yield text
+
+    with patch("app.services.chat_service.stream_answer", return_value=tokens()):
+        assert chat_service._generate_until_cancelled("q", mock_context, cancelled) is None
+    assert produced == ["one "]
+
+def slow_tokens(produced: list):
+    import time
+
+    def tokens(query, context_docs):
+        for i in range(20):
+            produced.append(i)
+            yield f"token{i} "
+            time.sleep(0.02)
+    return tokens
+
+@pytest.mark.parametrize("events_read", [1, 0])
+@pytest.mark.usefixtures("passthrough_rerank")
+def test_closing_the_stream_stops_generation(mock_context, events_read):
+    produced = []
+
+    async def scenario():
+        stream = await chat_service.stream_query_async("What?", top_k=3, file_ids=["mock-file-id"])
+        events = [await stream.__anext__() for _ in range(events_read)]
+        await stream.aclose()  # client gone right after the context event, or before any
+        await asyncio.sleep(0.1)
+        stopped_at = len(produced)
+        await asyncio.sleep(0.2)
+        return events, stopped_at
+
+    with patch("app.services.chat_service.search_documents", return_value=mock_context), \
+         patch("app.services.chat_service.stream_answer", slow_tokens(produced)):
+        events, stopped_at = asyncio.run(scenario())
+
+    assert [event for event, _ in events] == ["context"] * events_read
+    assert len(produced) == stopped_at < 20, "Generation should stop once the stream is closed"
 
 # ===== INTEGRATION TEST (mock index thật) =====
 
@@ -62,10 +156,10 @@ def test_handle_query_integration_with_mock_index():
     """
     fake_answer = "Mocked integration answer."
     with patch("app.services.chat_service.generate_answer", return_value=fake_answer):
-        result = chat_service.handle_query("What is Python?", top_k=2, file_id="mock-file-id")
+        result = chat_service.handle_query("What is Python?", top_k=2, file_ids=["mock-file-id"])
 
     assert isinstance(result["context"], list)
     assert len(result["context"]) > 0
     assert result["answer"] == fake_answer
     # Ensure that the returned context contains relevant text
-    assert any("Python" in doc for doc in result["context"])
+    assert any("Python" in doc["content"] for doc in result["context"])
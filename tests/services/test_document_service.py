@@ -1,4 +1,5 @@
 from pathlib import Path
+import hashlib
 import os
 import shutil
 import pytest
@@ -36,9 +37,23 @@ def test_save_upload_file(tmp_path):
     file_path.write_bytes(b"%PDF-1.4 sample pdf content")
 
     upload_file = UploadFile(filename="sample.pdf", file=open(file_path, "rb"))
-    saved_path, file_id = document_service.save_upload_file(upload_file, upload_dir=UPLOAD_DIR)
+    saved_path, file_id, content_hash = document_service.save_upload_file(upload_file, upload_dir=UPLOAD_DIR)
     assert saved_path.exists()
     assert file_id is not None
+    assert content_hash == hashlib.sha256(b"%PDF-1.4 sample pdf content").hexdigest()
+    assert saved_path.read_bytes() == b"%PDF-1.4 sample pdf content"
+
+def test_save_upload_file_rejects_oversized_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_service, "UPLOAD_CHUNK_SIZE", 1024)
+    file_path = tmp_path / "big.pdf"
+    file_path.write_bytes(b"x" * 10_000)
+
+    upload_file = UploadFile(filename="big.pdf", file=open(file_path, "rb"))
+    with pytest.raises(document_service.UploadTooLargeError):
+        document_service.save_upload_file(upload_file, upload_dir=UPLOAD_DIR, max_bytes=4096)
+
+    # Neither the final file nor the temp file is left behind
+    assert list(UPLOAD_DIR.iterdir()) == []
 
 def test_extract_text(tmp_path):
     sample_pdf_path = Path("tests/resources/sample.pdf")
@@ -52,7 +67,7 @@ def test_extract_text(tmp_path):
 def test_create_faiss_index_and_save(tmp_path):
     docs = ["This is a test document.", "Another document for indexing."]
     index_path = INDEX_DIR / "test_index.faiss"
-    metadata_path = INDEX_DIR / "test_index.pkl"
+    metadata_path = INDEX_DIR / "test_index.chunks"
 
     document_service.create_faiss_index_and_save(docs, index_path, metadata_path)
 
@@ -66,13 +81,13 @@ def test_full_document_process(tmp_path):
 
     with open(sample_pdf_path, "rb") as f:
         upload_file = UploadFile(filename="sample.pdf", file=f)
-        saved_path, file_id = document_service.save_upload_file(upload_file, upload_dir=UPLOAD_DIR)
+        saved_path, file_id, _ = document_service.save_upload_file(upload_file, upload_dir=UPLOAD_DIR)
 
     text = pdf_parser.extract_text_chunks(saved_path)
     docs = document_service.split_text_to_docs(text)
 
     index_path = INDEX_DIR / "sample_index.faiss"
-    metadata_path = INDEX_DIR / "sample_index.pkl"
+    metadata_path = INDEX_DIR / "sample_index.chunks"
 
     document_service.create_faiss_index_and_save(docs, index_path, metadata_path)
 
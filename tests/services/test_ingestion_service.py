@@ -0,0 +1,82 @@
+import threading
+import pytest
+from unittest.mock import patch
+from app.services.ingestion_service import JobManager, QueueFullError
+from app.utils.timing import span
+
+def wait(manager: JobManager, job_id: str) -> dict:
+    for _ in range(200):
+        job = manager.get(job_id)
+        if job["state"] in ("done", "failed"):
+            return job
+        threading.Event().wait(0.01)
+    raise TimeoutError(job_id)
+
+def test_job_reports_progress_and_completion(tmp_path):
+    def fake_process(file_path, file_id, progress=None):
+        progress({"stage": "embedding", "pages": 2, "chunks_total": 3})
+        progress({"chunks_done": 3})
+        with span("write", pipeline="ingest"):
+            pass
+        return None, None, [{"content": "a"}, {"content": "b"}, {"content": "c"}]
+
+    manager = JobManager(max_workers=1, max_queue=1)
+    with patch("app.services.ingestion_service.document_service.process_and_index_document", fake_process):
+        job = manager.submit(tmp_path / "a.pdf", "file-a", "a.pdf")
+        job = wait(manager, job["job_id"])
+
+    assert job["state"] == "done"
+    assert job["progress"]["pages"] == 2
+    assert job["progress"]["chunks_done"] == 3
+    assert set(job["timings"]) == {"write", "total"}
+    assert manager.stats()["active"] == 0
+
+def test_failed_job_records_error_and_cleans_up(tmp_path):
+    def fake_process(file_path, file_id, progress=None):
+        raise ValueError("Empty or no text extracted from PDF.")
+
+    manager = JobManager(max_workers=1, max_queue=1)
+    with patch("app.services.ingestion_service.document_service.process_and_index_document", fake_process), \
+         patch("app.services.ingestion_service.document_service.delete_document") as mock_delete:
+        job = wait(manager, manager.submit(tmp_path / "a.pdf", "file-a", "a.pdf")["job_id"])
+
+    assert job["state"] == "failed"
+    assert "no text" in job["error"]
+    mock_delete.assert_called_once_with("file-a")
+
+def test_queue_limit_rejects_extra_uploads(tmp_path):
+    release = threading.Event()
+
+    def blocking_process(file_path, file_id, progress=None):
+        release.wait(5)
+        return None, None, []
+
+    manager = JobManager(max_workers=1, max_queue=1)
+    with patch("app.services.ingestion_service.document_service.process_and_index_document", blocking_process):
+        manager.submit(tmp_path / "a.pdf", "a", "a.pdf")  # running
+        manager.submit(tmp_path / "b.pdf", "b", "b.pdf")  # queued
+        assert not manager.has_capacity()
+        with pytest.raises(QueueFullError):
+            manager.submit(tmp_path / "c.pdf", "c", "c.pdf")
+        release.set()
+        manager.shutdown()
+
+def test_same_content_in_flight_is_not_queued_twice(tmp_path):
+    release = threading.Event()
+
+    def blocking_process(file_path, file_id, progress=None):
+        release.wait(5)
+        return None, None, []
+
+    manager = JobManager(max_workers=1, max_queue=4)
+    with patch("app.services.ingestion_service.document_service.process_and_index_document", blocking_process), \
+         patch("app.services.ingestion_service.document_service.register_content_hash") as mock_register:
+        first = manager.submit(tmp_path / "a.pdf", "a", "a.pdf", content_hash="abc")
+        second = manager.submit(tmp_path / "b.pdf", "b", "b.pdf", content_hash="abc")
+        assert second["duplicate"] is True
+        assert second["job_id"] == first["job_id"]
+        assert manager.stats()["active"] == 1
+
+        release.set()
+        wait(manager, first["job_id"])
+    mock_register.assert_called_once_with("abc", "a")
@@ -1,10 +1,10 @@
 import faiss
-import pickle
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from app.rag.chunk_store import ChunkStore
 
 load_dotenv()
 
@@ -14,7 +14,7 @@ DATA_DIR = Path(f"data_{APP_ENV}") if APP_ENV != "dev" else Path("data")
 INDEX_DIR = DATA_DIR / "index"
 FILE_ID = "mock-file-id"
 FAISS_PATH = INDEX_DIR / f"{FILE_ID}.faiss"
-META_PATH = INDEX_DIR / f"{FILE_ID}.pkl"
+META_PATH = INDEX_DIR / f"{FILE_ID}.chunks"
 
 def build_mock_index():
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
@@ -33,8 +33,7 @@ def build_mock_index():
     index = faiss.IndexFlatL2(dim)
     index.add(np.array(embeddings))
 
-    with open(META_PATH, "wb") as f:
-        pickle.dump(docs, f)
+    ChunkStore.write(META_PATH, enumerate({"content": doc} for doc in docs))
 
     faiss.write_index(index, str(FAISS_PATH))
     print(f"Mock index saved to {FAISS_PATH}")
@@ -0,0 +1,78 @@
+import threading
+import pytest
+from app.utils.batching import MicroBatcher
+
+class RecordingFn:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, items):
+        self.calls.append(list(items))
+        return [item * 10 for item in items]
+
+def submit_concurrently(batcher, requests):
+    results = [None] * len(requests)
+    barrier = threading.Barrier(len(requests))
+
+    def run(i):
+        barrier.wait()
+        results[i] = batcher.submit(requests[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_concurrent_requests_share_one_call_and_get_their_own_results():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_wait=0.2, max_batch=100)
+    requests = [[i, i + 100] for i in range(8)]
+
+    results = submit_concurrently(batcher, requests)
+
+    assert results == [[i * 10, (i + 100) * 10] for i in range(8)]
+    assert len(fn.calls) < len(requests), "Concurrent requests should be batched"
+    assert sum(map(len, fn.calls)) == 16
+    stats = batcher.stats()
+    assert stats["requests"] == 8 and stats["items"] == 16
+    assert sum(stats["batch_size_histogram"].values()) == stats["batches"]
+
+def test_batch_is_closed_at_max_batch_items():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_wait=0.2, max_batch=4)
+    submit_concurrently(batcher, [[i] for i in range(8)])
+    assert all(len(call) <= 4 for call in fn.calls)
+
+def test_errors_reach_every_caller_of_the_batch():
+    def failing(items):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(failing, max_wait=0.05, max_batch=10)
+    with pytest.raises(RuntimeError, match="crashed"):
+        batcher.submit([1])
+
+def test_disabled_batcher_calls_fn_directly():
+    fn = RecordingFn()
+    batcher = MicroBatcher(fn, max_wait=0, max_batch=10)
+    assert batcher.submit([1, 2]) == [10, 20]
+    assert batcher.submit([]) == []
+    assert fn.calls == [[1, 2]]
+    assert batcher.stats()["batch_size_histogram"] == {"<=2": 1}
+
+def test_merged_batch_is_sorted_by_key_and_results_restored():
+    calls = []
+
+    def lengths(items):
+        calls.append(list(items))
+        return [len(item) for item in items]
+
+    batcher = MicroBatcher(lengths, max_wait=0.2, max_batch=100, sort_key=len)
+    requests = [["xxxx", "x"], ["xxx", "xx", "xxxxx"], ["xxxxxx"]]
+
+    results = submit_concurrently(batcher, requests)
+
+    assert results == [[4, 1], [3, 2, 5], [6]]
+    assert all(call == sorted(call, key=len) for call in calls if len(call) > 3)
+    assert any(len(call) > 3 for call in calls), "Concurrent requests should be batched"
@@ -0,0 +1,43 @@
+# tests/utils/test_chunker.py
+import pytest
+from app.utils.chunker import chunk_pages
+
+def words(n: int, prefix: str) -> str:
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+def word_count(pieces: list[str]) -> list[int]:
+    return [1] * len(pieces)
+
+def test_chunks_respect_size_and_overlap():
+    pages = [{"page_number": 0, "content": words(100, "w")}]
+    chunks = list(chunk_pages(pages, chunk_size=30, chunk_overlap=5, length_fn=word_count))
+
+    assert all(len(c["content"].split()) <= 30 for c in chunks)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert prev["content"].split()[-5:] == nxt["content"].split()[:5], "consecutive chunks overlap"
+    covered = set(w for c in chunks for w in c["content"].split())
+    assert covered == set(words(100, "w").split()), "no text is lost"
+
+def test_chunk_spanning_pages_keeps_page_range():
+    pages = [
+        {"page_number": 0, "content": words(20, "a")},
+        {"page_number": 1, "content": ""},
+        {"page_number": 2, "content": words(20, "c")},
+    ]
+    chunks = list(chunk_pages(iter(pages), chunk_size=30, chunk_overlap=0, length_fn=word_count))
+
+    assert chunks[0]["page_number"] == 0 and chunks[0]["page_end"] == 2
+    assert "a19\nc0" in chunks[0]["content"], "words of consecutive pages stay separated"
+    assert chunks[-1]["page_number"] == 2 and chunks[-1]["page_end"] == 2
+
+def test_chunks_prefer_sentence_boundaries():
+    text = "First sentence has five words. " * 2 + words(40, "x")
+    chunks = list(chunk_pages([{"page_number": 0, "content": text}], chunk_size=12, chunk_overlap=0,
+                              length_fn=word_count))
+    assert chunks[0]["content"] == "First sentence has five words. First sentence has five words."
+
+def test_char_sized_chunks_and_invalid_overlap():
+    chunks = list(chunk_pages([{"page_number": 3, "content": "lorem ipsum " * 200}], chunk_size=100, chunk_overlap=10))
+    assert len(chunks) > 1 and all(len(c["content"]) <= 100 for c in chunks)
+    with pytest.raises(ValueError):
+        list(chunk_pages([], chunk_size=10, chunk_overlap=10))
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import pytest
+from app.utils.executors import StageExecutor, StageBusyError
+
+def test_run_returns_the_result():
+    executor = StageExecutor("test", max_workers=2, max_queue=0)
+    assert asyncio.run(executor.run(lambda a, b=0: a + b, 2, b=3)) == 5
+    assert executor.stats()["completed"] == 1
+    executor.shutdown()
+
+def test_full_stage_rejects_instead_of_queueing():
+    executor = StageExecutor("test", max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(StageBusyError):
+            await executor.run(lambda: "rejected")
+        release.set()
+        return await running, await queued
+
+    assert asyncio.run(scenario()) == (True, "queued")
+    stats = executor.stats()
+    assert stats["rejected"] == 1 and stats["active"] == 0
+    executor.shutdown()
+
+def test_cancelled_call_never_runs_if_still_queued():
+    executor = StageExecutor("test", max_workers=1, max_queue=4)
+    release = threading.Event()
+    ran = []
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(ran.append, "queued"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+
+    asyncio.run(scenario())
+    executor.shutdown(); executor._executor.shutdown(wait=True)
+    assert ran == []
+    assert executor.stats()["cancelled"] == 1
+
+def test_submit_admits_the_call_before_it_is_awaited():
+    executor = StageExecutor("test", max_workers=1, max_queue=0)
+    release = threading.Event()
+
+    async def scenario():
+        running = executor.submit(release.wait)
+        with pytest.raises(StageBusyError):
+            executor.submit(lambda: "rejected")
+        release.set()
+        return await running
+
+    assert asyncio.run(scenario()) is True
+    executor.shutdown()
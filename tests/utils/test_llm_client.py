@@ -1,4 +1,5 @@
-from app.utils.llm_client import get_default_llm
+import pytest
+from app.utils.llm_client import get_default_llm, LLMEngine, ContextPacker
 
 def test_mock_llm_generate():
     llm = get_default_llm()
@@ -6,3 +7,104 @@ def test_mock_llm_generate():
     context_docs = ["Python is a programming language.", "It is used for many applications."]
     result = llm.generate(question, context_docs)
     assert isinstance(result, str)
+
+class CountingLLM:
+    instances = 0
+
+    def __init__(self):
+        CountingLLM.instances += 1
+
+    def generate(self, question: str, context_docs: list[str]) -> str:
+        return f"answer to {question}"
+
+def test_llm_engine_loads_model_once_and_reports_ready():
+    CountingLLM.instances = 0
+    engine = LLMEngine(factory=CountingLLM)
+    assert not engine.is_ready()
+
+    engine.warmup()
+    assert engine.is_ready()
+    assert engine.generate("q1", ["ctx"]) == "answer to q1"
+    assert engine.generate("q2", ["ctx"]) == "answer to q2"
+    assert CountingLLM.instances == 1, "Model should be constructed only once"
+
+def test_llm_engine_rejects_when_busy():
+    engine = LLMEngine(factory=CountingLLM, max_concurrency=1, acquire_timeout=0.01)
+    engine._gate.acquire()  # simulate an in-flight generation
+    try:
+        with pytest.raises(RuntimeError, match="busy"):
+            engine.generate("q", ["ctx"])
+    finally:
+        engine._gate.release()
+
+def test_llm_engine_failed_load_is_reported():
+    def broken_factory():
+        raise OSError("model file missing")
+
+    engine = LLMEngine(factory=broken_factory)
+    engine.warmup()
+    assert engine.state == "failed"
+    assert "model file missing" in engine.error
+
+class WordTokenizer:
+    """One token per whitespace-separated word; counts encode() calls."""
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=True):
+        self.calls += 1
+        return ([0] if add_special_tokens else []) + text.split()
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(ids)
+
+def test_context_packer_budget_includes_template_and_truncates_last_doc():
+    tok = WordTokenizer()
+    packer = ContextPacker(tok, template="Context: {context} Question: {question}", min_partial_tokens=3)
+    docs = [" ".join(f"d{i}w{j}" for j in range(10)) for i in range(3)]
+    # overhead = BOS + "Context:" + "Question:" + 2 question words = 5 -> 20 tokens left for context
+    context = packer.pack(docs, "what now", max_tokens=25)
+
+    assert context.split("\n")[:2] == [docs[0], docs[1]]
+    assert context == docs[0] + "\n" + docs[1] + "\n"
+    partial = packer.pack(docs, "what now", max_tokens=30)
+    assert partial.endswith("d2w0 d2w1 d2w2 d2w3\n"), "last doc is cut to the remaining budget"
+
+def test_stored_token_counts_are_only_trusted_for_the_current_tokenizer():
+    from app.config import LLM_TOKENIZER_NAME
+    from app.utils.llm_client import stored_token_counts
+    docs = [
+        {"content": "a", "n_tokens": 5, "tokenizer": LLM_TOKENIZER_NAME},
+        {"content": "b", "n_tokens": 7, "tokenizer": "some/older-tokenizer"},
+        {"content": "c", "n_tokens": 9},  # stored before counts were tagged
+        {"content": "d"},
+    ]
+    assert stored_token_counts(docs) == [5, None, None, None]
+
+def test_context_packer_tokenizes_each_doc_once():
+    tok = WordTokenizer()
+    packer = ContextPacker(tok, template="{context}{question}")
+    docs = [f"doc number {i}" for i in range(50)]
+    packer.pack(docs, "q", max_tokens=10_000)
+    packer.pack(docs, "q", max_tokens=10_000)
+    assert tok.calls == 50 + 2, "docs are counted once (memoized), plus one overhead per call"
+
+    tok.calls = 0
+    context = packer.pack(["x y", "a b c"], "q", max_tokens=100, token_counts=[2, 3], scores=[0.1, 0.9])
+    assert context == "a b c\nx y\n", "packed by descending score"
+    assert tok.calls == 1, "stored token counts skip tokenization"
+
+@pytest.mark.parametrize("answer", [
+    "  Plain answer.  ",
+    "Answer one. Unhelpful answers: other stuff",
+    "Python is great. I don't know.",
+    "I don't know",
+    "UNHELPFUL ANSWERS:   later text. I don't know",
+])
+def test_answer_cleaner_streaming_matches_clean_llm_answer(answer):
+    from app.utils.llm_client import AnswerCleaner, clean_llm_answer
+    cleaner = AnswerCleaner()
+    streamed = "".join(cleaner.feed(answer[i:i + 3]) for i in range(0, len(answer), 3)) + cleaner.finish()
+
+    assert cleaner.answer == clean_llm_answer(answer)
+    assert streamed.startswith(cleaner.answer), "only the trailing 'I don't know' rule removes streamed text"
@@ -0,0 +1,65 @@
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from app.utils.model_provider import LazyModel, ModelProvider
+
+def test_lazy_model_loads_once_under_concurrent_first_use():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)  # slow load: every thread arrives while it runs
+        return object()
+
+    model = LazyModel("slow", factory)
+    assert not model.is_loaded() and model.state == "idle"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(model.get())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1, "Model should be constructed only once"
+    assert all(r is results[0] for r in results)
+    assert model.state == "ready" and model.load_seconds is not None
+
+def test_lazy_model_failed_load_is_reported_and_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("offline and not cached")
+        return "model"
+
+    model = LazyModel("flaky", factory)
+    with pytest.raises(OSError):
+        model.get()
+    assert model.state == "failed" and "offline" in model.error
+
+    assert model.get() == "model"
+    assert model.state == "ready" and model.error is None
+
+def test_provider_warmup_loads_everything_and_survives_failures():
+    provider = ModelProvider()
+    provider.register("ok", lambda: "model")
+    provider.register("broken", lambda: 1 / 0)
+    assert not provider.is_ready()
+
+    provider.warmup()
+    stats = provider.stats()
+    assert stats["ok"]["state"] == "ready"
+    assert stats["broken"]["state"] == "failed"
+    assert not provider.is_ready()
+
+def test_importing_the_app_loads_no_model():
+    code = (
+        "import app.main\n"
+        "from app.utils.model_provider import model_provider\n"
+        "assert not any(s['state'] != 'idle' for s in model_provider.stats().values()), model_provider.stats()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
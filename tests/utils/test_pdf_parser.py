@@ -0,0 +1,60 @@
+# tests/utils/test_pdf_parser.py
+from reportlab.pdfgen import canvas
+from app.utils.pdf_parser import iter_pages, stop_extract_pool
+
+def make_pdf(path, n_pages: int):
+    c = canvas.Canvas(str(path))
+    for i in range(n_pages):
+        c.drawString(100, 750, f"Text of page {i}.")
+        c.showPage()
+    c.save()
+    return path
+
+def test_parallel_extraction_yields_pages_in_order(tmp_path):
+    pdf_path = make_pdf(tmp_path / "pages.pdf", 23)
+    try:
+        parallel = list(iter_pages(pdf_path, workers=2, pages_per_task=4, page_timeout=30))
+    finally:
+        stop_extract_pool()
+    serial = list(iter_pages(pdf_path, workers=1))
+
+    assert [p["page_number"] for p in parallel] == list(range(23))
+    assert parallel == serial
+    assert "Text of page 17." in parallel[17]["content"]
+
+def test_hung_task_retires_only_its_pool(tmp_path):
+    import time
+    from app.utils import pdf_parser
+
+    pool = pdf_parser._get_extract_pool(2)
+    try:
+        hung = pool.submit(time.sleep, 600)
+        other = pool.submit(time.sleep, 1)  # another job's task, running on the second worker
+        time.sleep(0.5)
+        pdf_parser._retire_extract_pool(pool, hung)
+
+        assert pdf_parser._get_extract_pool(2) is not pool, "new tasks should go to a fresh pool"
+        assert pool.submit(time.sleep, 0) is None
+        assert other.result(timeout=30) is None, "tasks already on the retired pool should still finish"
+        # Then the hung worker is terminated: its future fails instead of blocking forever
+        for _ in range(100):
+            if hung.done():
+                break
+            time.sleep(0.1)
+        assert hung.done()
+    finally:
+        pool.shutdown()
+        stop_extract_pool()
+
+def test_extraction_still_works_after_a_pool_was_retired(tmp_path):
+    import time
+    from app.utils import pdf_parser
+
+    pool = pdf_parser._get_extract_pool(2)
+    pdf_parser._retire_extract_pool(pool, pool.submit(time.sleep, 600))
+    pdf_path = make_pdf(tmp_path / "pages.pdf", 9)
+    try:
+        pages = list(iter_pages(pdf_path, workers=2, pages_per_task=4, page_timeout=30))
+    finally:
+        stop_extract_pool()
+    assert [p["page_number"] for p in pages] == list(range(9))
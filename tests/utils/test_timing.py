@@ -0,0 +1,58 @@
+import time
+from app.utils.timing import Histogram, record_timings, span, timed_iter
+
+def test_nested_spans_are_exclusive():
+    with record_timings("test") as timings:
+        with span("outer"):
+            time.sleep(0.02)
+            with span("inner"):
+                time.sleep(0.05)
+
+    assert timings.stages["inner"] >= 0.05
+    assert 0.02 <= timings.stages["outer"] < timings.stages["inner"]
+    assert timings.total >= timings.stages["outer"] + timings.stages["inner"]
+
+def test_timed_iter_excludes_consumer_and_records_once():
+    def produce():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    with record_timings("test") as timings:
+        for _ in timed_iter(produce(), "produce"):
+            time.sleep(0.05)  # consumer work is not the producer's
+
+    assert 0.03 <= timings.stages["produce"] < 0.15
+
+def test_spans_of_nested_iterators_split_pipeline_time():
+    def pages():
+        for i in range(2):
+            time.sleep(0.02)
+            yield i
+
+    def chunks(items):
+        for item in items:
+            time.sleep(0.01)
+            yield item
+
+    with record_timings("test") as timings:
+        list(timed_iter(chunks(timed_iter(pages(), "parse")), "chunk"))
+
+    assert timings.stages["parse"] >= 0.04
+    assert 0.02 <= timings.stages["chunk"] < timings.stages["parse"]
+
+def test_histogram_renders_prometheus_text():
+    histogram = Histogram("demo_seconds", "Demo.", buckets=[0.1, 1])
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+
+    assert histogram.render() == [
+        "# HELP demo_seconds Demo.",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{stage="a",le="0.1"} 1',
+        'demo_seconds_bucket{stage="a",le="1"} 2',
+        'demo_seconds_bucket{stage="a",le="+Inf"} 3',
+        'demo_seconds_sum{stage="a"} 5.550000',
+        'demo_seconds_count{stage="a"} 3',
+    ]